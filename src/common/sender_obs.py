@@ -174,7 +174,11 @@ def _mi_metric_conn_min_latency(mi):
             return latency
         else:
             return 0.0
-        
+
+# Drops the minimum latency remembered for a sender, so that long-lived
+# processes don't accumulate an entry for every connection they have served.
+def forget_sender(sender_id):
+    _conn_min_latencies.pop(sender_id, None)
     
 def _mi_metric_send_ratio(mi):
     thpt = mi.get("recv rate")
@@ -206,3 +210,76 @@ SENDER_MI_METRICS = [
 ]
 
 
+
+# Vectorized versions of the metrics above, for rebuilding observations from
+# logged monitor intervals in bulk. mis is a dict of equal-length arrays as
+# returned by shim_recording.load_columns, where the MIs of each flow are in
+# order and "flow" identifies the flow. These must stay in step with the
+# per-MI metric functions.
+def _safe_div(num, den, default):
+    den_ok = den > 0.0
+    return np.where(den_ok, num / np.where(den_ok, den, 1.0), default)
+
+def batch_mi_metrics(mis):
+    n_rtt = mis["n_rtt"]
+    half = n_rtt // 2
+    send_dur = mis["send_end"] - mis["send_start"]
+    recv_dur = mis["recv_end"] - mis["recv_start"]
+    acked = mis["bytes_acked"].astype(np.float64)
+    lost = mis["bytes_lost"].astype(np.float64)
+    metrics = {}
+    metrics["send dur"] = send_dur
+    metrics["recv dur"] = recv_dur
+    metrics["send rate"] = _safe_div(8.0 * mis["bytes_sent"], send_dur, 0.0)
+    metrics["recv rate"] = _safe_div(8.0 * (acked - mis["packet_size"]), recv_dur, 0.0)
+    metrics["avg latency"] = _safe_div(mis["rtt_sum"], n_rtt.astype(np.float64), 0.0)
+    metrics["loss ratio"] = _safe_div(lost, lost + acked, 0.0)
+    metrics["latency increase"] = np.where(half >= 1,
+        _safe_div(mis["rtt_second_half_sum"], (n_rtt - half).astype(np.float64), 0.0)
+        - _safe_div(mis["rtt_first_half_sum"], half.astype(np.float64), 0.0), 0.0)
+    metrics["ack latency inflation"] = _safe_div(metrics["latency increase"], recv_dur, 0.0)
+    metrics["sent latency inflation"] = _safe_div(metrics["latency increase"], send_dur, 0.0)
+
+    # Running minimum of the positive latencies within each flow.
+    latency = metrics["avg latency"]
+    min_latency = np.where(latency > 0.0, latency, np.inf)
+    flow = mis["flow"]
+    bounds = np.flatnonzero(np.diff(flow)) + 1
+    for segment in np.split(np.arange(len(flow)), bounds):
+        if len(segment) > 0:
+            min_latency[segment] = np.minimum.accumulate(min_latency[segment])
+    min_latency[np.isinf(min_latency)] = 0.0
+    metrics["conn min latency"] = min_latency
+
+    thpt = metrics["recv rate"]
+    send_rate = metrics["send rate"]
+    metrics["send ratio"] = np.where((thpt > 0.0) & (send_rate < 1000.0 * thpt),
+                                     _safe_div(send_rate, thpt, 1.0), 1.0)
+    metrics["latency ratio"] = _safe_div(latency, min_latency, 1.0)
+    return metrics
+
+# Returns an (n_mis, len(features)) array of scaled features, like
+# SenderMonitorInterval.as_array for each MI.
+def batch_features(mis, features):
+    metrics = batch_mi_metrics(mis)
+    return np.stack([metrics[f] / SenderMonitorIntervalMetric.get_by_name(f).scale
+                     for f in features], axis=1)
+
+# Returns the SenderHistory observation after each MI in [start, end), as a
+# float32 array of shape (end - start, history_len * n_features). Each flow's
+# history starts out filled with empty monitor intervals.
+def batch_history(feature_rows, flow, history_len, features, start=0, end=None):
+    if end is None:
+        end = len(feature_rows)
+    empty_row = SenderMonitorInterval(None).as_array(features)
+    n_features = feature_rows.shape[1]
+    flow_start = np.ones(len(flow), dtype=bool)
+    flow_start[1:] = flow[1:] != flow[:-1]
+    start_index = np.maximum.accumulate(np.where(flow_start, np.arange(len(flow)), 0))
+    index = np.arange(start, end)
+    offsets = np.arange(1 - history_len, 1)[None, :]
+    rows = index[:, None] + offsets
+    padded = rows < start_index[index][:, None]
+    obs = feature_rows[np.maximum(rows, 0)].astype(np.float32)
+    obs[padded] = empty_row
+    return obs.reshape(len(index), history_len * n_features)
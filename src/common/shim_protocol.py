@@ -0,0 +1,158 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array
+import socket
+import struct
+import sys
+
+# Length-prefixed binary protocol between the online training shim
+# (udt-plugins/training/shim.py) and ShimNetworkEnv. Every frame is
+#
+#   magic (u16) | version (u8) | message type (u8) | payload length (u32)
+#
+# followed by the payload. An MI payload holds the fixed monitor interval
+# fields followed by all of its RTT samples as packed float64 values, so large
+# intervals are never truncated. A RATE payload is a single float64 rate in
+# Mbps. All values are little-endian.
+
+MAGIC = 0x5043
+VERSION = 1
+
+MSG_MI = 1
+MSG_RATE = 2
+
+FRAME_HEADER = struct.Struct("<HBBI")
+MI_FIELDS = struct.Struct("<iqqqddddidI")
+RATE = struct.Struct("<d")
+
+def _pack_rtts(rtt_samples):
+    rtts = array.array("d", rtt_samples)
+    if sys.byteorder != "little":
+        rtts.byteswap()
+    return rtts.tobytes()
+
+def _unpack_rtts(buf, offset, n_rtt):
+    rtts = array.array("d")
+    rtts.frombytes(bytes(buf[offset:offset + 8 * n_rtt]))
+    if sys.byteorder != "little":
+        rtts.byteswap()
+    return rtts.tolist()
+
+def frame(msg_type, payload):
+    return FRAME_HEADER.pack(MAGIC, VERSION, msg_type, len(payload)) + payload
+
+def encode_mi(flow_id, bytes_sent, bytes_acked, bytes_lost, send_start_time,
+              send_end_time, recv_start_time, recv_end_time, rtt_samples,
+              packet_size, utility):
+    rtts = _pack_rtts(rtt_samples)
+    return frame(MSG_MI, MI_FIELDS.pack(flow_id, bytes_sent, bytes_acked,
+        bytes_lost, send_start_time, send_end_time, recv_start_time,
+        recv_end_time, packet_size, utility, len(rtts) // 8) + rtts)
+
+# Returns the MI fields in the order give_sample takes them.
+def decode_mi(payload):
+    (flow_id, bytes_sent, bytes_acked, bytes_lost, send_start_time,
+     send_end_time, recv_start_time, recv_end_time, packet_size, utility,
+     n_rtt) = MI_FIELDS.unpack_from(payload, 0)
+    if len(payload) != MI_FIELDS.size + 8 * n_rtt:
+        raise ValueError("MI frame of %d bytes does not hold %d RTT samples"
+                         % (len(payload), n_rtt))
+    rtt_samples = _unpack_rtts(payload, MI_FIELDS.size, n_rtt)
+    return (flow_id, bytes_sent, bytes_acked, bytes_lost, send_start_time,
+            send_end_time, recv_start_time, recv_end_time, rtt_samples,
+            packet_size, utility)
+
+def encode_rate(rate):
+    return frame(MSG_RATE, RATE.pack(rate))
+
+def decode_rate(payload):
+    return RATE.unpack(payload)[0]
+
+def recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    received = 0
+    while received < n:
+        count = sock.recv_into(view[received:], n - received)
+        if count == 0:
+            raise ConnectionError("Connection closed mid-frame")
+        received += count
+    return buf
+
+def _check_header(header):
+    magic, version, msg_type, length = FRAME_HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("Bad frame magic 0x%x" % magic)
+    if version != VERSION:
+        raise ValueError("Unsupported shim protocol version %d" % version)
+    return msg_type, length
+
+# Reads one frame and returns (msg_type, payload).
+def recv_frame(sock):
+    msg_type, length = _check_header(recv_exact(sock, FRAME_HEADER.size))
+    return msg_type, recv_exact(sock, length)
+
+# The same for asyncio servers reading from a StreamReader.
+async def read_frame(reader):
+    msg_type, length = _check_header(await reader.readexactly(FRAME_HEADER.size))
+    return msg_type, await reader.readexactly(length)
+
+def recv_message(sock, expected_type):
+    msg_type, payload = recv_frame(sock)
+    if msg_type != expected_type:
+        raise ValueError("Expected message type %d, got %d" % (expected_type, msg_type))
+    return payload
+
+def send_rate(sock, rate):
+    sock.sendall(encode_rate(rate))
+
+def recv_rate(sock):
+    return decode_rate(recv_message(sock, MSG_RATE))
+
+def send_mi(sock, *mi_fields):
+    sock.sendall(encode_mi(*mi_fields))
+
+def recv_mi(sock):
+    return decode_mi(recv_message(sock, MSG_MI))
+
+# Wraps a connected socket in the same interface as shim_ring.ShimRing, so
+# both ends can switch transports without changing their send/recv calls.
+class SocketChannel():
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def send_rate(self, rate):
+        send_rate(self.sock, rate)
+
+    def recv_rate(self):
+        return recv_rate(self.sock)
+
+    def send_mi(self, *mi_fields):
+        send_mi(self.sock, *mi_fields)
+
+    def recv_mi(self):
+        return recv_mi(self.sock)
+
+    # Wakes a thread blocked in recv_rate or recv_mi, which then raises, so
+    # that it can be joined before close.
+    def shutdown(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        self.sock.close()
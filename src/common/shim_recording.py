@@ -0,0 +1,226 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mmap
+import struct
+import time
+
+import numpy as np
+
+from common import shim_protocol
+
+# Append-only recordings of online shim sessions. A recording file starts with
+# a short header and then holds shim_protocol frames in the order the trainer
+# saw them: every RATE frame it sent and every MI frame it got back, with a
+# SESSION frame (holding the wall clock time) whenever a new sender connects
+# and an empty RESET frame whenever the trainer resets the environment.
+# Recordings from several runs can be appended to the same file. A frame cut
+# short by a crash ends the recording without an error.
+
+RECORDING_MAGIC = b"PCCSHIMREC"
+RECORDING_VERSION = 1
+RECORDING_HEADER = struct.Struct("<10sH")
+
+MSG_SESSION = 16
+SESSION = struct.Struct("<d")
+MSG_RESET = 17
+
+class ShimRecorder():
+
+    def __init__(self, path, flush_every=64):
+        self.path = path
+        self.flush_every = flush_every
+        self.n_unflushed = 0
+        self.f = open(path, "ab")
+        if self.f.tell() == 0:
+            self.f.write(RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION))
+
+    def _write(self, data):
+        self.f.write(data)
+        self.n_unflushed += 1
+        if self.n_unflushed >= self.flush_every:
+            self.flush()
+
+    def start_session(self):
+        self._write(shim_protocol.frame(MSG_SESSION, SESSION.pack(time.time())))
+        self.flush()
+
+    def record_reset(self):
+        self._write(shim_protocol.frame(MSG_RESET, b""))
+
+    def record_rate(self, rate):
+        self._write(shim_protocol.encode_rate(rate))
+
+    def record_mi(self, *mi_fields):
+        self._write(shim_protocol.encode_mi(*mi_fields))
+
+    def flush(self):
+        self.f.flush()
+        self.n_unflushed = 0
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+# Yields (msg_type, value) for every complete frame in the recording. The value
+# is the session start time, the rate, the MI fields in give_sample order, or
+# None for a reset.
+def read_recording(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version = RECORDING_HEADER.unpack_from(data, 0)
+    if magic != RECORDING_MAGIC:
+        raise ValueError("%s is not a shim recording" % path)
+    if version != RECORDING_VERSION:
+        raise ValueError("Unsupported shim recording version %d" % version)
+    view = memoryview(data)
+    pos = RECORDING_HEADER.size
+    header_size = shim_protocol.FRAME_HEADER.size
+    while pos + header_size <= len(data):
+        msg_type, length = shim_protocol._check_header(view[pos:pos + header_size])
+        pos += header_size
+        if pos + length > len(data):
+            break
+        payload = view[pos:pos + length]
+        pos += length
+        if msg_type == MSG_SESSION:
+            yield msg_type, SESSION.unpack(payload)[0]
+        elif msg_type == MSG_RESET:
+            yield msg_type, None
+        elif msg_type == shim_protocol.MSG_RATE:
+            yield msg_type, shim_protocol.decode_rate(payload)
+        elif msg_type == shim_protocol.MSG_MI:
+            yield msg_type, shim_protocol.decode_mi(payload)
+
+# Splits a recording into its sessions, each a list of the trainer's
+# episodes, and each episode a list of (rate, mi_fields) pairs where the MI was
+# measured at the rate before it. Episodes end at every reset. Sessions
+# recorded before resets were are split every unmarked_len steps instead, if
+# given.
+def load_sessions(path, unmarked_len=None):
+    sessions = []
+    rate = None
+    for msg_type, value in read_recording(path):
+        if msg_type == MSG_SESSION:
+            sessions.append({"marked":False, "episodes":[[]]})
+            rate = None
+        elif len(sessions) == 0:
+            continue
+        elif msg_type == MSG_RESET:
+            sessions[-1]["marked"] = True
+            sessions[-1]["episodes"].append([])
+            rate = None
+        elif msg_type == shim_protocol.MSG_RATE:
+            rate = value
+        elif rate is not None:
+            sessions[-1]["episodes"][-1].append((rate, value))
+            rate = None
+    result = []
+    for session in sessions:
+        episodes = []
+        for steps in session["episodes"]:
+            if not session["marked"] and unmarked_len is not None:
+                episodes += [steps[start:start + unmarked_len]
+                             for start in range(0, len(steps), unmarked_len)]
+            else:
+                episodes.append(steps)
+        episodes = [steps for steps in episodes if len(steps) > 0]
+        if len(episodes) > 0:
+            result.append(episodes)
+    return result
+
+# The episodes of every session in a recording, in order.
+def load_episodes(path, unmarked_len=None):
+    return [steps for session in load_sessions(path, unmarked_len) for steps in session]
+
+# Loads a recording as NumPy columns, one entry per recorded MI, for bulk
+# processing of long recordings. RTT samples are reduced to their count and to
+# the sums of all, the first half and the second half of them, which is all
+# that the sender_obs features need. MIs are keyed by flow as
+# (session number, flow_id), and "flow" holds an index into the returned
+# list of flow keys.
+def load_columns(path):
+    int_fields = ["bytes_sent", "bytes_acked", "bytes_lost", "packet_size"]
+    float_fields = ["rate", "send_start", "send_end", "recv_start", "recv_end", "utility"]
+    columns = {}
+    for name in int_fields + float_fields + ["flow"]:
+        columns[name] = []
+    rtt_chunks = []
+    n_rtts = []
+    flow_keys = []
+    flow_lookup = {}
+    session = -1
+    rate = None
+
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version = RECORDING_HEADER.unpack_from(data, 0)
+    if magic != RECORDING_MAGIC:
+        raise ValueError("%s is not a shim recording" % path)
+    if version != RECORDING_VERSION:
+        raise ValueError("Unsupported shim recording version %d" % version)
+    pos = RECORDING_HEADER.size
+    header_size = shim_protocol.FRAME_HEADER.size
+    mi_size = shim_protocol.MI_FIELDS.size
+    while pos + header_size <= len(data):
+        msg_type, length = shim_protocol._check_header(data[pos:pos + header_size])
+        pos += header_size
+        if pos + length > len(data):
+            break
+        if msg_type == MSG_SESSION:
+            session += 1
+            rate = None
+        elif msg_type == shim_protocol.MSG_RATE:
+            rate = shim_protocol.RATE.unpack_from(data, pos)[0]
+        elif msg_type == shim_protocol.MSG_MI and rate is not None:
+            (flow_id, bytes_sent, bytes_acked, bytes_lost, send_start, send_end,
+             recv_start, recv_end, packet_size, utility,
+             n_rtt) = shim_protocol.MI_FIELDS.unpack_from(data, pos)
+            key = (session, flow_id)
+            if key not in flow_lookup:
+                flow_lookup[key] = len(flow_keys)
+                flow_keys.append(key)
+            columns["flow"].append(flow_lookup[key])
+            columns["rate"].append(rate)
+            columns["bytes_sent"].append(bytes_sent)
+            columns["bytes_acked"].append(bytes_acked)
+            columns["bytes_lost"].append(bytes_lost)
+            columns["send_start"].append(send_start)
+            columns["send_end"].append(send_end)
+            columns["recv_start"].append(recv_start)
+            columns["recv_end"].append(recv_end)
+            columns["packet_size"].append(packet_size)
+            columns["utility"].append(utility)
+            rtt_chunks.append(data[pos + mi_size:pos + mi_size + 8 * n_rtt])
+            n_rtts.append(n_rtt)
+            rate = None
+        pos += length
+    data.close()
+
+    result = {}
+    for name in int_fields + ["flow"]:
+        result[name] = np.array(columns[name], dtype=np.int64)
+    for name in float_fields:
+        result[name] = np.array(columns[name], dtype=np.float64)
+    n_rtt = np.array(n_rtts, dtype=np.int64)
+    rtts = np.frombuffer(b"".join(rtt_chunks), dtype="<f8")
+    cumsum = np.concatenate([[0.0], np.cumsum(rtts)])
+    ends = np.cumsum(n_rtt)
+    starts = ends - n_rtt
+    mids = starts + n_rtt // 2
+    result["n_rtt"] = n_rtt
+    result["rtt_sum"] = cumsum[ends] - cumsum[starts]
+    result["rtt_first_half_sum"] = cumsum[mids] - cumsum[starts]
+    result["rtt_second_half_sum"] = cumsum[ends] - cumsum[mids]
+    return result, flow_keys
@@ -0,0 +1,272 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mmap
+import os
+import select
+import struct
+import tempfile
+import time
+
+from common import shim_protocol
+
+# Same-host transport between the online training shim and ShimNetworkEnv.
+# Both sides map one shared memory segment holding two single-producer,
+# single-consumer byte rings: one carrying MI frames from the shim to the
+# trainer and one carrying RATE frames back. The frames are exactly those of
+# shim_protocol, so only the transport changes.
+#
+# A reader first spins on the ring for a short while, which is where the
+# reply almost always arrives in the rate/MI ping-pong. Only if the ring stays
+# empty does it mark itself waiting and sleep on a named FIFO, which the
+# writer pokes after publishing data. The sleep uses a short timeout, so a
+# wake-up lost to a race costs at most that timeout.
+
+RING_MAGIC = 0x50434352
+RING_VERSION = 1
+
+# magic (u32) | version (u32) | capacity (u32) | attached (u32) | closed (u32)
+SEGMENT_HEADER = struct.Struct("<IIIII")
+# head (u64, written by the producer) | tail (u64, written by the consumer) |
+# waiting (u32, written by the consumer)
+RING_HEADER = struct.Struct("<QQI")
+RING_HEADER_SIZE = 64
+
+ATTACHED_OFFSET = 12
+CLOSED_OFFSET = 16
+HEAD_OFFSET = 0
+TAIL_OFFSET = 8
+WAITING_OFFSET = 16
+
+DEFAULT_CAPACITY = 1 << 20
+SPIN_TIME = 0.0002
+SLEEP_TIMEOUT = 0.005
+
+def default_name(port=9787):
+    return "pcc_shim_%d" % port
+
+# The segment is a plain file in /dev/shm (a RAM-backed tmpfs on Linux),
+# mapped by both processes.
+def _segment_path(name):
+    if os.path.isdir("/dev/shm"):
+        return os.path.join("/dev/shm", name)
+    return os.path.join(tempfile.gettempdir(), name)
+
+def _fifo_path(name, direction):
+    return os.path.join(tempfile.gettempdir(), "%s.%s" % (name, direction))
+
+def _get_u64(buf, offset):
+    return struct.unpack_from("<Q", buf, offset)[0]
+
+def _set_u64(buf, offset, value):
+    struct.pack_into("<Q", buf, offset, value)
+
+def _get_u32(buf, offset):
+    return struct.unpack_from("<I", buf, offset)[0]
+
+def _set_u32(buf, offset, value):
+    struct.pack_into("<I", buf, offset, value)
+
+class SpscRing():
+
+    def __init__(self, buf, header_offset, data_offset, capacity, doorbell_fd, segment):
+        self.buf = buf
+        self.header = header_offset
+        self.data = data_offset
+        self.capacity = capacity
+        self.doorbell_fd = doorbell_fd
+        self.segment = segment
+
+    def _head(self):
+        return _get_u64(self.buf, self.header + HEAD_OFFSET)
+
+    def _tail(self):
+        return _get_u64(self.buf, self.header + TAIL_OFFSET)
+
+    def _copy_in(self, pos, data):
+        start = pos % self.capacity
+        first = min(len(data), self.capacity - start)
+        self.buf[self.data + start:self.data + start + first] = data[:first]
+        if first < len(data):
+            self.buf[self.data:self.data + len(data) - first] = data[first:]
+
+    def _copy_out(self, pos, out, n):
+        start = pos % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self.buf[self.data + start:self.data + start + first]
+        if first < n:
+            out[first:n] = self.buf[self.data:self.data + n - first]
+
+    def _ring_doorbell(self):
+        if _get_u32(self.buf, self.header + WAITING_OFFSET):
+            try:
+                os.write(self.doorbell_fd, b"\0")
+            except BlockingIOError:
+                pass # The FIFO is full of pending wake-ups already.
+
+    # Frames larger than the ring are written in pieces as the reader frees
+    # space, which only happens for extremely large MIs.
+    def write(self, data):
+        data = memoryview(data)
+        written = 0
+        while written < len(data):
+            head = self._head()
+            free = self.capacity - (head - self._tail())
+            if free == 0:
+                self.segment.check_open()
+                time.sleep(0)
+                continue
+            n = min(free, len(data) - written)
+            self._copy_in(head, data[written:written + n])
+            _set_u64(self.buf, self.header + HEAD_OFFSET, head + n)
+            written += n
+            self._ring_doorbell()
+
+    def _wait_for_data(self, tail):
+        spin_until = time.perf_counter() + SPIN_TIME
+        while time.perf_counter() < spin_until:
+            if self._head() != tail:
+                return
+            # Yield so that the writer can run even on a single core.
+            os.sched_yield()
+        _set_u32(self.buf, self.header + WAITING_OFFSET, 1)
+        try:
+            while self._head() == tail:
+                self.segment.check_open()
+                readable, _, _ = select.select([self.doorbell_fd], [], [], SLEEP_TIMEOUT)
+                if readable:
+                    try:
+                        os.read(self.doorbell_fd, 4096)
+                    except BlockingIOError:
+                        pass
+        finally:
+            _set_u32(self.buf, self.header + WAITING_OFFSET, 0)
+
+    def read_exact(self, n):
+        out = bytearray(n)
+        view = memoryview(out)
+        received = 0
+        while received < n:
+            tail = self._tail()
+            avail = self._head() - tail
+            if avail == 0:
+                self._wait_for_data(tail)
+                continue
+            count = min(avail, n - received)
+            self._copy_out(tail, view[received:], count)
+            _set_u64(self.buf, self.header + TAIL_OFFSET, tail + count)
+            received += count
+        return out
+
+class ShimRing():
+
+    def __init__(self, name, owner):
+        self.name = name
+        self.owner = owner
+        with open(_segment_path(name), "r+b") as f:
+            self.mm = mmap.mmap(f.fileno(), 0)
+        self.buf = memoryview(self.mm)
+        buf = self.buf
+        magic, version, capacity, _, _ = SEGMENT_HEADER.unpack_from(buf, 0)
+        if magic != RING_MAGIC:
+            raise ValueError("%s is not a shim ring" % name)
+        if version != RING_VERSION:
+            raise ValueError("Unsupported shim ring version %d" % version)
+        self.capacity = capacity
+        self.mi_fd = os.open(_fifo_path(name, "mi"), os.O_RDWR | os.O_NONBLOCK)
+        self.rate_fd = os.open(_fifo_path(name, "rate"), os.O_RDWR | os.O_NONBLOCK)
+        mi_header = RING_HEADER_SIZE
+        rate_header = 2 * RING_HEADER_SIZE
+        data = 3 * RING_HEADER_SIZE
+        self.mi_ring = SpscRing(buf, mi_header, data, capacity, self.mi_fd, self)
+        self.rate_ring = SpscRing(buf, rate_header, data + capacity, capacity,
+                                  self.rate_fd, self)
+
+    # Called by the trainer. Replaces any segment left behind by an earlier run.
+    def create(name=default_name(), capacity=DEFAULT_CAPACITY):
+        for direction in ["mi", "rate"]:
+            path = _fifo_path(name, direction)
+            if os.path.exists(path):
+                os.unlink(path)
+            os.mkfifo(path)
+        # Write the header to a new file and rename it into place, so a shim
+        # never maps a half-initialized segment.
+        path = _segment_path(name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SEGMENT_HEADER.pack(RING_MAGIC, RING_VERSION, capacity, 0, 0))
+            f.truncate(3 * RING_HEADER_SIZE + 2 * capacity)
+        os.replace(tmp_path, path)
+        return ShimRing(name, True)
+
+    # Called by the shim. Raises FileNotFoundError if no trainer created the
+    # ring, and ConnectionError if another flow is already using it.
+    def attach(name=default_name()):
+        ring = ShimRing(name, False)
+        if _get_u32(ring.buf, ATTACHED_OFFSET):
+            ring.close()
+            raise ConnectionError("Shim ring %s already has a sender" % name)
+        _set_u32(ring.buf, ATTACHED_OFFSET, 1)
+        os.write(ring.mi_fd, b"\0")
+        return ring
+
+    def is_attached(self):
+        return _get_u32(self.buf, ATTACHED_OFFSET) != 0
+
+    def check_open(self):
+        if _get_u32(self.buf, CLOSED_OFFSET):
+            raise ConnectionError("Shim ring %s was closed" % self.name)
+
+    def send_rate(self, rate):
+        self.rate_ring.write(shim_protocol.encode_rate(rate))
+
+    def recv_rate(self):
+        return shim_protocol.decode_rate(self._recv_message(self.rate_ring, shim_protocol.MSG_RATE))
+
+    def send_mi(self, *mi_fields):
+        self.mi_ring.write(shim_protocol.encode_mi(*mi_fields))
+
+    def recv_mi(self):
+        return shim_protocol.decode_mi(self._recv_message(self.mi_ring, shim_protocol.MSG_MI))
+
+    def _recv_message(self, ring, expected_type):
+        msg_type, length = shim_protocol._check_header(ring.read_exact(shim_protocol.FRAME_HEADER.size))
+        payload = ring.read_exact(length)
+        if msg_type != expected_type:
+            raise ValueError("Expected message type %d, got %d" % (expected_type, msg_type))
+        return payload
+
+    # Marks the ring closed and rings both doorbells, so that a thread
+    # blocked in recv_rate or recv_mi raises ConnectionError and can be joined
+    # before close releases the segment.
+    def shutdown(self):
+        _set_u32(self.buf, CLOSED_OFFSET, 1)
+        for fd in [self.mi_fd, self.rate_fd]:
+            try:
+                os.write(fd, b"\0")
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        self.shutdown()
+        for fd in [self.mi_fd, self.rate_fd]:
+            os.close(fd)
+        self.mi_ring = None
+        self.rate_ring = None
+        self.buf.release()
+        self.mm.close()
+        if self.owner:
+            os.unlink(_segment_path(self.name))
+            for direction in ["mi", "rate"]:
+                os.unlink(_fifo_path(self.name, direction))
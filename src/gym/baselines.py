@@ -0,0 +1,259 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+
+# Classic congestion controllers for the simulator, to compare trained
+# policies against. A controller sees the same monitor intervals as a policy:
+# after every MI, SimulatedNetworkEnv calls on_mi with the sender and its
+# SenderMonitorInterval, and the controller sets the rate (and window) for
+# the next MI through Sender.set_rate and Sender.set_cwnd. Rates are in
+# packets per second, as in Sender; MI rates are in bits per second. The
+# window-based controllers (aimd-window and bbr) put their sender in window
+# mode with Sender.set_cwnd_mode on every reset, so it is limited by its
+# window as well as paced by its rate, whatever the simulator's USE_CWND.
+#
+# They follow the published algorithms at MI granularity rather than per
+# packet, so they are reference points on the simulator's link model, not
+# faithful reimplementations.
+
+BYTES_PER_PACKET = 1500
+
+def mi_rate_to_packets(bits_per_second):
+    return bits_per_second / (8.0 * BYTES_PER_PACKET)
+
+def packets_to_mbps(packets_per_second):
+    return packets_per_second * 8.0 * BYTES_PER_PACKET / 1e6
+
+class Controller():
+
+    def reset(self, sender):
+        pass
+
+    def on_mi(self, sender, mi):
+        raise NotImplementedError
+
+# Additive increase, multiplicative decrease. In rate mode the rate grows by
+# `increase` packets/s per MI and halves on loss. In window mode the window
+# grows by one packet per RTT and halves on loss, and the rate paces the
+# window over the minimum RTT. After a decrease, losses are ignored for one
+# RTT, since those packets were sent before it.
+class AimdController(Controller):
+
+    def __init__(self, window=False, increase=5.0, decrease=0.5):
+        self.window = window
+        self.increase = increase
+        self.decrease = decrease
+        self.reset(None)
+
+    def reset(self, sender):
+        self.quiet_until = 0.0
+        # Sender.set_cwnd keeps whole packets, so the window grows here.
+        self.cwnd = None
+        if sender is not None:
+            self.cwnd = float(sender.cwnd)
+            if self.window:
+                sender.set_cwnd_mode(True)
+
+    def on_mi(self, sender, mi):
+        now = mi.send_end
+        rtt = mi.get("avg latency")
+        min_rtt = sender.min_latency if sender.min_latency is not None else rtt
+        lost = mi.get("loss ratio") > 0.0 and now >= self.quiet_until
+        if lost:
+            self.quiet_until = now + rtt
+        if not self.window:
+            if lost:
+                sender.set_rate(sender.rate * self.decrease)
+            else:
+                sender.set_rate(sender.rate + self.increase)
+            return
+        if self.cwnd is None:
+            self.cwnd = float(sender.cwnd)
+        if lost:
+            self.cwnd *= self.decrease
+        elif rtt > 0.0:
+            self.cwnd += mi.get("send dur") / rtt
+        sender.set_cwnd(self.cwnd)
+        if int(self.cwnd) != sender.cwnd:
+            self.cwnd = float(sender.cwnd)
+        if min_rtt > 0.0:
+            sender.set_rate(1.25 * self.cwnd / min_rtt)
+
+# A PCC Vivace style controller: it probes rate * (1 + eps) and then
+# rate * (1 - eps), estimates the gradient of the Vivace utility
+# x^0.9 - 900 x dRTT/dt - 11.35 x L (x in Mbps) and takes a gradient step,
+# amplified while the direction holds and bounded by a change limit that
+# grows with every consecutive step. The simulator's MIs are half an RTT and
+# report the acks that arrive during them, so each probe first waits an RTT
+# for the feedback of the new rate, then measures over as many MIs as it
+# takes to cover another RTT and at least MIN_PROBE_PACKETS packets.
+class VivaceController(Controller):
+
+    EXPONENT = 0.9
+    LATENCY_COEF = 900.0
+    LOSS_COEF = 11.35
+    MIN_PROBE_PACKETS = 10
+
+    def __init__(self, eps=0.05, theta=1.0, omega=0.05, omega_step=0.1):
+        self.eps = eps
+        self.theta = theta
+        self.omega = omega
+        self.omega_step = omega_step
+        self.reset(None)
+
+    def reset(self, sender):
+        self.base_rate = None
+        self.probe = 0
+        self.utility_up = 0.0
+        self.direction = 0
+        self.n_same_direction = 0
+        self.clear_probe()
+
+    def clear_probe(self):
+        self.settle_dur = 0.0
+        self.probe_dur = 0.0
+        self.probe_sent = 0
+        self.probe_acked = 0
+        self.probe_lost = 0
+        self.probe_latency_increase = 0.0
+
+    def utility(self):
+        x = packets_to_mbps(mi_rate_to_packets(8.0 * self.probe_sent / self.probe_dur))
+        latency_gradient = max(0.0, self.probe_latency_increase / self.probe_dur)
+        loss = self.probe_lost / float(max(1, self.probe_lost + self.probe_acked))
+        return (x ** self.EXPONENT - self.LATENCY_COEF * x * latency_gradient
+                - self.LOSS_COEF * x * loss)
+
+    def set_probe_rate(self, sender):
+        if self.probe == 0:
+            sender.set_rate(self.base_rate * (1.0 + self.eps))
+            # Keep probing around the rate the sender can actually use.
+            self.base_rate = min(self.base_rate, sender.rate / (1.0 + self.eps))
+        else:
+            sender.set_rate(self.base_rate * (1.0 - self.eps))
+            self.base_rate = max(self.base_rate, sender.rate / (1.0 - self.eps))
+
+    def on_mi(self, sender, mi):
+        if self.base_rate is None:
+            self.base_rate = sender.rate
+            self.set_probe_rate(sender)
+            return
+        rtt = max(mi.get("avg latency"), sender.min_latency or 0.0)
+        if self.settle_dur < rtt:
+            self.settle_dur += mi.get("send dur")
+            return
+        self.probe_dur += mi.get("send dur")
+        self.probe_sent += mi.bytes_sent
+        self.probe_acked += mi.bytes_acked
+        self.probe_lost += mi.bytes_lost
+        self.probe_latency_increase += mi.get("latency increase")
+        if (self.probe_dur < rtt
+                or self.probe_sent < self.MIN_PROBE_PACKETS * mi.packet_size):
+            return
+        if self.probe == 0:
+            self.utility_up = self.utility()
+            self.probe = 1
+        else:
+            self.step(self.utility_up, self.utility())
+            self.probe = 0
+        self.clear_probe()
+        self.set_probe_rate(sender)
+
+    def step(self, utility_up, utility_down):
+        rate_mbps = packets_to_mbps(self.base_rate)
+        gradient = (utility_up - utility_down) / (2.0 * self.eps * rate_mbps)
+        direction = 1 if gradient > 0.0 else -1
+        if direction == self.direction:
+            self.n_same_direction += 1
+        else:
+            self.n_same_direction = 0
+        self.direction = direction
+        change = self.theta * (1 + self.n_same_direction) * gradient
+        limit = (self.omega + self.n_same_direction * self.omega_step) * rate_mbps
+        change = max(-limit, min(limit, change))
+        self.base_rate *= (rate_mbps + change) / rate_mbps
+
+# A BBR style controller built on a model of the path: the bottleneck
+# bandwidth is the highest delivery rate over the last BW_WINDOW MIs and the
+# propagation delay is the minimum RTT seen. It starts up at a gain of 2.89
+# until the bandwidth estimate stops growing by 25% for three MIs, drains
+# the queue it built, then cycles the pacing gain through
+# 1.25, 0.75, 1, 1, 1, 1, 1, 1, one MI per phase, with a window of twice the
+# bandwidth-delay product.
+class BbrController(Controller):
+
+    BW_WINDOW = 10
+    STARTUP_GAIN = 2.89
+    CWND_GAIN = 2.0
+    CYCLE_GAINS = [1.25, 0.75, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0]
+
+    def __init__(self):
+        self.reset(None)
+
+    def reset(self, sender):
+        self.delivery_rates = collections.deque(maxlen=self.BW_WINDOW)
+        self.state = "startup"
+        self.full_bw = 0.0
+        self.n_full_bw = 0
+        self.cycle_index = 0
+        if sender is not None:
+            sender.set_cwnd_mode(True)
+
+    def btl_bw(self):
+        return max(self.delivery_rates) if len(self.delivery_rates) > 0 else 0.0
+
+    def on_mi(self, sender, mi):
+        if mi.bytes_acked > 0:
+            self.delivery_rates.append(mi_rate_to_packets(mi.get("recv rate")))
+        btl_bw = self.btl_bw()
+        min_rtt = sender.min_latency
+        if btl_bw <= 0.0 or min_rtt is None:
+            return
+
+        if self.state == "startup":
+            if btl_bw >= 1.25 * self.full_bw:
+                self.full_bw = btl_bw
+                self.n_full_bw = 0
+            else:
+                self.n_full_bw += 1
+                if self.n_full_bw >= 3:
+                    self.state = "drain"
+        elif self.state == "drain":
+            if mi.get("avg latency") <= 1.25 * min_rtt:
+                self.state = "probe_bw"
+        else:
+            self.cycle_index = (self.cycle_index + 1) % len(self.CYCLE_GAINS)
+
+        if self.state == "startup":
+            gain = self.STARTUP_GAIN
+        elif self.state == "drain":
+            gain = 1.0 / self.STARTUP_GAIN
+        else:
+            gain = self.CYCLE_GAINS[self.cycle_index]
+        sender.set_rate(gain * btl_bw)
+        sender.set_cwnd(self.CWND_GAIN * btl_bw * min_rtt)
+
+BASELINES = {
+    "aimd":lambda: AimdController(),
+    "aimd-window":lambda: AimdController(window=True),
+    "vivace":lambda: VivaceController(),
+    "bbr":lambda: BbrController(),
+}
+
+def make_controller(name):
+    if name not in BASELINES:
+        raise ValueError("Unknown baseline %s (known: %s)"
+                         % (name, ", ".join(sorted(BASELINES.keys()))))
+    return BASELINES[name]()
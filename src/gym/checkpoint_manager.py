@@ -0,0 +1,147 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import queue
+import shutil
+import threading
+import time
+
+import numpy as np
+
+import model_export
+
+# Periodic checkpoints that keep disk I/O off the learner's thread. On the
+# learner's thread a checkpoint only copies the parameters out of the
+# session. A background thread then writes, for each snapshot,
+#
+#   <checkpoint_dir>/<run>/checkpoint_<step>/weights.npz   parameters by variable name
+#   <checkpoint_dir>/<run>/checkpoint_<step>/saved_model/  the serving SavedModel
+#
+# where <run> (run_<start time>) is new for every manager, so runs sharing a
+# checkpoint_dir never overwrite or rotate away each other's checkpoints.
+# Each checkpoint is written under a temporary name and renamed into place,
+# and <checkpoint_dir>/latest names the newest complete one as <run>/<name>.
+# Only the last keep_last checkpoints this manager wrote are kept. If the writer falls behind, new snapshots
+# are dropped rather than making the learner wait, unless the checkpoint is
+# taken with block=True (as for the final one).
+
+class CheckpointManager():
+
+    def __init__(self, checkpoint_dir, every_timesteps=0, every_seconds=0.0,
+                 keep_last=5, max_pending=2):
+        self.checkpoint_dir = checkpoint_dir
+        self.every_timesteps = every_timesteps
+        self.every_seconds = every_seconds
+        self.keep_last = keep_last
+        self.last_timesteps = 0
+        self.last_time = time.time()
+        self.n_dropped = 0
+        self.n_written = 0
+        # Checkpoint directories written by this manager, oldest first.
+        self.written = []
+        self.pending = queue.Queue(maxsize=max_pending)
+        run_name = "run_%s" % time.strftime("%Y%m%d-%H%M%S")
+        self.run_dir = os.path.join(checkpoint_dir, run_name)
+        n = 1
+        while os.path.exists(self.run_dir):
+            n += 1
+            self.run_dir = os.path.join(checkpoint_dir, "%s_%d" % (run_name, n))
+        os.makedirs(self.run_dir)
+        self.writer = threading.Thread(target=self.write_loop, name="checkpoint-writer")
+        self.writer.daemon = True
+        self.writer.start()
+
+    def is_due(self, num_timesteps):
+        if self.every_timesteps > 0 and num_timesteps - self.last_timesteps >= self.every_timesteps:
+            return True
+        if self.every_seconds > 0.0 and time.time() - self.last_time >= self.every_seconds:
+            return True
+        return False
+
+    # Takes a snapshot if one is due. Suitable for calling from a learn()
+    # callback.
+    def maybe_checkpoint(self, model):
+        if self.is_due(model.num_timesteps):
+            self.checkpoint(model)
+
+    def checkpoint(self, model, block=False):
+        self.last_timesteps = model.num_timesteps
+        self.last_time = time.time()
+        item = (model, model.num_timesteps, model_export.snapshot_weights(model))
+        if block:
+            self.pending.put(item)
+            return
+        try:
+            self.pending.put_nowait(item)
+        except queue.Full:
+            self.n_dropped += 1
+            print("Checkpoint writer is behind, skipping checkpoint at step %d"
+                  % model.num_timesteps)
+
+    def write_loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                self.pending.task_done()
+                return
+            model, step, weights = item
+            try:
+                self.write_checkpoint(model, step, weights)
+            except Exception as e:
+                print("Failed to write checkpoint at step %d: %s" % (step, str(e)))
+            self.pending.task_done()
+
+    def write_checkpoint(self, model, step, weights):
+        name = "checkpoint_%d" % step
+        final_dir = os.path.join(self.run_dir, name)
+        tmp_dir = os.path.join(self.run_dir, ".tmp_" + name)
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        np.savez(os.path.join(tmp_dir, "weights.npz"), **weights)
+        sess, pol = model_export.build_serving_policy(model, weights)
+        try:
+            model_export.export_policy(sess, pol, os.path.join(tmp_dir, "saved_model"))
+        finally:
+            sess.close()
+        if os.path.exists(final_dir):
+            shutil.rmtree(final_dir)
+        os.rename(tmp_dir, final_dir)
+
+        latest_tmp = os.path.join(self.checkpoint_dir, ".latest")
+        with open(latest_tmp, "w") as f:
+            f.write(os.path.relpath(final_dir, self.checkpoint_dir) + "\n")
+        os.replace(latest_tmp, os.path.join(self.checkpoint_dir, "latest"))
+        if final_dir in self.written:
+            self.written.remove(final_dir)
+        self.written.append(final_dir)
+        self.n_written += 1
+        print("Wrote checkpoint %s" % final_dir)
+        self.rotate()
+
+    # Deletes this manager's oldest checkpoints beyond keep_last. The newest,
+    # which latest names, is always kept.
+    def rotate(self):
+        if self.keep_last <= 0:
+            return
+        while len(self.written) > max(1, self.keep_last):
+            shutil.rmtree(self.written.pop(0), ignore_errors=True)
+
+    # Waits for every queued checkpoint to be written and stops the writer.
+    def close(self):
+        self.pending.put(None)
+        self.writer.join()
+        if self.n_dropped > 0:
+            print("Dropped %d checkpoints while the writer was behind" % self.n_dropped)
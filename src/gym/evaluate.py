@@ -0,0 +1,293 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+##
+#   Evaluates a trained policy in the simulator over a grid of link
+#   scenarios.
+#
+#   usage: python3 evaluate.py --model-path=<saved model dir or .npz>
+#              [--baselines=aimd,aimd-window,vivace,bbr]
+#              [--bw=50,100,300,500,1000] [--latency=0.01,0.05,0.2,0.5,1.0]
+#              [--queue=2,10,100,1000] [--loss=0.0,0.01,0.05,0.1]
+#              [--n-seeds=3] [--episode-steps=400] [--n-workers=<cores>]
+#              [--cache-dir=/tmp/pcc_eval_cache] [--output=<summary.csv>]
+#
+#   Every (scenario, seed) pair is one deterministic episode with the policy's
+#   deterministic action. Episodes run in a process pool, each worker loading
+#   its own copy of the policy. Per-episode results are cached on disk keyed
+#   by a hash of the model files, the scenario, the seed and the episode
+#   settings, so only episodes missing from the cache are run. The summary has
+#   one row per scenario with percentiles of the per-step throughput, latency
+#   and loss rate, and of the episode reward, across all seeds.
+#
+#   Each controller in --baselines (see baselines.py) runs over the same
+#   episodes, and the summary then has one set of rows per policy plus a
+#   comparison of their medians. An empty --model-path runs only the
+#   baselines.
+#
+#   The default grid reaches past the training ranges (bw 100-500 packets/s,
+#   latency 0.05-0.5s, queue 2-3000 packets, loss 0-5%).
+##
+
+import hashlib
+import inspect
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import zlib
+
+import numpy as np
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+sys.path.insert(0, os.path.join(parentdir, "udt-plugins", "testing"))
+
+from common.simple_arg_parse import arg_or_default
+
+EVAL_VERSION = 1
+BASELINE_PREFIX = "baseline:"
+PERCENTILES = [10, 50, 90]
+METRICS = ["throughput", "latency", "loss", "reward"]
+
+def parse_list(arg, default):
+    return [float(x) for x in str(arg_or_default(arg, default)).split(",")]
+
+def is_baseline(model_path):
+    return model_path.startswith(BASELINE_PREFIX)
+
+# A content hash of the model file or of every file in a SavedModel directory.
+# A baseline is hashed with the controllers' source and with the simulator's,
+# since they drive its Sender directly (for instance, the window-based ones
+# rely on it enforcing their window). Changing either reruns their episodes.
+def model_hash(model_path):
+    h = hashlib.sha1()
+    if is_baseline(model_path):
+        h.update(model_path.encode())
+        for source in ["baselines.py", "network_sim.py"]:
+            with open(os.path.join(currentdir, source), "rb") as f:
+                h.update(f.read())
+        return h.hexdigest()
+    if os.path.isfile(model_path):
+        paths = [model_path]
+    else:
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(model_path):
+            for filename in filenames:
+                paths.append(os.path.join(dirpath, filename))
+        paths.sort()
+    for path in paths:
+        h.update(os.path.relpath(path, model_path).encode())
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def episode_seed(scenario, seed):
+    return zlib.crc32(repr((scenario, seed)).encode())
+
+# The simulator takes its reward, action scale and observation settings from
+# the command line, so they are part of every cache key too.
+def env_settings():
+    import network_sim
+    return list(network_sim.SETTINGS.items())
+
+def cache_key(model_digest, scenario, seed, episode_steps):
+    key = json.dumps([EVAL_VERSION, model_digest, list(scenario), seed, episode_steps,
+                      env_settings()])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+class ResultCache():
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def get(self, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def put(self, key, result):
+        if self.cache_dir is None:
+            return
+        path = self._path(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(result, f)
+        os.replace(tmp_path, path)
+
+_worker_policy = None
+
+def _init_worker(model_path):
+    global _worker_policy
+    # The simulator prints every episode; keep worker output quiet.
+    sys.stdout = open(os.devnull, "w")
+    _worker_policy = load_policy(model_path)
+
+def load_policy(model_path):
+    if is_baseline(model_path):
+        import baselines
+        return baselines.make_controller(model_path[len(BASELINE_PREFIX):])
+    import distill_table
+    return distill_table.load_policy(model_path)
+
+# The policy is either a model, acting on each observation, or a
+# baselines.Controller that drives the sender itself.
+def run_episode(policy, scenario, seed, episode_steps):
+    import baselines
+    import network_sim
+    ep_seed = episode_seed(scenario, seed)
+    random.seed(ep_seed)
+    np.random.seed(ep_seed % (2 ** 32))
+    env = network_sim.SimulatedNetworkEnv()
+    env.seed(ep_seed)
+    bw, lat, queue, loss = scenario
+    env.fixed_link_params = (bw, lat, int(queue), loss)
+    env.max_steps = episode_steps
+    if isinstance(policy, baselines.Controller):
+        env.controller = policy
+    obs = env.reset()
+    done = False
+    rewards = []
+    while not done:
+        if env.controller is not None:
+            act = np.zeros(env.action_space.shape)
+        else:
+            act = np.asarray(policy.act(np.reshape(obs, (1, -1)).astype(np.float32))["act"])
+        obs, reward, done, _ = env.step(act.reshape(-1))
+        rewards.append(reward)
+    events = env.event_record["Events"]
+    return {"throughput":[float(e["Throughput"]) for e in events],
+            "latency":[float(e["Latency"]) for e in events],
+            "loss":[float(e["Loss Rate"]) for e in events],
+            "reward":float(np.sum(rewards))}
+
+def _run_task(task):
+    key, scenario, seed, episode_steps = task
+    return key, run_episode(_worker_policy, scenario, seed, episode_steps)
+
+def summarize(scenario, results):
+    row = {"bw":scenario[0], "latency_s":scenario[1], "queue":int(scenario[2]),
+           "loss_rate":scenario[3], "episodes":len(results)}
+    for metric in METRICS:
+        values = np.array(list(itertools.chain.from_iterable(
+            [r[metric] if isinstance(r[metric], list) else [r[metric]] for r in results])))
+        for p in PERCENTILES:
+            row["%s_p%d" % (metric, p)] = float(np.percentile(values, p)) if len(values) > 0 else float("nan")
+    return row
+
+def write_table(rows, path):
+    columns = list(rows[0].keys())
+    with open(path, "w") as f:
+        f.write(",".join(columns) + "\n")
+        for row in rows:
+            f.write(",".join([str(row[c]) for c in columns]) + "\n")
+
+# The median of each metric's p50 over all scenarios, per policy.
+def print_comparison(rows_by_policy):
+    print("%30s | %12s %10s %10s %10s" % ("policy", "thpt p50", "lat p50", "loss p50", "reward p50"))
+    for name, rows in rows_by_policy:
+        print("%30s | %12.1f %10.4f %10.4f %10.1f"
+              % (name[-30:], np.median([r["throughput_p50"] for r in rows]),
+                 np.median([r["latency_p50"] for r in rows]),
+                 np.median([r["loss_p50"] for r in rows]),
+                 np.median([r["reward_p50"] for r in rows])))
+
+def print_table(rows):
+    print("%8s %8s %6s %6s | %12s %12s %10s %10s" % ("bw", "lat", "queue", "loss",
+          "thpt p50", "thpt p10", "lat p50", "reward p50"))
+    for row in rows:
+        print("%8.1f %8.3f %6d %6.3f | %12.1f %12.1f %10.4f %10.1f"
+              % (row["bw"], row["latency_s"], row["queue"], row["loss_rate"],
+                 row["throughput_p50"], row["throughput_p10"], row["latency_p50"],
+                 row["reward_p50"]))
+
+def evaluate(model_path, scenarios, seeds, episode_steps, n_workers, cache_dir):
+    digest = model_hash(model_path)
+    cache = ResultCache(cache_dir)
+    results = {}
+    tasks = []
+    for scenario in scenarios:
+        for seed in seeds:
+            key = cache_key(digest, scenario, seed, episode_steps)
+            cached = cache.get(key)
+            if cached is not None:
+                results[key] = cached
+            else:
+                tasks.append((key, scenario, seed, episode_steps))
+    print("Model %s: %d episodes cached, %d to run" % (digest[:12], len(results), len(tasks)))
+    if len(tasks) > 0:
+        pool = multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=(model_path,))
+        for i, (key, result) in enumerate(pool.imap_unordered(_run_task, tasks)):
+            cache.put(key, result)
+            results[key] = result
+            if (i + 1) % max(1, len(tasks) // 20) == 0:
+                print("%d/%d episodes done" % (i + 1, len(tasks)))
+        pool.close()
+        pool.join()
+    rows = []
+    for scenario in scenarios:
+        rows.append(summarize(scenario, [results[cache_key(digest, scenario, seed, episode_steps)]
+                                         for seed in seeds]))
+    return rows
+
+def main():
+    model_path = arg_or_default("--model-path", "/tmp/pcc_saved_models/model_A/")
+    bws = parse_list("--bw", "50,100,300,500,1000")
+    lats = parse_list("--latency", "0.01,0.05,0.2,0.5,1.0")
+    queues = parse_list("--queue", "2,10,100,1000")
+    losses = parse_list("--loss", "0.0,0.01,0.05,0.1")
+    seeds = list(range(0, arg_or_default("--n-seeds", 3)))
+    episode_steps = arg_or_default("--episode-steps", 400)
+    n_workers = arg_or_default("--n-workers", multiprocessing.cpu_count())
+    cache_dir = arg_or_default("--cache-dir", "/tmp/pcc_eval_cache")
+    output = arg_or_default("--output", None)
+    baseline_names = [name for name in arg_or_default("--baselines", "").split(",") if name != ""]
+
+    policies = [BASELINE_PREFIX + name for name in baseline_names]
+    if model_path != "":
+        policies.insert(0, model_path)
+    scenarios = list(itertools.product(bws, lats, queues, losses))
+    rows_by_policy = []
+    for policy in policies:
+        rows = evaluate(policy, scenarios, seeds, episode_steps, n_workers, cache_dir)
+        print(policy)
+        print_table(rows)
+        rows_by_policy.append((policy, rows))
+    if len(policies) > 1:
+        print_comparison(rows_by_policy)
+    if output is not None:
+        all_rows = []
+        for policy, rows in rows_by_policy:
+            for row in rows:
+                policy_row = {"policy":policy}
+                policy_row.update(row)
+                all_rows.append(policy_row)
+        write_table(all_rows, output)
+
+if __name__ == "__main__":
+    main()
@@ -13,12 +13,20 @@
 # limitations under the License.
 
 import json
-import matplotlib.pyplot as plt
 import numpy as np
 import sys
 
+if "--batch" in sys.argv:
+    # Many logs or log directories; see log_summary.py for the options.
+    import log_summary
+    log_summary.main([arg for arg in sys.argv[1:] if not arg.startswith("--")])
+    exit(0)
+
+import matplotlib.pyplot as plt
+
 if (not (len(sys.argv) == 2)) or (sys.argv[1] == "-h") or (sys.argv[1] == "--help"):
     print("usage: python3 graph_run.py <pcc_env_log_filename.json>")
+    print("       python3 graph_run.py --batch <log or directory> [...]")
     exit(0)
 
 filename = sys.argv[1]
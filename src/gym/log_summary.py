@@ -0,0 +1,348 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+##
+#   Summarizes many environment logs at once. This is the batch mode of
+#   graph_run.py.
+#
+#   usage: python3 graph_run.py --batch <log or directory> [...]
+#              [--n-workers=<cores>] [--max-points=500] [--max-pages=50]
+#              [--summary=log_summary.csv] [--aggregate=log_summary.json]
+#              [--report=log_report.pdf]
+#
+#   Inputs are JSON logs from SimulatedNetworkEnv.dump_events_to_file, or the
+#   per-episode .npz files of rollout_log.py, or directories of either. Worker
+#   processes parse the logs and reduce each one to per-episode statistics and
+#   a few downsampled series, so the main process never holds a whole log.
+#   The main process streams one row per log into the summary CSV and keeps
+#   the aggregate statistics in fixed-size structures, so memory use does not
+#   grow with the number of logs.
+#
+#   The report has one page per selected log (about --max-pages, evenly
+#   spaced through the inputs) in graph_run's layout, followed by pages with
+#   the per-log statistics across the whole batch and their distributions.
+#   Series are downsampled to --max-points with Largest-Triangle-Three-Buckets,
+#   which keeps the peaks and dips a plain stride would skip.
+##
+
+import glob
+import inspect
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+
+import numpy as np
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from common.simple_arg_parse import arg_or_default
+
+# (column, label) of every per-step series.
+SERIES = [("reward", "Reward"),
+          ("send_rate", "Send Rate"),
+          ("throughput", "Throughput"),
+          ("latency", "Latency"),
+          ("loss", "Loss Rate")]
+JSON_KEYS = {"reward":"Reward", "send_rate":"Send Rate", "throughput":"Throughput",
+             "latency":"Latency", "loss":"Loss Rate"}
+PERCENTILES = [10, 50, 90]
+LOG_PATTERNS = ["*.json", "*.npz"]
+
+def expand_inputs(inputs):
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            dir_paths = []
+            for pattern in LOG_PATTERNS:
+                dir_paths += glob.glob(os.path.join(path, pattern))
+            paths += sorted(dir_paths)
+        else:
+            paths.append(path)
+    return paths
+
+# The series of one log as NumPy arrays, skipping the first event like
+# graph_run.py does.
+def load_series(path):
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            series = {name:np.asarray(data[name], dtype=np.float64) for name, _ in SERIES}
+        series["time"] = np.arange(1, len(series["reward"]) + 1, dtype=np.float64)
+        return series
+    with open(path) as f:
+        events = json.load(f)["Events"][1:]
+    series = {"time":np.array([float(e["Time"]) for e in events])}
+    for name, key in JSON_KEYS.items():
+        series[name] = np.array([float(e[key]) for e in events])
+    return series
+
+# Largest-Triangle-Three-Buckets downsampling to at most n_out points.
+def lttb(x, y, n_out):
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+    bucket_edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    out = np.zeros(n_out, dtype=np.int64)
+    out[-1] = n - 1
+    selected = 0
+    for i in range(0, n_out - 2):
+        start, end = bucket_edges[i], bucket_edges[i + 1]
+        if i + 2 < n_out - 1:
+            next_start, next_end = bucket_edges[i + 1], bucket_edges[i + 2]
+            avg_x = np.mean(x[next_start:next_end])
+            avg_y = np.mean(y[next_start:next_end])
+        else:
+            avg_x, avg_y = x[-1], y[-1]
+        if end <= start:
+            out[i + 1] = start
+            selected = start
+            continue
+        ax, ay = x[selected], y[selected]
+        area = np.abs((ax - avg_x) * (y[start:end] - ay) - (ax - x[start:end]) * (avg_y - ay))
+        selected = start + int(np.argmax(area))
+        out[i + 1] = selected
+    return x[out], y[out]
+
+def episode_stats(series):
+    stats = {"steps":len(series["reward"]), "return":float(np.sum(series["reward"]))}
+    for name, _ in SERIES:
+        values = series[name]
+        if len(values) == 0:
+            values = np.array([np.nan])
+        stats[name + "_mean"] = float(np.mean(values))
+        for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+            stats["%s_p%d" % (name, p)] = float(v)
+    return stats
+
+STAT_COLUMNS = (["steps", "return"] + [name + "_mean" for name, _ in SERIES]
+                + ["%s_p%d" % (name, p) for name, _ in SERIES for p in PERCENTILES])
+
+def summarize_log(task):
+    index, path, max_points, keep_series = task
+    try:
+        series = load_series(path)
+    except Exception as e:
+        return index, path, None, None, str(e)
+    stats = episode_stats(series)
+    plot = None
+    if keep_series:
+        plot = {}
+        for name, _ in SERIES:
+            plot[name] = lttb(series["time"], series[name], max_points)
+    return index, path, stats, plot, None
+
+# Mean, standard deviation, extremes and a fixed-size uniform sample of a
+# stream of values, for percentiles.
+class StreamStats():
+
+    def __init__(self, sample_size=10000, seed=0):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.sample_size = sample_size
+        self.sample = []
+        self.rand = random.Random(seed)
+
+    def add(self, value):
+        if not math.isfinite(value):
+            return
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if len(self.sample) < self.sample_size:
+            self.sample.append(value)
+        else:
+            j = self.rand.randrange(self.n)
+            if j < self.sample_size:
+                self.sample[j] = value
+
+    def result(self):
+        if self.n == 0:
+            return {"n":0}
+        result = {"n":self.n, "mean":self.mean, "std":math.sqrt(self.m2 / self.n),
+                  "min":self.min, "max":self.max}
+        for p, v in zip(PERCENTILES, np.percentile(self.sample, PERCENTILES)):
+            result["p%d" % p] = float(v)
+        return result
+
+# A per-log value over the whole batch in a fixed number of buckets. When the
+# buckets run out, neighbouring pairs are merged and each bucket covers twice
+# as many logs.
+class BucketSeries():
+
+    def __init__(self, n_buckets=512):
+        self.n_buckets = n_buckets
+        self.width = 1
+        self.count = np.zeros(n_buckets)
+        self.total = np.zeros(n_buckets)
+        self.low = np.full(n_buckets, np.inf)
+        self.high = np.full(n_buckets, -np.inf)
+
+    def add(self, index, value):
+        if not math.isfinite(value):
+            return
+        while index // self.width >= self.n_buckets:
+            self.merge()
+        b = index // self.width
+        self.count[b] += 1
+        self.total[b] += value
+        self.low[b] = min(self.low[b], value)
+        self.high[b] = max(self.high[b], value)
+
+    def merge(self):
+        half = self.n_buckets // 2
+        self.count[:half] = self.count[0::2] + self.count[1::2]
+        self.total[:half] = self.total[0::2] + self.total[1::2]
+        self.low[:half] = np.minimum(self.low[0::2], self.low[1::2])
+        self.high[:half] = np.maximum(self.high[0::2], self.high[1::2])
+        self.count[half:] = 0
+        self.total[half:] = 0
+        self.low[half:] = np.inf
+        self.high[half:] = -np.inf
+        self.width *= 2
+
+    # Bucket centers (in log index), means, minima and maxima.
+    def result(self):
+        used = self.count > 0
+        centers = (np.arange(self.n_buckets) + 0.5) * self.width
+        return (centers[used], self.total[used] / self.count[used],
+                self.low[used], self.high[used])
+
+AGGREGATE_STATS = ["return"] + [name + "_mean" for name, _ in SERIES]
+
+class Aggregate():
+
+    def __init__(self):
+        self.n_logs = 0
+        self.n_failed = 0
+        self.total_steps = 0
+        self.stats = {name:StreamStats() for name in AGGREGATE_STATS}
+        self.trends = {name:BucketSeries() for name in AGGREGATE_STATS}
+
+    def add(self, index, stats):
+        self.n_logs += 1
+        self.total_steps += stats["steps"]
+        for name in AGGREGATE_STATS:
+            self.stats[name].add(stats[name])
+            self.trends[name].add(index, stats[name])
+
+    def result(self):
+        return {"logs":self.n_logs, "failed":self.n_failed, "steps":self.total_steps,
+                "per_log":{name:self.stats[name].result() for name in AGGREGATE_STATS}}
+
+def plot_log(pdf, plt, path, plot):
+    fig, axes = plt.subplots(len(SERIES), figsize=(10, 12))
+    for axis, (name, label) in zip(axes, SERIES):
+        x, y = plot[name]
+        axis.plot(x, y)
+        axis.set_ylabel(label)
+    axes[-1].set_xlabel("Monitor Interval")
+    fig.suptitle("Summary Graph for %s" % path)
+    pdf.savefig(fig)
+    plt.close(fig)
+
+def plot_aggregate(pdf, plt, aggregate):
+    fig, axes = plt.subplots(len(AGGREGATE_STATS), figsize=(10, 12))
+    for axis, name in zip(axes, AGGREGATE_STATS):
+        centers, means, lows, highs = aggregate.trends[name].result()
+        axis.fill_between(centers, lows, highs, alpha=0.3)
+        axis.plot(centers, means)
+        axis.set_ylabel(name)
+    axes[-1].set_xlabel("Log")
+    fig.suptitle("Per-log statistics over %d logs" % aggregate.n_logs)
+    pdf.savefig(fig)
+    plt.close(fig)
+
+    fig, axes = plt.subplots(len(AGGREGATE_STATS), figsize=(10, 12))
+    for axis, name in zip(axes, AGGREGATE_STATS):
+        axis.hist(aggregate.stats[name].sample, bins=50)
+        axis.set_ylabel(name)
+    fig.suptitle("Distribution of per-log statistics")
+    pdf.savefig(fig)
+    plt.close(fig)
+
+def summarize_logs(paths, n_workers, max_points, max_pages, summary_path, report_path):
+    stride = max(1, int(math.ceil(len(paths) / float(max(1, max_pages)))))
+    tasks = ((i, path, max_points, report_path is not None and i % stride == 0)
+             for i, path in enumerate(paths))
+
+    pdf = None
+    plt = None
+    if report_path is not None:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        from matplotlib.backends.backend_pdf import PdfPages
+        pdf = PdfPages(report_path)
+
+    aggregate = Aggregate()
+    summary = open(summary_path, "w")
+    summary.write(",".join(["log"] + STAT_COLUMNS) + "\n")
+    pool = multiprocessing.Pool(n_workers)
+    try:
+        for index, path, stats, plot, error in pool.imap(summarize_log, tasks, chunksize=8):
+            if error is not None:
+                aggregate.n_failed += 1
+                print("Skipping %s: %s" % (path, error))
+                continue
+            aggregate.add(index, stats)
+            summary.write(",".join([path] + [str(stats[c]) for c in STAT_COLUMNS]) + "\n")
+            if plot is not None:
+                plot_log(pdf, plt, path, plot)
+            if (index + 1) % max(1, len(paths) // 20) == 0:
+                print("%d/%d logs done" % (index + 1, len(paths)))
+    finally:
+        pool.close()
+        pool.join()
+        summary.close()
+    if pdf is not None:
+        if aggregate.n_logs > 0:
+            plot_aggregate(pdf, plt, aggregate)
+        pdf.close()
+    return aggregate
+
+def main(inputs):
+    n_workers = arg_or_default("--n-workers", multiprocessing.cpu_count())
+    max_points = arg_or_default("--max-points", 500)
+    max_pages = arg_or_default("--max-pages", 50)
+    summary_path = arg_or_default("--summary", "log_summary.csv")
+    aggregate_path = arg_or_default("--aggregate", "log_summary.json")
+    report_path = arg_or_default("--report", "log_report.pdf")
+    if report_path == "":
+        report_path = None
+
+    paths = expand_inputs(inputs)
+    if len(paths) == 0:
+        print("No logs found")
+        sys.exit(1)
+    print("Summarizing %d logs with %d workers" % (len(paths), n_workers))
+    aggregate = summarize_logs(paths, n_workers, max_points, max_pages, summary_path, report_path)
+    result = aggregate.result()
+    with open(aggregate_path, "w") as f:
+        json.dump(result, f, indent=4)
+    print("%d logs, %d steps, %d failed" % (result["logs"], result["steps"], result["failed"]))
+    for name in AGGREGATE_STATS:
+        s = result["per_log"][name]
+        if s["n"] > 0:
+            print("\t%s: mean %0.3f, p10 %0.3f, p50 %0.3f, p90 %0.3f"
+                  % (name, s["mean"], s["p10"], s["p50"], s["p90"]))
@@ -0,0 +1,89 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+
+import tensorflow as tf
+
+# The policy whose deterministic action is served. PPO1 keeps it in
+# policy_pi; PPO2 and the other vectorized algorithms act through act_model.
+def serving_policy(model):
+    if hasattr(model, "policy_pi"):
+        return model.policy_pi
+    return model.act_model
+
+def build_signature_map(pol):
+    obs_ph = pol.obs_ph
+    act = pol.deterministic_action
+    sampled_act = pol.action
+
+    obs_input = tf.saved_model.utils.build_tensor_info(obs_ph)
+    outputs_tensor_info = tf.saved_model.utils.build_tensor_info(act)
+    stochastic_act_tensor_info = tf.saved_model.utils.build_tensor_info(sampled_act)
+    signature = tf.saved_model.signature_def_utils.build_signature_def(
+        inputs={"ob":obs_input},
+        outputs={"act":outputs_tensor_info, "stochastic_act":stochastic_act_tensor_info},
+        method_name=tf.saved_model.signature_constants.PREDICT_METHOD_NAME)
+
+    return {tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY:
+            signature}
+
+def export_policy(sess, pol, export_dir):
+    with sess.graph.as_default():
+        signature_map = build_signature_map(pol)
+        model_builder = tf.saved_model.builder.SavedModelBuilder(export_dir)
+        model_builder.add_meta_graph_and_variables(sess,
+            tags=[tf.saved_model.tag_constants.SERVING],
+            signature_def_map=signature_map,
+            clear_devices=True)
+        model_builder.save(as_text=True)
+
+##
+#   Save the model's serving policy as a SavedModel in export_dir, in the
+#   format loaded by udt-plugins/testing/loaded_agent.py.
+##
+def export_saved_model(model, export_dir):
+    export_policy(model.sess, serving_policy(model), export_dir)
+
+# Copies the model's parameters out of its session, keyed by variable name.
+# This is the only part of a checkpoint that has to run on the learner's
+# thread.
+def snapshot_weights(model):
+    with model.graph.as_default():
+        values = model.sess.run(model.params)
+    return collections.OrderedDict(zip([p.name for p in model.params], values))
+
+##
+#   Rebuilds the model's serving policy in a new graph and session and loads
+#   the given weights into it, so a snapshot can be exported without touching
+#   the learner's graph. Returns the session and the policy.
+##
+def build_serving_policy(model, weights):
+    graph = tf.Graph()
+    with graph.as_default():
+        sess = tf.Session(graph=graph)
+        policy_kwargs = getattr(model, "policy_kwargs", None) or {}
+        if hasattr(model, "policy_pi"):
+            # PPO1 and TRPO build their acting policy under the "pi" scope.
+            with tf.variable_scope("pi", reuse=False):
+                pol = model.policy(sess, model.observation_space, model.action_space,
+                                   1, 1, None, reuse=False, **policy_kwargs)
+        else:
+            pol = model.policy(sess, model.observation_space, model.action_space,
+                               1, 1, None, reuse=False, **policy_kwargs)
+        assigns = [var.assign(weights[var.name]) for var in tf.global_variables()
+                   if var.name in weights]
+        sess.run(tf.global_variables_initializer())
+        sess.run(assigns)
+    return sess, pol
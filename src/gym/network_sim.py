@@ -18,6 +18,7 @@ from gym.utils import seeding
 from gym.envs.registration import register
 import numpy as np
 import heapq
+import collections
 import time
 import random
 import json
@@ -29,6 +30,7 @@ parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir) 
 from common import sender_obs, config
 from common.simple_arg_parse import arg_or_default
+import rewards
 
 MAX_CWND = 5000
 MIN_CWND = 4
@@ -36,7 +38,25 @@ MIN_CWND = 4
 MAX_RATE = 1000
 MIN_RATE = 40
 
-REWARD_SCALE = 0.001
+# Every setting the simulator takes from the command line. evaluate.py keys
+# its result cache on these, so a new command line option must be added here.
+SETTINGS = collections.OrderedDict([
+    # Any name in rewards.REWARD_FUNCTIONS, or "module:function".
+    ("reward", arg_or_default("--reward", default="very-high-thpt")),
+    ("delta_scale", config.DELTA_SCALE),
+    ("history_len", arg_or_default("--history-len", default=10)),
+    ("input_features", arg_or_default("--input-features",
+        default="sent latency inflation,"
+              + "latency ratio,"
+              + "send ratio")),
+    ("steady_state_window", arg_or_default("--steady-state-window", default=0)),
+    ("steady_state_tolerance", arg_or_default("--steady-state-tolerance", default=0.05)),
+    ("steady_state_mode", arg_or_default("--steady-state-mode", default="end")),
+    ("steady_state_gamma", arg_or_default("--steady-state-gamma", default=0.99)),
+])
+
+REWARD_SCALE = rewards.REWARD_SCALE
+REWARD_FUNCTION = rewards.get_reward_function(SETTINGS["reward"])
 
 MAX_STEPS = 400
 
@@ -45,12 +65,10 @@ EVENT_TYPE_ACK = 'A'
 
 BYTES_PER_PACKET = 1500
 
-LATENCY_PENALTY = 1.0
-LOSS_PENALTY = 1.0
-
 USE_LATENCY_NOISE = False
 MAX_LATENCY_NOISE = 1.1
 
+# The default window mode of new senders; see Sender.set_cwnd_mode.
 USE_CWND = False
 
 class Link():
@@ -120,6 +138,13 @@ class Network():
     def get_cur_time(self):
         return self.cur_time
 
+    # Schedules the next send of a sender parked on a full window, keeping
+    # to its pacing rate.
+    def wake_sender(self, sender):
+        sender.parked = False
+        next_send = max(self.cur_time, sender.last_send_time + 1.0 / sender.rate)
+        heapq.heappush(self.q, (next_send, sender, EVENT_TYPE_SEND, 0, 0.0, False))
+
     def run_for_dur(self, dur):
         end_time = self.cur_time + dur
         for sender in self.senders:
@@ -144,6 +169,8 @@ class Network():
                     else:
                         sender.on_packet_acked(cur_latency)
                         #print("Packet acked at time %f" % self.cur_time)
+                    if sender.parked and sender.can_send_packet():
+                        self.wake_sender(sender)
                 else:
                     new_next_hop = next_hop + 1
                     link_latency = sender.path[next_hop].get_cur_latency(self.cur_time)
@@ -157,9 +184,17 @@ class Network():
                     #print("Packet sent at time %f" % self.cur_time)
                     if sender.can_send_packet():
                         sender.on_packet_sent()
+                        sender.last_send_time = self.cur_time
                         push_new_event = True
-                    heapq.heappush(self.q, (self.cur_time + (1.0 / sender.rate), sender, EVENT_TYPE_SEND, 0, 0.0, False))
-                
+                        heapq.heappush(self.q, (self.cur_time + (1.0 / sender.rate), sender, EVENT_TYPE_SEND, 0, 0.0, False))
+                    else:
+                        # Window limited: park until an ACK or loss frees
+                        # space, rather than polling at the pacing rate. No
+                        # packet leaves, so it must not touch the link's
+                        # queue or draw a loss.
+                        sender.parked = True
+                        continue
+
                 else:
                     push_new_event = True
 
@@ -181,27 +216,11 @@ class Network():
         throughput = sender_mi.get("recv rate")
         latency = sender_mi.get("avg latency")
         loss = sender_mi.get("loss ratio")
-        bw_cutoff = self.links[0].bw * 0.8
-        lat_cutoff = 2.0 * self.links[0].dl * 1.5
-        loss_cutoff = 2.0 * self.links[0].lr * 1.5
-        #print("thpt %f, bw %f" % (throughput, bw_cutoff))
-        #reward = 0 if (loss > 0.1 or throughput < bw_cutoff or latency > lat_cutoff or loss > loss_cutoff) else 1 #
-        
-        # Super high throughput
-        #reward = REWARD_SCALE * (20.0 * throughput / RATE_OBS_SCALE - 1e3 * latency / LAT_OBS_SCALE - 2e3 * loss)
-        
-        # Very high thpt
-        reward = (10.0 * throughput / (8 * BYTES_PER_PACKET) - 1e3 * latency - 2e3 * loss)
-        
-        # High thpt
-        #reward = REWARD_SCALE * (5.0 * throughput / RATE_OBS_SCALE - 1e3 * latency / LAT_OBS_SCALE - 2e3 * loss)
-        
-        # Low latency
-        #reward = REWARD_SCALE * (2.0 * throughput / RATE_OBS_SCALE - 1e3 * latency / LAT_OBS_SCALE - 2e3 * loss)
-        #if reward > 857:
-        #print("Reward = %f, thpt = %f, lat = %f, loss = %f" % (reward, throughput, latency, loss))
-        
-        #reward = (throughput / RATE_OBS_SCALE) * np.exp(-1 * (LATENCY_PENALTY * latency / LAT_OBS_SCALE + LOSS_PENALTY * loss))
+        # The raw statistics behind the reward, kept so rollouts can be
+        # relabeled later with a different formula (see rewards.py).
+        self.last_mi_stats = (throughput, latency, loss)
+        reward = REWARD_FUNCTION(throughput, latency, loss,
+                                 self.links[0].bw, self.links[0].dl, self.links[0].lr)
         return reward * REWARD_SCALE
 
 class Sender():
@@ -225,6 +244,9 @@ class Sender():
         self.history = sender_obs.SenderHistory(self.history_len,
                                                 self.features, self.id)
         self.cwnd = cwnd
+        self.use_cwnd = USE_CWND
+        self.parked = False
+        self.last_send_time = 0.0
 
     _next_id = 1
     def _get_next_id():
@@ -249,11 +271,21 @@ class Sender():
             self.set_cwnd(self.cwnd / (1.0 - delta))
 
     def can_send_packet(self):
-        if USE_CWND:
+        if self.use_cwnd:
             return int(self.bytes_in_flight) / BYTES_PER_PACKET < self.cwnd
         else:
             return True
 
+    # Switches between rate-only sending and sending limited by the window
+    # as well. Can be changed at any time, even mid-episode.
+    def set_cwnd_mode(self, use_cwnd):
+        self.use_cwnd = use_cwnd
+        self.wake_if_unblocked()
+
+    def wake_if_unblocked(self):
+        if self.parked and self.can_send_packet():
+            self.net.wake_sender(self)
+
     def register_network(self, net):
         self.net = net
 
@@ -287,6 +319,7 @@ class Sender():
             self.cwnd = MAX_CWND
         if self.cwnd < MIN_CWND:
             self.cwnd = MIN_CWND
+        self.wake_if_unblocked()
 
     def record_run(self):
         smi = self.get_run_data()
@@ -336,19 +369,47 @@ class Sender():
         #print("Resetting sender!")
         self.rate = self.starting_rate
         self.bytes_in_flight = 0
+        self.parked = False
+        self.last_send_time = 0.0
         self.min_latency = None
         self.reset_obs()
         self.history = sender_obs.SenderHistory(self.history_len,
                                                 self.features, self.id)
 
+# Decides when a sender has settled: its rate, throughput and latency have
+# each stayed within a relative range of `tolerance` (max - min over the
+# mean) for the last `window` MIs.
+class SteadyStateDetector():
+
+    def __init__(self, window, tolerance):
+        self.window = window
+        self.tolerance = tolerance
+        self.samples = collections.deque(maxlen=window)
+
+    def reset(self):
+        self.samples.clear()
+
+    def step(self, rate, throughput, latency):
+        self.samples.append((rate, throughput, latency))
+        if len(self.samples) < self.window:
+            return False
+        values = np.array(self.samples)
+        means = np.mean(values, axis=0)
+        if np.any(means <= 0.0):
+            return False
+        ranges = np.max(values, axis=0) - np.min(values, axis=0)
+        return bool(np.all(ranges <= self.tolerance * means))
+
 class SimulatedNetworkEnv(gym.Env):
     
     def __init__(self,
-                 history_len=arg_or_default("--history-len", default=10),
-                 features=arg_or_default("--input-features",
-                    default="sent latency inflation,"
-                          + "latency ratio,"
-                          + "send ratio")):
+                 history_len=SETTINGS["history_len"],
+                 features=SETTINGS["input_features"],
+                 use_cwnd=USE_CWND,
+                 steady_state_window=SETTINGS["steady_state_window"],
+                 steady_state_tolerance=SETTINGS["steady_state_tolerance"],
+                 steady_state_mode=SETTINGS["steady_state_mode"],
+                 steady_state_gamma=SETTINGS["steady_state_gamma"]):
         self.viewer = None
         self.rand = None
 
@@ -356,6 +417,33 @@ class SimulatedNetworkEnv(gym.Env):
         self.min_lat, self.max_lat = (0.05, 0.5)
         self.min_queue, self.max_queue = (0, 8)
         self.min_loss, self.max_loss = (0.0, 0.05)
+        # (bw, lat, queue, loss) to use instead of random links, for evaluation.
+        self.fixed_link_params = None
+        # A baselines.Controller to drive the sender instead of the actions.
+        self.controller = None
+        # Whether the senders are window limited and the actions also change
+        # the window.
+        self.use_cwnd = use_cwnd
+        # With a steady_state_window, an episode whose sender has settled
+        # (see SteadyStateDetector) ends before max_steps. In "end" mode, the
+        # default, for learners that treat every done as terminal (such as
+        # stable_baselines' PPO), the last reward also includes the
+        # discounted rewards of the skipped steps, assuming the window's mean
+        # reward continues. In "truncate" mode it is only marked as cut short
+        # (info["TimeLimit.truncated"]), for learners that bootstrap from the
+        # last observation. The steps and simulated seconds skipped are
+        # reported in info and summed over the env's lifetime.
+        if steady_state_mode not in ["end", "truncate"]:
+            raise ValueError("Unknown steady state mode %s (known: end, truncate)" % steady_state_mode)
+        self.steady_state = None
+        if steady_state_window > 0:
+            self.steady_state = SteadyStateDetector(steady_state_window, steady_state_tolerance)
+        self.steady_state_mode = steady_state_mode
+        self.steady_state_gamma = steady_state_gamma
+        self.steady_state_episodes = 0
+        self.steady_state_steps_saved = 0
+        self.steady_state_time_saved = 0.0
+        self.recent_rewards = collections.deque(maxlen=max(1, steady_state_window))
         self.history_len = history_len
         print("History length: %d" % history_len)
         self.features = features.split(",")
@@ -373,7 +461,7 @@ class SimulatedNetworkEnv(gym.Env):
         self.last_thpt = None
         self.last_rate = None
 
-        if USE_CWND:
+        if self.use_cwnd:
             self.action_space = spaces.Box(np.array([-1e12, -1e12]), np.array([1e12, 1e12]), dtype=np.float32)
         else:
             self.action_space = spaces.Box(np.array([-1e12]), np.array([1e12]), dtype=np.float32)
@@ -408,9 +496,11 @@ class SimulatedNetworkEnv(gym.Env):
         #print(actions)
         for i in range(0, 1):#len(actions)):
             #print("Updating rate for sender %d" % i)
+            if self.controller is not None:
+                break
             action = actions
             self.senders[i].apply_rate_delta(action[0])
-            if USE_CWND:
+            if self.use_cwnd:
                 self.senders[i].apply_cwnd_delta(action[1])
         #print("Running for %fs" % self.run_dur)
         reward = self.net.run_for_dur(self.run_dur)
@@ -436,12 +526,36 @@ class SimulatedNetworkEnv(gym.Env):
         self.event_record["Events"].append(event)
         if event["Latency"] > 0.0:
             self.run_dur = 0.5 * sender_mi.get("avg latency")
+        if self.controller is not None:
+            self.controller.on_mi(self.senders[0], sender_mi)
         #print("Sender obs: %s" % sender_obs)
 
         should_stop = False
 
+        throughput, latency, loss = self.net.last_mi_stats
+        info = {"throughput":throughput, "latency":latency, "loss":loss,
+                "send_rate":event["Send Rate"]}
+        self.recent_rewards.append(reward)
+        if (self.steady_state is not None and self.steps_taken < self.max_steps
+                and self.steady_state.step(self.senders[0].rate, throughput, latency)):
+            should_stop = True
+            steps_saved = self.max_steps - self.steps_taken
+            time_saved = steps_saved * self.run_dur
+            info["steady_state"] = True
+            info["steady_state_steps_saved"] = steps_saved
+            info["steady_state_time_saved"] = time_saved
+            if self.steady_state_mode == "end":
+                gamma = self.steady_state_gamma
+                bonus = np.mean(self.recent_rewards) * gamma * (1.0 - gamma ** steps_saved) / (1.0 - gamma)
+                info["steady_state_bonus"] = bonus
+                reward += bonus
+            else:
+                info["TimeLimit.truncated"] = True
+            self.steady_state_episodes += 1
+            self.steady_state_steps_saved += steps_saved
+            self.steady_state_time_saved += time_saved
         self.reward_sum += reward
-        return sender_obs, reward, (self.steps_taken >= self.max_steps or should_stop), {}
+        return sender_obs, reward, (self.steps_taken >= self.max_steps or should_stop), info
 
     def print_debug(self):
         print("---Link Debug---")
@@ -456,6 +570,8 @@ class SimulatedNetworkEnv(gym.Env):
         lat   = random.uniform(self.min_lat, self.max_lat)
         queue = 1 + int(np.exp(random.uniform(self.min_queue, self.max_queue)))
         loss  = random.uniform(self.min_loss, self.max_loss)
+        if self.fixed_link_params is not None:
+            bw, lat, queue, loss = self.fixed_link_params
         #bw    = 200
         #lat   = 0.03
         #queue = 5
@@ -464,6 +580,8 @@ class SimulatedNetworkEnv(gym.Env):
         #self.senders = [Sender(0.3 * bw, [self.links[0], self.links[1]], 0, self.history_len)]
         #self.senders = [Sender(random.uniform(0.2, 0.7) * bw, [self.links[0], self.links[1]], 0, self.history_len)]
         self.senders = [Sender(random.uniform(0.3, 1.5) * bw, [self.links[0], self.links[1]], 0, self.features, history_len=self.history_len)]
+        for sender in self.senders:
+            sender.use_cwnd = self.use_cwnd
         self.run_dur = 3 * lat
 
     def reset(self):
@@ -471,6 +589,8 @@ class SimulatedNetworkEnv(gym.Env):
         self.net.reset()
         self.create_new_links_and_senders()
         self.net = Network(self.senders, self.links)
+        if self.controller is not None:
+            self.controller.reset(self.senders[0])
         self.episodes_run += 1
         if self.episodes_run > 0 and self.episodes_run % 100 == 0:
             self.dump_events_to_file("pcc_env_log_run_%d.json" % self.episodes_run)
@@ -481,8 +601,21 @@ class SimulatedNetworkEnv(gym.Env):
         self.reward_ewma += 0.01 * self.reward_sum
         print("Reward: %0.2f, Ewma Reward: %0.2f" % (self.reward_sum, self.reward_ewma))
         self.reward_sum = 0.0
+        if self.steady_state is not None:
+            self.steady_state.reset()
+            self.recent_rewards.clear()
+            if self.steady_state_episodes > 0:
+                print("Steady state: %d episodes ended early, %d steps (%0.1fs simulated) saved"
+                      % (self.steady_state_episodes, self.steady_state_steps_saved,
+                         self.steady_state_time_saved))
         return self._get_all_sender_obs()
 
+    # The current link as (bw, delay, queue, loss rate), the extra inputs of
+    # the reward functions.
+    def link_params(self):
+        link = self.links[0]
+        return (link.bw, link.dl, link.max_queue_delay * link.bw, link.lr)
+
     def render(self, mode='human'):
         pass
 
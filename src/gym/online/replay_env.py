@@ -0,0 +1,174 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gym
+from gym import spaces
+from gym.utils import seeding
+from gym.envs.registration import register
+import numpy as np
+
+import shim_env
+from common import sender_obs, shim_recording
+from common.simple_arg_parse import arg_or_default
+
+# Serves recordings made with ShimNetworkEnv --shim-record through the same
+# observation pipeline, without a network. The recorded trajectories are
+# fixed: the agent's actions do not change them, so this environment is for
+# trying out feature sets and reward variants on real traces (and for
+# imitation or off-policy work), not for on-policy improvement. Each step's
+# info holds the recorded rate and the action that would have produced it.
+#
+# Episodes are those the trainer ran: recordings mark every environment
+# reset. Older recordings without the marks are split every
+# RESET_INTERVAL + 1 steps, the live episode length. With an episode_len,
+# episodes are further cut into pieces of at most that many steps.
+#
+# As in the live environment, the MIs keep their recorded flow ids, so
+# connection-level features such as "conn min latency" carry over from one
+# episode to the next within a session and start afresh with each session.
+#
+# All observations and rewards are built once when the recording is loaded,
+# so stepping only indexes into arrays.
+
+# The action that moves the rate from prev_rate to rate under
+# shim_env.apply_rate_delta, ignoring clamping.
+def implied_action(prev_rate, rate):
+    if rate >= prev_rate:
+        return (rate / prev_rate - 1.0) / shim_env.DELTA_SCALE
+    return (1.0 - prev_rate / rate) / shim_env.DELTA_SCALE
+
+def recorded_utility(mi_fields):
+    return mi_fields[-1]
+
+class ShimReplayEnv(gym.Env):
+
+    def __init__(self, recording_paths=arg_or_default("--replay-path", default="/tmp/pcc_shim.rec"),
+                 history_len=arg_or_default("--history-len", default=10),
+                 features=arg_or_default("--input-features",
+                    default="sent latency inflation,"
+                          + "latency ratio,"
+                          + "send ratio"),
+                 reward_fn=recorded_utility,
+                 episode_len=None,
+                 shuffle=False):
+        self.viewer = None
+        self.rand = None
+        self.features = features.split(",")
+        self.history_len = history_len
+        self.reward_fn = reward_fn
+        self.shuffle = shuffle
+
+        single_obs_min_vec = sender_obs.get_min_obs_vector(self.features)
+        single_obs_max_vec = sender_obs.get_max_obs_vector(self.features)
+        self.observation_space = spaces.Box(np.tile(single_obs_min_vec, self.history_len),
+                                            np.tile(single_obs_max_vec, self.history_len),
+                                            dtype=np.float32)
+        self.action_space = spaces.Box(np.array([-1e12]), np.array([1e12]), dtype=np.float32)
+
+        # Each episode is (observations, rewards, rates, actions), where
+        # observations has one more row than the others: the reset observation.
+        self.episodes = []
+        for path in recording_paths.split(","):
+            for session in shim_recording.load_sessions(path, shim_env.RESET_INTERVAL + 1):
+                for steps in session:
+                    self.add_episode(steps, episode_len)
+                for flow_id in set([mi_fields[0] for steps in session for _, mi_fields in steps]):
+                    sender_obs.forget_sender(flow_id)
+        if len(self.episodes) == 0:
+            raise ValueError("No recorded steps in %s" % recording_paths)
+        print("Loaded %d recorded episodes (%d steps)"
+              % (len(self.episodes), sum([len(ep[1]) for ep in self.episodes])))
+
+        self.episode = -1
+        self.steps_taken = 0
+        self.reward_sum = 0.0
+        self.reward_ewma = 0.0
+
+    def add_episode(self, steps, episode_len):
+        history = sender_obs.SenderHistory(self.history_len, self.features, 0)
+        obs = [history.as_array()]
+        rews = []
+        rates = []
+        actions = []
+        # Every live episode starts from the reset rate, and each later
+        # action moves the rate on from the previous MI's.
+        prev_rate = min(max(shim_env.STARTING_RATE, shim_env.MIN_RATE), shim_env.MAX_RATE)
+        for rate, mi_fields in steps:
+            (flow_id, bytes_sent, bytes_acked, bytes_lost, send_start_time,
+             send_end_time, recv_start_time, recv_end_time, rtt_samples,
+             packet_size, utility) = mi_fields
+            history.step(sender_obs.SenderMonitorInterval(
+                flow_id,
+                bytes_sent=bytes_sent,
+                bytes_acked=bytes_acked,
+                bytes_lost=bytes_lost,
+                send_start=send_start_time,
+                send_end=send_end_time,
+                recv_start=recv_start_time,
+                recv_end=recv_end_time,
+                rtt_samples=rtt_samples,
+                packet_size=packet_size
+            ))
+            obs.append(history.as_array())
+            rews.append(self.reward_fn(mi_fields))
+            rates.append(rate)
+            actions.append(implied_action(prev_rate, rate))
+            prev_rate = rate
+        obs = np.array(obs, dtype=np.float32)
+        rews = np.array(rews, dtype=np.float32)
+        rates = np.array(rates)
+        actions = np.array(actions)
+        # Pieces of a longer episode start from its observation at that step.
+        if episode_len is None:
+            episode_len = len(rews)
+        for start in range(0, len(rews), episode_len):
+            end = start + episode_len
+            self.episodes.append((obs[start:end + 1], rews[start:end],
+                                  rates[start:end], actions[start:end]))
+
+    def seed(self, seed=None):
+        self.rand, seed = seeding.np_random(seed)
+        return [seed]
+
+    def step(self, action):
+        obs, rews, rates, actions = self.episodes[self.episode]
+        i = self.steps_taken
+        self.steps_taken += 1
+        self.reward_sum += rews[i]
+        done = (self.steps_taken >= len(rews))
+        return obs[i + 1], rews[i], done, {"recorded_rate":rates[i],
+                                           "recorded_action":actions[i]}
+
+    def reset(self):
+        self.reward_ewma *= 0.99
+        self.reward_ewma += 0.01 * self.reward_sum
+        self.reward_sum = 0.0
+        self.steps_taken = 0
+        if self.shuffle:
+            if self.rand is None:
+                self.seed()
+            self.episode = self.rand.randint(len(self.episodes))
+        else:
+            self.episode = (self.episode + 1) % len(self.episodes)
+        return self.episodes[self.episode][0][0]
+
+    def render(self, mode='human'):
+        pass
+
+    def close(self):
+        if self.viewer:
+            self.viewer.close()
+            self.viewer = None
+
+register(id='NetShimReplay-v0', entry_point='replay_env:ShimReplayEnv')
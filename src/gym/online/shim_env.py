@@ -17,11 +17,11 @@ from gym import spaces
 from gym.utils import seeding
 from gym.envs.registration import register
 import numpy as np
-import ast
 import heapq
 import time
 import random
 import json
+import select
 import socket
 import os
 import sys
@@ -32,7 +32,7 @@ grandparentdir = os.path.dirname(parentdir)
 sys.path.insert(0,parentdir) 
 sys.path.insert(0,grandparentdir) 
 from common.simple_arg_parse import arg_or_default
-from common import sender_obs
+from common import sender_obs, shim_protocol, shim_recording, shim_ring
 
 RESET_INTERVAL = 400
 
@@ -47,6 +47,22 @@ DELTA_SCALE = 0.025# * 1e-12
 RATE_OBS_SCALE = 0.001
 LAT_OBS_SCALE = 0.1
 
+# "shm" also offers the shared memory ring in common/shim_ring.py to a shim
+# on the same host. Senders that cannot use it still connect over TCP.
+SHIM_TRANSPORT = arg_or_default("--shim-transport", default="tcp")
+SHIM_PORT = arg_or_default("--shim-port", default=9787)
+
+# Appends every rate sent and MI received to this file, for replay_env.py.
+SHIM_RECORD_PATH = arg_or_default("--shim-record", default=None)
+
+def apply_rate_delta(rate, action):
+    delta = action * DELTA_SCALE
+    if delta >= 0.0:
+        rate = rate * (1.0 + delta)
+    else:
+        rate = rate / (1.0 - delta)
+    return min(MAX_RATE, max(MIN_RATE, rate))
+
 class ShimNetworkEnv(gym.Env):
     
     def __init__(self, history_len=arg_or_default("--history-len", default=10),
@@ -59,8 +75,15 @@ class ShimNetworkEnv(gym.Env):
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setblocking(1)
-        self.sock.bind(("localhost", 9787))
-
+        self.sock.bind(("localhost", SHIM_PORT))
+
+        self.ring = None
+        if SHIM_TRANSPORT == "shm":
+            self.ring = shim_ring.ShimRing.create(
+                arg_or_default("--shim-ring-name", default=shim_ring.default_name(SHIM_PORT)))
+        self.recorder = None
+        if SHIM_RECORD_PATH is not None:
+            self.recorder = shim_recording.ShimRecorder(SHIM_RECORD_PATH)
         self.conn = None
         self.conn_addr = None
         self.features = features.split(",")
@@ -80,12 +103,7 @@ class ShimNetworkEnv(gym.Env):
         self.reward_ewma = 0.0
 
     def apply_action(self, action):
-        delta = action * DELTA_SCALE
-        #print("Applying delta %f" % delta)
-        if delta >= 0.0:
-            self.set_rate(self.rate * (1.0 + delta))
-        else:
-            self.set_rate(self.rate / (1.0 - delta))
+        self.set_rate(apply_rate_delta(self.rate, action))
 
     def set_rate(self, new_rate):
         self.rate = new_rate
@@ -101,26 +119,19 @@ class ShimNetworkEnv(gym.Env):
 
     def step(self, action):
         if self.conn is None:
-            print("Listening for connection from network sender")
-            self.sock.listen()
-            self.conn, self.addr = self.sock.accept()
+            self.conn = self.wait_for_sender()
+            if self.recorder is not None:
+                self.recorder.start_session()
         self.apply_action(action[0])
-        self.conn.send(str(self.rate).encode())
-        data = self.conn.recv(1024).decode()
-        data = data.split("\n")[-2]
-        vals = data.split(";")
-        flow_id = int(vals[0])
-        bytes_sent = int(vals[1])
-        bytes_acked = int(vals[2])
-        bytes_lost = int(vals[3])
-        send_start_time = float(vals[4])
-        send_end_time = float(vals[5])
-        recv_start_time = float(vals[6])
-        recv_end_time = float(vals[7])
-        rtt_samples = [float(rtt) for rtt in ast.literal_eval(vals[8])]
-        packet_size = int(vals[9])
-        rew = float(vals[10])
-        
+        self.conn.send_rate(self.rate)
+        mi = self.conn.recv_mi()
+        if self.recorder is not None:
+            self.recorder.record_rate(self.rate)
+            self.recorder.record_mi(*mi)
+        (flow_id, bytes_sent, bytes_acked, bytes_lost, send_start_time,
+         send_end_time, recv_start_time, recv_end_time, rtt_samples,
+         packet_size, rew) = mi
+
         self.history.step(sender_obs.SenderMonitorInterval(
             flow_id,
             bytes_sent=bytes_sent,
@@ -138,7 +149,28 @@ class ShimNetworkEnv(gym.Env):
         done = (self.steps_taken > RESET_INTERVAL)
         return self.history.as_array(), rew, done, {}
 
+    # Returns a channel to the first sender that either attaches to the shared
+    # memory ring or connects over TCP.
+    def wait_for_sender(self):
+        print("Listening for connection from network sender")
+        self.sock.listen()
+        while True:
+            if self.ring is not None and self.ring.is_attached():
+                print("Network sender attached over shared memory")
+                return self.ring
+            waiting_on = [self.sock]
+            if self.ring is not None:
+                waiting_on.append(self.ring.mi_fd)
+            readable, _, _ = select.select(waiting_on, [], [], 1.0)
+            if self.sock in readable:
+                conn, self.conn_addr = self.sock.accept()
+                return shim_protocol.SocketChannel(conn)
+
     def reset(self):
+        # A session starts with a fresh episode, so only later resets are
+        # recorded.
+        if self.recorder is not None and self.conn is not None:
+            self.recorder.record_reset()
         self.history = sender_obs.SenderHistory(self.history_len, self.features, 0)
         self.reward_ewma *= 0.99
         self.reward_ewma += 0.01 * self.reward_sum
@@ -155,5 +187,11 @@ class ShimNetworkEnv(gym.Env):
         if self.viewer:
             self.viewer.close()
             self.viewer = None
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
 register(id='NetShim-v0', entry_point='shim_env:ShimNetworkEnv')
@@ -14,13 +14,13 @@
 
 import gym
 import shim_env
-import tensorflow as tf
 
 from stable_baselines.common.policies import MlpPolicy
 from stable_baselines.common.policies import MlpLstmPolicy
 from stable_baselines.common.policies import FeedForwardPolicy
 from stable_baselines.common.vec_env import SubprocVecEnv
 from stable_baselines import PPO1
+from stable_baselines import PPO2
 from stable_baselines import TRPO
 import os
 import sys
@@ -31,6 +31,8 @@ grandparentdir = os.path.dirname(parentdir)
 sys.path.insert(0,parentdir) 
 sys.path.insert(0,grandparentdir) 
 from common.simple_arg_parse import arg_or_default
+import model_export
+import train_monitor
 
 arch_str = arg_or_default("--arch", default="32,16")
 if arch_str == "":
@@ -49,12 +51,20 @@ class MyMlpPolicy(FeedForwardPolicy):
         global my_sess
         my_sess = sess
 
-n_cpu = 1
-env = gym.make('NetShim-v0')
+n_flows = arg_or_default("--n-flows", default=1)
 
 gamma = arg_or_default("--gamma", default=0.99)
 print("gamma = %f" % gamma)
-model = PPO1(MyMlpPolicy, env, verbose=1, schedule='constant', timesteps_per_actorbatch=8192, optim_batchsize=2048, gamma=gamma)
+if n_flows > 1:
+    # Collect from n_flows concurrent pccclient flows. Each PPO2 rollout still
+    # covers about 8192 steps, split evenly across the flows.
+    import shim_vec_env
+    env = shim_vec_env.ShimVecEnv(n_flows)
+    n_steps = train_monitor.ppo2_n_steps(8192, n_flows, nminibatches=4)
+    model = PPO2(MyMlpPolicy, env, verbose=1, n_steps=n_steps, nminibatches=4, gamma=gamma)
+else:
+    env = gym.make('NetShim-v0')
+    model = PPO1(MyMlpPolicy, env, verbose=1, schedule='constant', timesteps_per_actorbatch=8192, optim_batchsize=2048, gamma=gamma)
 model.learn(total_timesteps=(9600 * 410))
 
 ##
@@ -62,29 +72,4 @@ model.learn(total_timesteps=(9600 * 410))
 ##
 default_export_dir = "/tmp/pcc_saved_models/model_A/"
 export_dir = arg_or_default("--model-dir", default=default_export_dir)
-with model.graph.as_default():
-
-    pol = model.policy_pi#act_model
-
-    obs_ph = pol.obs_ph
-    act = pol.deterministic_action
-    sampled_act = pol.action
-
-    obs_input = tf.saved_model.utils.build_tensor_info(obs_ph)
-    outputs_tensor_info = tf.saved_model.utils.build_tensor_info(act)
-    stochastic_act_tensor_info = tf.saved_model.utils.build_tensor_info(sampled_act)
-    signature = tf.saved_model.signature_def_utils.build_signature_def(
-        inputs={"ob":obs_input},
-        outputs={"act":outputs_tensor_info, "stochastic_act":stochastic_act_tensor_info},
-        method_name=tf.saved_model.signature_constants.PREDICT_METHOD_NAME)
-
-    #"""
-    signature_map = {tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY:
-                     signature}
-
-    model_builder = tf.saved_model.builder.SavedModelBuilder(export_dir)
-    model_builder.add_meta_graph_and_variables(model.sess,
-        tags=[tf.saved_model.tag_constants.SERVING],
-        signature_def_map=signature_map,
-        clear_devices=True)
-    model_builder.save(as_text=True)
+model_export.export_saved_model(model, export_dir)
@@ -0,0 +1,308 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import collections
+import queue
+import threading
+
+import numpy as np
+from stable_baselines.common.vec_env import VecEnv
+
+import shim_env
+from common import sender_obs, shim_protocol
+
+# A vectorized online training environment. An asyncio server running on a
+# background thread accepts any number of pccclient flows (each loading
+# udt-plugins/training/shim.py), and every flow becomes one of n_flows
+# sub-environments. Flows beyond n_flows wait until a slot frees up. When a
+# flow disconnects, its sub-environment ends the episode and the next waiting
+# or newly connecting flow starts a fresh one in that slot. Every step waits
+# until all slots have a flow, so the learner only sees real transitions.
+
+class ShimFlowServer():
+
+    def __init__(self, n_slots, host="localhost", port=9787):
+        self.n_slots = n_slots
+        self.writers = [None] * n_slots
+        # Incremented each time a flow attaches to a slot, so that messages
+        # from a departed flow can be told apart from its successor's.
+        self.generations = [0] * n_slots
+        self.mi_queues = [queue.Queue() for _ in range(n_slots)]
+        self.standby = collections.deque()
+        self.cond = threading.Condition()
+        self.ready = threading.Event()
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, args=(host, port),
+                                       name="shim-flow-server")
+        self.thread.daemon = True
+        self.thread.start()
+        self.ready.wait()
+
+    def _run(self, host, port):
+        asyncio.set_event_loop(self.loop)
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self._handle_flow, host, port))
+        print("Listening for network senders on %s:%d" % (host, port))
+        self.ready.set()
+        self.loop.run_forever()
+
+    def _assign(self, slot, writer):
+        with self.cond:
+            self.writers[slot] = writer
+            self.generations[slot] += 1
+            self.cond.notify_all()
+            return self.generations[slot]
+
+    async def _attach(self, writer):
+        for slot in range(0, self.n_slots):
+            if self.writers[slot] is None:
+                return slot, self._assign(slot, writer)
+        waiter = self.loop.create_future()
+        self.standby.append((waiter, writer))
+        return await waiter
+
+    def _detach(self, slot, generation):
+        with self.cond:
+            self.writers[slot] = None
+            self.mi_queues[slot].put((generation, None))
+            self.cond.notify_all()
+        while len(self.standby) > 0:
+            waiter, writer = self.standby.popleft()
+            if not waiter.cancelled():
+                waiter.set_result((slot, self._assign(slot, writer)))
+                return
+
+    async def _handle_flow(self, reader, writer):
+        slot, generation = await self._attach(writer)
+        print("Network sender joined as flow %d" % slot)
+        try:
+            while True:
+                msg_type, payload = await shim_protocol.read_frame(reader)
+                if msg_type == shim_protocol.MSG_MI:
+                    self.mi_queues[slot].put((generation, shim_protocol.decode_mi(payload)))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            print("Network sender left flow %d" % slot)
+            self._detach(slot, generation)
+            writer.close()
+
+    def n_attached(self):
+        return len([w for w in self.writers if w is not None])
+
+    def wait_for_flows(self, n):
+        with self.cond:
+            while self.n_attached() < n:
+                self.cond.wait()
+
+    def generation(self, slot):
+        with self.cond:
+            if self.writers[slot] is None:
+                return None
+            return self.generations[slot]
+
+    # Returns False if the flow with the given generation has already left.
+    def send_rate(self, slot, generation, rate):
+        with self.cond:
+            writer = self.writers[slot]
+            if writer is None or self.generations[slot] != generation:
+                return False
+        self.loop.call_soon_threadsafe(writer.write, shim_protocol.encode_rate(rate))
+        return True
+
+    # Blocks for the next MI from the given flow; None means the flow left.
+    def recv_mi(self, slot, generation):
+        while True:
+            mi_generation, mi = self.mi_queues[slot].get()
+            if mi_generation == generation:
+                return mi
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+class ShimVecEnv(VecEnv):
+
+    def __init__(self, n_flows, port=9787,
+                 history_len=shim_env.arg_or_default("--history-len", default=10),
+                 features=shim_env.arg_or_default("--input-features",
+                    default="sent latency inflation,"
+                          + "latency ratio,"
+                          + "send ratio"),
+                 gamma=shim_env.arg_or_default("--gamma", default=0.99),
+                 reward_window=10):
+        self.features = features.split(",")
+        self.gamma = gamma
+        self.history_len = history_len
+        single_obs_min_vec = sender_obs.get_min_obs_vector(self.features)
+        single_obs_max_vec = sender_obs.get_max_obs_vector(self.features)
+        observation_space = shim_env.spaces.Box(np.tile(single_obs_min_vec, self.history_len),
+                                                np.tile(single_obs_max_vec, self.history_len),
+                                                dtype=np.float32)
+        action_space = shim_env.spaces.Box(np.array([-1e12]), np.array([1e12]), dtype=np.float32)
+        VecEnv.__init__(self, n_flows, observation_space, action_space)
+
+        self.server = ShimFlowServer(n_flows, port=port)
+        self.flow_generations = [None] * n_flows
+        self.histories = [None] * n_flows
+        self.rates = [shim_env.STARTING_RATE] * n_flows
+        self.steps_taken = [0] * n_flows
+        self.reward_sums = [0.0] * n_flows
+        self.recent_rewards = [collections.deque(maxlen=reward_window) for _ in range(0, n_flows)]
+        self.reward_ewma = 0.0
+        self.actions = None
+        for i in range(0, n_flows):
+            self._reset_slot(i)
+
+    def _sender_id(self, i):
+        return (i, self.flow_generations[i])
+
+    def _reset_slot(self, i):
+        self.reward_ewma *= 0.99
+        self.reward_ewma += 0.01 * self.reward_sums[i]
+        self.reward_sums[i] = 0.0
+        self.recent_rewards[i].clear()
+        self.steps_taken[i] = 0
+        self.rates[i] = shim_env.STARTING_RATE
+        return self._new_history(i)
+
+    def _new_history(self, i):
+        self.histories[i] = sender_obs.SenderHistory(self.history_len,
+                                                     self.features,
+                                                     self._sender_id(i))
+        return self.histories[i].as_array()
+
+    # Blocks until every slot has a flow. A slot whose flow left already
+    # ended its episode and returned a fresh observation, which is the same
+    # as that of the history its new flow starts with.
+    def _fill_slots(self):
+        while True:
+            self.server.wait_for_flows(self.num_envs)
+            for i in range(0, self.num_envs):
+                if self.flow_generations[i] is None:
+                    generation = self.server.generation(i)
+                    if generation is not None:
+                        self.flow_generations[i] = generation
+                        self._new_history(i)
+            if None not in self.flow_generations:
+                return
+
+    def reset(self):
+        self._fill_slots()
+        return np.array([self._reset_slot(i) for i in range(0, self.num_envs)])
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        obs = [None] * self.num_envs
+        rews = np.zeros(self.num_envs, dtype=np.float32)
+        dones = np.zeros(self.num_envs, dtype=np.bool_)
+        infos = [{} for _ in range(0, self.num_envs)]
+
+        # A flow that leaves before its first MI has no transition to report,
+        # so its action goes to the flow that replaces it instead.
+        pending = list(range(0, self.num_envs))
+        while len(pending) > 0:
+            self._fill_slots()
+            retry = []
+            # Send every flow its new rate before waiting on any of them, so
+            # the flows measure their next MIs in parallel.
+            sent = []
+            for i in pending:
+                generation = self.flow_generations[i]
+                self.rates[i] = shim_env.apply_rate_delta(self.rates[i], self.actions[i][0])
+                if self.server.send_rate(i, generation, self.rates[i]):
+                    sent.append(i)
+                else:
+                    self._flow_left(i, obs, rews, dones, infos, retry)
+
+            for i in sent:
+                mi = self.server.recv_mi(i, self.flow_generations[i])
+                if mi is None:
+                    self._flow_left(i, obs, rews, dones, infos, retry)
+                    continue
+                self._record_mi(i, mi, obs, rews, dones, infos)
+            pending = retry
+        return np.array(obs), rews, dones, infos
+
+    def _record_mi(self, i, mi, obs, rews, dones, infos):
+        (flow_id, bytes_sent, bytes_acked, bytes_lost, send_start_time,
+         send_end_time, recv_start_time, recv_end_time, rtt_samples,
+         packet_size, rew) = mi
+        self.histories[i].step(sender_obs.SenderMonitorInterval(
+            self._sender_id(i),
+            bytes_sent=bytes_sent,
+            bytes_acked=bytes_acked,
+            bytes_lost=bytes_lost,
+            send_start=send_start_time,
+            send_end=send_end_time,
+            recv_start=recv_start_time,
+            recv_end=recv_end_time,
+            rtt_samples=rtt_samples,
+            packet_size=packet_size
+        ))
+        rews[i] = rew
+        self.reward_sums[i] += rew
+        self.recent_rewards[i].append(rew)
+        self.steps_taken[i] += 1
+        obs[i] = self.histories[i].as_array()
+        if self.steps_taken[i] > shim_env.RESET_INTERVAL:
+            dones[i] = True
+            infos[i]["terminal_observation"] = obs[i]
+            obs[i] = self._reset_slot(i)
+
+    # A flow that leaves before its first MI is replaced and its slot
+    # retried. One that leaves mid-episode ends it, but its last action was
+    # never measured and the episode did not really terminate. PPO2 treats
+    # every done as terminal, so, as in SimulatedNetworkEnv's steady-state
+    # "end" mode, the step's reward is the discounted value of the rest of
+    # the episode at the flow's recent mean reward instead of a made-up 0.
+    # It is not counted in the episode's reward.
+    def _flow_left(self, i, obs, rews, dones, infos, retry):
+        sender_obs.forget_sender(self._sender_id(i))
+        self.flow_generations[i] = None
+        if self.steps_taken[i] == 0:
+            self.rates[i] = shim_env.STARTING_RATE
+            retry.append(i)
+            return
+        remaining = shim_env.RESET_INTERVAL + 1 - self.steps_taken[i]
+        value = 0.0
+        if len(self.recent_rewards[i]) > 0 and remaining > 0:
+            value = (np.mean(self.recent_rewards[i]) * (1.0 - self.gamma ** remaining)
+                     / (1.0 - self.gamma))
+        rews[i] = value
+        dones[i] = True
+        infos[i]["terminal_observation"] = self.histories[i].as_array()
+        infos[i]["flow_left"] = True
+        infos[i]["flow_left_value"] = value
+        obs[i] = self._reset_slot(i)
+
+    def print_rewards(self):
+        print("Ewma Reward: %0.2f over %d flows" % (self.reward_ewma, self.server.n_attached()))
+
+    def close(self):
+        self.server.close()
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self, method_name)(*method_args, **method_kwargs)
+                for _ in self._get_indices(indices)]
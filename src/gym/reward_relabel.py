@@ -0,0 +1,126 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+##
+#   Recomputes the rewards of saved rollouts with other reward formulas,
+#   without running the simulator again.
+#
+#   usage: python3 reward_relabel.py --rollout-dir=<dir>
+#              [--reward=very-high-thpt,super-high-thpt,high-thpt,low-latency,exponential,cutoff]
+#              [--output-dir=<dir>] [--output=<summary.csv>]
+#
+#   Rollouts come from stable_solve.py --rollout-dir. Every formula in
+#   --reward (a name from rewards.py or "module:function") is applied to all
+#   logged steps at once. The summary compares each formula's episode returns
+#   with the logged ones, and says which formula reproduces the logged reward.
+#   With --output-dir, each episode is copied there with an extra
+#   reward_<formula> array per formula, ready to use as an offline dataset.
+##
+
+import inspect
+import os
+import sys
+import time
+
+import numpy as np
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from common.simple_arg_parse import arg_or_default
+import rewards
+import rollout_log
+
+def relabel(columns, reward_name):
+    reward_function = rewards.get_reward_function(reward_name)
+    return reward_function(columns["throughput"], columns["latency"], columns["loss"],
+                           columns["bw"], columns["delay"], columns["loss_rate"]) * rewards.REWARD_SCALE
+
+def episode_returns(step_rewards, episode, n_episodes):
+    return np.bincount(episode, weights=step_rewards, minlength=n_episodes)
+
+def array_name(reward_name):
+    return "reward_" + "".join([c if c.isalnum() else "_" for c in reward_name])
+
+def summarize(reward_name, relabeled, logged, episode, n_episodes):
+    returns = episode_returns(relabeled, episode, n_episodes)
+    logged_returns = episode_returns(logged, episode, n_episodes)
+    if n_episodes > 1 and np.std(returns) > 0.0 and np.std(logged_returns) > 0.0:
+        corr = float(np.corrcoef(returns, logged_returns)[0, 1])
+    else:
+        corr = float("nan")
+    return {"reward":reward_name, "episodes":n_episodes,
+            "mean_return":float(np.mean(returns)), "std_return":float(np.std(returns)),
+            "mean_step_reward":float(np.mean(relabeled)),
+            "corr_with_logged":corr,
+            "matches_logged":bool(np.allclose(relabeled, logged, rtol=1e-6, atol=1e-9))}
+
+def write_relabeled(paths, columns, relabeled, output_dir):
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    episode = columns["episode"]
+    for i, path in enumerate(paths):
+        mask = episode == i
+        with np.load(path) as data:
+            arrays = {name:data[name] for name in data.files}
+        for reward_name, values in relabeled.items():
+            arrays[array_name(reward_name)] = values[mask]
+        np.savez(os.path.join(output_dir, os.path.basename(path)), **arrays)
+
+def main():
+    rollout_dir = arg_or_default("--rollout-dir", "./pcc_rollouts")
+    reward_names = arg_or_default("--reward", ",".join(rewards.REWARD_FUNCTIONS.keys())).split(",")
+    output_dir = arg_or_default("--output-dir", None)
+    output = arg_or_default("--output", None)
+
+    paths = rollout_log.list_rollouts(rollout_dir)
+    if len(paths) == 0:
+        print("No rollouts in %s" % rollout_dir)
+        sys.exit(1)
+    start = time.time()
+    columns = rollout_log.load_rollouts(paths)
+    n_steps = len(columns["reward"])
+    print("Loaded %d steps from %d episodes in %0.1fs" % (n_steps, len(paths), time.time() - start))
+
+    start = time.time()
+    relabeled = {}
+    for reward_name in reward_names:
+        relabeled[reward_name] = relabel(columns, reward_name)
+    elapsed = time.time() - start
+    print("Relabeled with %d formulas in %0.2fs (%0.0f steps/s)"
+          % (len(reward_names), elapsed, len(reward_names) * n_steps / max(elapsed, 1e-9)))
+
+    # The formulas give the per-step reward, without the value of skipped
+    # steps the simulator adds when it ends an episode at a steady state.
+    logged = columns["reward"] - columns["steady_state_bonus"]
+    rows = [summarize(name, relabeled[name], logged, columns["episode"], len(paths))
+            for name in reward_names]
+    print("%20s %14s %14s %10s %8s" % ("reward", "mean return", "std return", "corr", "logged"))
+    for row in rows:
+        print("%20s %14.2f %14.2f %10.3f %8s" % (row["reward"], row["mean_return"], row["std_return"],
+                                                 row["corr_with_logged"],
+                                                 "yes" if row["matches_logged"] else ""))
+
+    if output is not None:
+        with open(output, "w") as f:
+            f.write(",".join(rows[0].keys()) + "\n")
+            for row in rows:
+                f.write(",".join([str(v) for v in row.values()]) + "\n")
+    if output_dir is not None:
+        write_relabeled(paths, columns, relabeled, output_dir)
+        print("Wrote %d relabeled episodes to %s" % (len(paths), output_dir))
+
+if __name__ == "__main__":
+    main()
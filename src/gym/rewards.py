@@ -0,0 +1,78 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import importlib
+
+import numpy as np
+
+# Reward formulas for the simulator, as functions of a monitor interval's
+# throughput (bits/s), average latency (s) and loss ratio, plus the link's
+# bandwidth (packets/s), delay (s) and random loss rate. They use NumPy
+# operations only, so the same function rewards one step in
+# Network.run_for_dur or relabels a whole dataset of logged steps at once
+# (see reward_relabel.py). The simulator multiplies the result by
+# REWARD_SCALE. The formulas are kept exactly as they were first written in
+# run_for_dur, including the extra REWARD_SCALE factor in some of them.
+
+REWARD_SCALE = 0.001
+BYTES_PER_PACKET = 1500
+
+# Observation scales of the online environment, used by the older formulas.
+RATE_OBS_SCALE = 0.001
+LAT_OBS_SCALE = 0.1
+
+LATENCY_PENALTY = 1.0
+LOSS_PENALTY = 1.0
+
+def very_high_thpt(thpt, lat, loss, bw, delay, loss_rate):
+    return 10.0 * thpt / (8 * BYTES_PER_PACKET) - 1e3 * lat - 2e3 * loss
+
+def super_high_thpt(thpt, lat, loss, bw, delay, loss_rate):
+    return REWARD_SCALE * (20.0 * thpt / RATE_OBS_SCALE - 1e3 * lat / LAT_OBS_SCALE - 2e3 * loss)
+
+def high_thpt(thpt, lat, loss, bw, delay, loss_rate):
+    return REWARD_SCALE * (5.0 * thpt / RATE_OBS_SCALE - 1e3 * lat / LAT_OBS_SCALE - 2e3 * loss)
+
+def low_latency(thpt, lat, loss, bw, delay, loss_rate):
+    return REWARD_SCALE * (2.0 * thpt / RATE_OBS_SCALE - 1e3 * lat / LAT_OBS_SCALE - 2e3 * loss)
+
+def exponential(thpt, lat, loss, bw, delay, loss_rate):
+    return (thpt / RATE_OBS_SCALE) * np.exp(-1 * (LATENCY_PENALTY * lat / LAT_OBS_SCALE + LOSS_PENALTY * loss))
+
+# 1 when the interval met every target, else 0.
+def cutoff(thpt, lat, loss, bw, delay, loss_rate):
+    bw_cutoff = bw * 0.8
+    lat_cutoff = 2.0 * delay * 1.5
+    loss_cutoff = 2.0 * loss_rate * 1.5
+    missed = (loss > 0.1) | (thpt < bw_cutoff) | (lat > lat_cutoff) | (loss > loss_cutoff)
+    return np.where(missed, 0.0, 1.0)
+
+REWARD_FUNCTIONS = {
+    "very-high-thpt":very_high_thpt,
+    "super-high-thpt":super_high_thpt,
+    "high-thpt":high_thpt,
+    "low-latency":low_latency,
+    "exponential":exponential,
+    "cutoff":cutoff,
+}
+
+# Looks up a formula by name, or imports one given as "module:function".
+def get_reward_function(name):
+    if name in REWARD_FUNCTIONS:
+        return REWARD_FUNCTIONS[name]
+    if ":" in name:
+        module_name, func_name = name.split(":", 1)
+        return getattr(importlib.import_module(module_name), func_name)
+    raise ValueError("Unknown reward function %s (known: %s)"
+                     % (name, ", ".join(sorted(REWARD_FUNCTIONS.keys()))))
@@ -0,0 +1,296 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+##
+#   Converts saved rollouts into a sharded dataset.
+#
+#   usage: python3 rollout_dataset.py --rollout-dir=<dir> --dataset-dir=<dir>
+#              [--shard-rows=1048576]
+#
+#   Rollouts come from stable_solve.py --rollout-dir. stable_solve.py
+#   --dataset-dir writes the same dataset directly while training.
+##
+
+import glob
+import inspect
+import json
+import os
+import sys
+
+import numpy as np
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from common.simple_arg_parse import arg_or_default
+
+# A rollout dataset is a directory of fixed-size shards, one row per step:
+#
+#   <dataset_dir>/index.json              fields, shards and row counts
+#   <dataset_dir>/shard_<n>/<field>.npy   one array per field
+#
+# The fields are those of rollout_log.py's episodes plus done (the last step
+# of each episode) and episode (its number in this dataset), with the link
+# parameters repeated on every row. A done row with truncated set ended at a
+# steady state rather than terminally; bootstrap from its next_obs after
+# taking steady_state_bonus out of its reward. Each field is a plain .npy file, so
+# RolloutDataset can memory-map the shards and read only the rows it serves.
+# Every shard but the last of each writer holds shard_rows rows.
+#
+# A ShardWriter on an existing dataset appends to it in new shards, numbering
+# its episodes after the existing ones. RolloutDataset numbers the episodes of
+# several datasets one after another, so episode ids stay unique.
+
+INDEX_VERSION = 1
+
+# Fields older rollouts lack, and their defaults, as in rollout_log.py (not
+# imported here, since it needs gym).
+OPTIONAL_FIELDS = {"truncated":np.bool_, "steady_state_bonus":np.float64}
+
+class ShardWriter():
+
+    def __init__(self, dataset_dir, shard_rows=1 << 20):
+        self.dataset_dir = dataset_dir
+        self.shard_rows = shard_rows
+        self.fields = None
+        self.shards = []
+        self.shard = None
+        self.shard_fill = 0
+        self.n_episodes = 0
+        if not os.path.isdir(dataset_dir):
+            os.makedirs(dataset_dir)
+        index_path = os.path.join(dataset_dir, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+            if index["version"] != INDEX_VERSION:
+                raise ValueError("Cannot append to %s: index version %d, expected %d"
+                                 % (dataset_dir, index["version"], INDEX_VERSION))
+            self.fields = {name:(field["dtype"], tuple(field["shape"]))
+                           for name, field in index["fields"].items()}
+            self.shards = index["shards"]
+            self.n_episodes = index["episodes"]
+        elif len(os.listdir(dataset_dir)) > 0:
+            raise ValueError("%s is not empty and has no index.json" % dataset_dir)
+
+    def shard_dir(self, n):
+        return os.path.join(self.dataset_dir, "shard_%05d" % n)
+
+    def open_shard(self):
+        n = len(self.shards)
+        os.makedirs(self.shard_dir(n), exist_ok=True)
+        self.shard = {}
+        for name, (dtype, shape) in self.fields.items():
+            self.shard[name] = np.lib.format.open_memmap(
+                os.path.join(self.shard_dir(n), name + ".npy"), mode="w+",
+                dtype=dtype, shape=(self.shard_rows,) + tuple(shape))
+        self.shards.append({"name":"shard_%05d" % n, "rows":0})
+        self.shard_fill = 0
+
+    def add_episode(self, arrays):
+        n_steps = len(arrays["reward"])
+        if n_steps == 0:
+            return
+        arrays = dict(arrays)
+        for name, value in list(arrays.items()):
+            if np.ndim(value) == 0:
+                arrays[name] = np.full(n_steps, value)
+        done = np.zeros(n_steps, dtype=np.bool_)
+        done[-1] = True
+        arrays["done"] = done
+        for name, dtype in OPTIONAL_FIELDS.items():
+            if name not in arrays:
+                arrays[name] = np.zeros(n_steps, dtype=dtype)
+        arrays["episode"] = np.full(n_steps, self.n_episodes, dtype=np.int64)
+        fields = {name:(np.asarray(value).dtype.str, tuple(np.shape(value)[1:]))
+                  for name, value in sorted(arrays.items())}
+        if self.fields is None:
+            self.fields = fields
+        elif fields != self.fields:
+            raise ValueError("Episode fields %s do not match the dataset's %s"
+                             % (str(fields), str(self.fields)))
+
+        written = 0
+        while written < n_steps:
+            if self.shard is None or self.shard_fill == self.shard_rows:
+                self.close_shard()
+                self.open_shard()
+            n = min(n_steps - written, self.shard_rows - self.shard_fill)
+            for name, column in self.shard.items():
+                column[self.shard_fill:self.shard_fill + n] = arrays[name][written:written + n]
+            self.shard_fill += n
+            self.shards[-1]["rows"] = self.shard_fill
+            written += n
+        self.n_episodes += 1
+        # Keep the index current, so a crash only loses unflushed rows.
+        for column in self.shard.values():
+            column.flush()
+        self.write_index()
+
+    def close_shard(self):
+        if self.shard is None:
+            return
+        for column in self.shard.values():
+            column.flush()
+        self.shard = None
+
+    def write_index(self):
+        index = {"version":INDEX_VERSION, "shard_rows":self.shard_rows,
+                 "fields":{name:{"dtype":dtype, "shape":list(shape)}
+                           for name, (dtype, shape) in self.fields.items()},
+                 "shards":self.shards, "rows":sum([s["rows"] for s in self.shards]),
+                 "episodes":self.n_episodes}
+        tmp_path = os.path.join(self.dataset_dir, ".index.json")
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, indent=4)
+        os.replace(tmp_path, os.path.join(self.dataset_dir, "index.json"))
+
+    # Flushes the last shard and cuts it down to its rows.
+    def close(self):
+        if self.shard is None:
+            return
+        n = len(self.shards) - 1
+        rows = self.shard_fill
+        for name, column in self.shard.items():
+            path = os.path.join(self.shard_dir(n), name + ".npy")
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, column[:rows])
+            os.replace(tmp_path, path)
+        self.shard = None
+        self.write_index()
+
+# Every dataset directory under the given paths, including the per-worker
+# datasets stable_solve.py writes.
+def find_datasets(paths):
+    dataset_dirs = []
+    for path in paths:
+        if os.path.exists(os.path.join(path, "index.json")):
+            dataset_dirs.append(path)
+        else:
+            dataset_dirs += sorted([os.path.dirname(p) for p in
+                                    glob.glob(os.path.join(path, "*", "index.json"))])
+    return dataset_dirs
+
+class RolloutDataset():
+
+    def __init__(self, paths):
+        if isinstance(paths, str):
+            paths = [paths]
+        self.shards = []
+        # Added to the episode ids of each shard, so that those of different
+        # datasets do not collide.
+        self.episode_offsets = []
+        self.fields = None
+        self.n_episodes = 0
+        for dataset_dir in find_datasets(paths):
+            with open(os.path.join(dataset_dir, "index.json")) as f:
+                index = json.load(f)
+            if self.fields is None:
+                self.fields = index["fields"]
+            for shard in index["shards"]:
+                if shard["rows"] > 0:
+                    self.shards.append((os.path.join(dataset_dir, shard["name"]), shard["rows"]))
+                    self.episode_offsets.append(self.n_episodes)
+            self.n_episodes += index["episodes"]
+        if self.fields is None:
+            raise ValueError("No rollout datasets in %s" % ", ".join(paths))
+        self.shard_starts = np.cumsum([0] + [rows for _, rows in self.shards])
+        self.n_rows = int(self.shard_starts[-1])
+        self.columns = {}
+
+    def __len__(self):
+        return self.n_rows
+
+    # The memory-mapped rows of one field in one shard.
+    def column(self, shard, name):
+        key = (shard, name)
+        if key not in self.columns:
+            shard_dir, rows = self.shards[shard]
+            self.columns[key] = np.load(os.path.join(shard_dir, name + ".npy"), mmap_mode="r")[:rows]
+        return self.columns[key]
+
+    # Rows start to end of the whole dataset, across shards.
+    def read(self, name, start, end):
+        parts = []
+        shard = int(np.searchsorted(self.shard_starts, start, side="right")) - 1
+        while start < end and shard < len(self.shards):
+            offset = start - self.shard_starts[shard]
+            n = min(end - start, self.shards[shard][1] - offset)
+            part = np.asarray(self.column(shard, name)[offset:offset + n])
+            if name == "episode":
+                part = part + self.episode_offsets[shard]
+            parts.append(part)
+            start += n
+            shard += 1
+        return np.concatenate(parts)
+
+    # Mini-batches of the given fields in random order. The dataset is split
+    # into chunks of chunk_rows consecutive rows; chunks are visited in a
+    # random order, buffer_chunks at a time, and the rows of each buffer are
+    # shuffled together. Only one buffer is in memory at a time.
+    def batches(self, batch_size, fields=None, shuffle=True, seed=0, epochs=1,
+                chunk_rows=4096, buffer_chunks=64, drop_last=False):
+        if fields is None:
+            fields = sorted(self.fields.keys())
+        rand = np.random.RandomState(seed)
+        chunk_starts = np.arange(0, self.n_rows, chunk_rows)
+        for _ in range(0, epochs):
+            order = rand.permutation(len(chunk_starts)) if shuffle else np.arange(len(chunk_starts))
+            carry = None
+            for group_start in range(0, len(order), buffer_chunks):
+                # Read the chunks in file order, then shuffle in memory.
+                group = np.sort(chunk_starts[order[group_start:group_start + buffer_chunks]])
+                buffer = {}
+                for name in fields:
+                    buffer[name] = np.concatenate(
+                        [self.read(name, start, min(self.n_rows, start + chunk_rows)) for start in group])
+                if carry is not None:
+                    for name in fields:
+                        buffer[name] = np.concatenate([carry[name], buffer[name]])
+                n = len(buffer[fields[0]])
+                perm = rand.permutation(n) if shuffle else np.arange(n)
+                n_full = (n // batch_size) * batch_size
+                for start in range(0, n_full, batch_size):
+                    rows = perm[start:start + batch_size]
+                    yield {name:buffer[name][rows] for name in fields}
+                carry = {name:buffer[name][perm[n_full:]] for name in fields}
+            if carry is not None and len(carry[fields[0]]) > 0 and not drop_last:
+                yield carry
+
+def export_rollouts(rollout_dir, dataset_dir, shard_rows):
+    writer = ShardWriter(dataset_dir, shard_rows)
+    for path in sorted(glob.glob(os.path.join(rollout_dir, "*.npz"))):
+        with np.load(path) as data:
+            arrays = {name:data[name] for name in data.files}
+        if "next_obs" not in arrays:
+            # Older episodes; the last step's next observation is unknown,
+            # and marked done.
+            arrays["next_obs"] = np.concatenate([arrays["obs"][1:], arrays["obs"][-1:]])
+        writer.add_episode(arrays)
+    writer.close()
+    return writer
+
+def main():
+    rollout_dir = arg_or_default("--rollout-dir", "./pcc_rollouts")
+    dataset_dir = arg_or_default("--dataset-dir", "./pcc_dataset")
+    shard_rows = arg_or_default("--shard-rows", 1 << 20)
+    writer = export_rollouts(rollout_dir, dataset_dir, shard_rows)
+    print("Wrote %d episodes, %d rows in %d shards to %s"
+          % (writer.n_episodes, sum([s["rows"] for s in writer.shards]), len(writer.shards),
+             dataset_dir))
+
+if __name__ == "__main__":
+    main()
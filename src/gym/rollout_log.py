@@ -0,0 +1,134 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import glob
+import os
+
+import gym
+import numpy as np
+
+# Saves the simulator's rollouts together with the raw statistics behind each
+# reward, so rewards can be recomputed offline with any formula from
+# rewards.py (see reward_relabel.py). Each finished episode is written to
+#
+#   <rollout_dir>/<prefix>_<episode>.npz
+#
+# with one row per step in obs (the observation the action was chosen from),
+# action, reward, next_obs, throughput, latency, loss and send_rate, and the
+# link's bw, delay, queue and loss_rate as scalars. truncated marks the last
+# step of an episode the simulator cut short at a steady state, which should
+# be bootstrapped rather than treated as terminal, and steady_state_bonus is
+# the value of the skipped steps that "end" mode added to its reward.
+# Episodes cut short by the end of training are not written. Given a writer, such as
+# rollout_dataset.ShardWriter, finished episodes go to its add_episode
+# instead of to separate files.
+
+STEP_FIELDS = ["throughput", "latency", "loss", "send_rate"]
+# Fields missing from older rollouts, and their defaults.
+OPTIONAL_FIELDS = {"truncated":np.bool_, "steady_state_bonus":np.float64}
+LINK_FIELDS = ["bw", "delay", "queue", "loss_rate"]
+
+class RolloutLogger(gym.Wrapper):
+
+    def __init__(self, env, rollout_dir=None, prefix="rollout", writer=None):
+        gym.Wrapper.__init__(self, env)
+        self.rollout_dir = rollout_dir
+        self.prefix = prefix
+        self.writer = writer
+        self.episode = 0
+        self.last_obs = None
+        self.clear()
+        if writer is None and not os.path.isdir(rollout_dir):
+            os.makedirs(rollout_dir, exist_ok=True)
+
+    def clear(self):
+        self.rows = {"obs":[], "action":[], "reward":[], "next_obs":[], "truncated":[],
+                     "steady_state_bonus":[]}
+        for field in STEP_FIELDS:
+            self.rows[field] = []
+
+    def reset(self, **kwargs):
+        self.clear()
+        self.last_obs = self.env.reset(**kwargs)
+        return self.last_obs
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
+        self.rows["obs"].append(self.last_obs)
+        self.rows["action"].append(np.asarray(action, dtype=np.float32).reshape(-1))
+        self.rows["reward"].append(reward)
+        self.rows["next_obs"].append(obs)
+        self.rows["truncated"].append(bool(info.get("steady_state", False)))
+        self.rows["steady_state_bonus"].append(info.get("steady_state_bonus", 0.0))
+        for field in STEP_FIELDS:
+            self.rows[field].append(info[field])
+        self.last_obs = obs
+        if done:
+            self.write_episode()
+        return obs, reward, done, info
+
+    def write_episode(self):
+        arrays = {}
+        for name, values in self.rows.items():
+            # Full precision for the statistics, so relabeling with the
+            # training formula reproduces the logged reward.
+            if name in ["obs", "action", "next_obs"]:
+                dtype = np.float32
+            else:
+                dtype = OPTIONAL_FIELDS.get(name, np.float64)
+            arrays[name] = np.array(values, dtype=dtype)
+        for name, value in zip(LINK_FIELDS, self.env.unwrapped.link_params()):
+            arrays[name] = np.float64(value)
+        if self.writer is not None:
+            self.writer.add_episode(arrays)
+            self.episode += 1
+            self.clear()
+            return
+        path = os.path.join(self.rollout_dir, "%s_%06d.npz" % (self.prefix, self.episode))
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        self.episode += 1
+        self.clear()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        return self.env.close()
+
+def list_rollouts(rollout_dir):
+    return sorted(glob.glob(os.path.join(rollout_dir, "*.npz")))
+
+# Concatenates every episode in the given files into flat columns, with the
+# link parameters repeated for each step and an "episode" column mapping
+# each step back to its file.
+def load_rollouts(paths):
+    columns = {}
+    for episode, path in enumerate(paths):
+        with np.load(path) as data:
+            n_steps = len(data["reward"])
+            for name in data.files:
+                value = data[name]
+                if value.ndim == 0:
+                    value = np.full(n_steps, value, dtype=np.float64)
+                columns.setdefault(name, []).append(value)
+            for name, dtype in OPTIONAL_FIELDS.items():
+                if name not in data.files:
+                    columns.setdefault(name, []).append(np.zeros(n_steps, dtype=dtype))
+            columns.setdefault("episode", []).append(np.full(n_steps, episode, dtype=np.int64))
+    for name in columns.keys():
+        columns[name] = np.concatenate(columns[name])
+    return columns
@@ -0,0 +1,89 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+##
+#   Checks that changes to the simulator's event loop leave rate mode
+#   bit-identical.
+#
+#   usage: python3 sim_regression.py [--n-episodes=3] [--episode-steps=100]
+#
+#   Runs seeded episodes with seeded random actions, in rate mode and in
+#   window mode, and hashes every observation and reward. The rate mode hash
+#   must match RATE_MODE_DIGEST, taken with the default simulator settings;
+#   the script exits with status 1 if it does not. Window mode results are
+#   allowed to change, so its hash and rewards are only printed, to be quoted
+#   when a change affects them.
+##
+
+import contextlib
+import hashlib
+import inspect
+import io
+import os
+import random
+import sys
+
+import numpy as np
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from common.simple_arg_parse import arg_or_default
+import network_sim
+
+RATE_MODE_DIGEST = "f1b69d987f8c08afef493de226636f5e99657ced"
+
+def run(use_cwnd, n_episodes, episode_steps):
+    h = hashlib.sha1()
+    episode_rewards = []
+    for episode in range(0, n_episodes):
+        random.seed(episode)
+        np.random.seed(episode)
+        actions = np.random.RandomState(episode).uniform(-1.0, 1.0, (episode_steps, 2))
+        # The simulator prints every episode.
+        with contextlib.redirect_stdout(io.StringIO()):
+            env = network_sim.SimulatedNetworkEnv(use_cwnd=use_cwnd)
+            env.seed(episode)
+            env.max_steps = episode_steps
+            obs = env.reset()
+            h.update(np.asarray(obs, dtype=np.float64).tobytes())
+            total = 0.0
+            for action in actions:
+                obs, reward, done, _ = env.step(action[:env.action_space.shape[0]])
+                h.update(np.asarray(obs, dtype=np.float64).tobytes())
+                h.update(np.float64(reward).tobytes())
+                total += reward
+                if done:
+                    break
+        episode_rewards.append(total)
+    return h.hexdigest(), episode_rewards
+
+def main():
+    n_episodes = arg_or_default("--n-episodes", 3)
+    episode_steps = arg_or_default("--episode-steps", 100)
+    rate_digest, rate_rewards = run(False, n_episodes, episode_steps)
+    window_digest, window_rewards = run(True, n_episodes, episode_steps)
+    print("Rate mode:   %s, reward %0.1f" % (rate_digest, sum(rate_rewards)))
+    print("Window mode: %s, reward %0.1f" % (window_digest, sum(window_rewards)))
+    if (n_episodes, episode_steps) != (3, 100):
+        print("Not the reference episodes; nothing to compare against")
+        return
+    if rate_digest != RATE_MODE_DIGEST:
+        print("Rate mode changed (expected %s)" % RATE_MODE_DIGEST)
+        exit(1)
+    print("Rate mode unchanged")
+
+if __name__ == "__main__":
+    main()
@@ -14,11 +14,14 @@
 
 import gym
 import network_sim
-import tensorflow as tf
+import numpy as np
+import random
 
 from stable_baselines.common.policies import MlpPolicy
 from stable_baselines.common.policies import FeedForwardPolicy
+from stable_baselines.common.vec_env import SubprocVecEnv
 from stable_baselines import PPO1
+from stable_baselines import PPO2
 import os
 import sys
 import inspect
@@ -26,6 +29,11 @@ currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentfram
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0,parentdir) 
 from common.simple_arg_parse import arg_or_default
+import checkpoint_manager
+import model_export
+import rollout_dataset
+import rollout_log
+import train_monitor
 
 arch_str = arg_or_default("--arch", default="32,16")
 if arch_str == "":
@@ -34,57 +42,96 @@ else:
     arch = [int(layer_width) for layer_width in arch_str.split(",")]
 print("Architecture is: %s" % str(arch))
 
-training_sess = None
-
 class MyMlpPolicy(FeedForwardPolicy):
 
     def __init__(self, sess, ob_space, ac_space, n_env, n_steps, n_batch, reuse=False, **_kwargs):
         super(MyMlpPolicy, self).__init__(sess, ob_space, ac_space, n_env, n_steps, n_batch, reuse, net_arch=[{"pi":arch, "vf":arch}],
                                         feature_extraction="mlp", **_kwargs)
-        global training_sess
-        training_sess = sess
 
-env = gym.make('PccNs-v0')
-#env = gym.make('CartPole-v0')
+# With --n-envs above 1, training runs that many simulators in worker
+# processes and uses PPO2, keeping about 8192 steps per update. Training stops
+# after --total-timesteps steps or --time-budget seconds, whichever is first.
+# A checkpoint (weights and SavedModel) is written in the background to
+# --checkpoint-dir every --checkpoint-timesteps steps and/or
+# --checkpoint-seconds seconds, keeping the last --keep-checkpoints. With
+# --rollout-dir, every finished episode is also saved there with its raw
+# per-step statistics, for reward_relabel.py, and with --dataset-dir written
+# into a sharded dataset (see rollout_dataset.py). --metrics-file streams the
+# per-iteration statistics, including the mean episode reward, to a CSV file.
+n_envs = arg_or_default("--n-envs", default=1)
+seed = arg_or_default("--seed", default=0)
+timesteps_per_batch = arg_or_default("--timesteps-per-batch", default=8192)
+checkpoint_timesteps = arg_or_default("--checkpoint-timesteps", default=1600 * 410)
+total_timesteps = arg_or_default("--total-timesteps", default=6 * checkpoint_timesteps)
+time_budget = arg_or_default("--time-budget", default=0.0)
+if time_budget <= 0.0:
+    time_budget = None
+checkpoint_dir = arg_or_default("--checkpoint-dir", default="./pcc_checkpoints")
+checkpoint_seconds = arg_or_default("--checkpoint-seconds", default=0.0)
+keep_checkpoints = arg_or_default("--keep-checkpoints", default=5)
+rollout_dir = arg_or_default("--rollout-dir", default=None)
+dataset_dir = arg_or_default("--dataset-dir", default=None)
+metrics_file = arg_or_default("--metrics-file", default=None)
+
+# PPO1 and PPO2 treat every episode end as terminal, so episodes the
+# simulator cuts short at a steady state must carry the skipped steps' value
+# in their last reward ("end" mode) rather than rely on bootstrapping.
+if (arg_or_default("--steady-state-window", default=0) > 0
+        and arg_or_default("--steady-state-mode", default="end") != "end"):
+    raise ValueError("stable_solve.py ignores TimeLimit.truncated; use --steady-state-mode=end")
+
+def make_env(rank):
+    def _init():
+        # The simulator draws from the global random modules, so every worker
+        # needs its own seed.
+        random.seed(seed + rank)
+        np.random.seed(seed + rank)
+        env = gym.make('PccNs-v0')
+        env.seed(seed + rank)
+        if rollout_dir is not None:
+            env = rollout_log.RolloutLogger(env, rollout_dir, prefix="env%d" % rank)
+        if dataset_dir is not None:
+            writer = rollout_dataset.ShardWriter(os.path.join(dataset_dir, "env%d" % rank))
+            env = rollout_log.RolloutLogger(env, writer=writer)
+        return env
+    return _init
 
 gamma = arg_or_default("--gamma", default=0.99)
 print("gamma = %f" % gamma)
-model = PPO1(MyMlpPolicy, env, verbose=1, schedule='constant', timesteps_per_actorbatch=8192, optim_batchsize=2048, gamma=gamma)
+if n_envs > 1:
+    # Fork the workers before TensorFlow starts any threads.
+    env = train_monitor.TimedVecEnv(SubprocVecEnv([make_env(i) for i in range(0, n_envs)],
+                                                  start_method="fork"))
+    n_steps = train_monitor.ppo2_n_steps(timesteps_per_batch, n_envs, nminibatches=4)
+    print("PPO2 rollouts: %d steps from each of %d envs" % (n_steps, n_envs))
+    model = PPO2(MyMlpPolicy, env, verbose=1, n_steps=n_steps, nminibatches=4, gamma=gamma)
+else:
+    env = train_monitor.TimedEnv(make_env(0)())
+    #env = gym.make('CartPole-v0')
+    model = PPO1(MyMlpPolicy, env, verbose=1, schedule='constant', timesteps_per_actorbatch=timesteps_per_batch, optim_batchsize=2048, gamma=gamma)
+
+monitor = train_monitor.TrainingMonitor(env, total_timesteps, time_budget,
+                                        report_every=timesteps_per_batch,
+                                        metrics_path=metrics_file)
+checkpoints = checkpoint_manager.CheckpointManager(checkpoint_dir,
+                                                   every_timesteps=checkpoint_timesteps,
+                                                   every_seconds=checkpoint_seconds,
+                                                   keep_last=keep_checkpoints)
+
+def training_callback(locals_, globals_):
+    checkpoints.maybe_checkpoint(locals_["self"])
+    return monitor(locals_, globals_)
 
-for i in range(0, 6):
-    with model.graph.as_default():                                                                   
-        saver = tf.train.Saver()                                                                     
-        saver.save(training_sess, "./pcc_model_%d.ckpt" % i)
-    model.learn(total_timesteps=(1600 * 410))
+checkpoints.checkpoint(model)
+model.learn(total_timesteps=total_timesteps, callback=training_callback)
+checkpoints.checkpoint(model, block=True)
+monitor.summary()
+env.close()
+checkpoints.close()
 
 ##
 #   Save the model to the location specified below.
 ##
 default_export_dir = "/tmp/pcc_saved_models/model_A/"
 export_dir = arg_or_default("--model-dir", default=default_export_dir)
-with model.graph.as_default():
-
-    pol = model.policy_pi#act_model
-
-    obs_ph = pol.obs_ph
-    act = pol.deterministic_action
-    sampled_act = pol.action
-
-    obs_input = tf.saved_model.utils.build_tensor_info(obs_ph)
-    outputs_tensor_info = tf.saved_model.utils.build_tensor_info(act)
-    stochastic_act_tensor_info = tf.saved_model.utils.build_tensor_info(sampled_act)
-    signature = tf.saved_model.signature_def_utils.build_signature_def(
-        inputs={"ob":obs_input},
-        outputs={"act":outputs_tensor_info, "stochastic_act":stochastic_act_tensor_info},
-        method_name=tf.saved_model.signature_constants.PREDICT_METHOD_NAME)
-
-    #"""
-    signature_map = {tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY:
-                     signature}
-
-    model_builder = tf.saved_model.builder.SavedModelBuilder(export_dir)
-    model_builder.add_meta_graph_and_variables(model.sess,
-        tags=[tf.saved_model.tag_constants.SERVING],
-        signature_def_map=signature_map,
-        clear_devices=True)
-    model_builder.save(as_text=True)
+model_export.export_saved_model(model, export_dir)
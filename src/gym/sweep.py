@@ -0,0 +1,367 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+##
+#   Runs a hyperparameter sweep of stable_solve.py on this machine.
+#
+#   usage: python3 sweep.py --spec=<spec.json> [--sweep-dir=./pcc_sweep]
+#              [--max-cpus=<cores>] [--cpus-per-trial=1] [--seed=0]
+#              [--grace-steps=200000] [--min-trials-to-stop=3]
+#              [--poll-seconds=5.0]
+#
+#   The spec is a JSON object such as
+#
+#   {"mode": "random", "n_trials": 20,
+#    "params": {"--arch": ["32,16", "64,32"],
+#               "--gamma": {"uniform": [0.9, 0.999]},
+#               "--delta-scale": {"log_uniform": [0.005, 0.1]},
+#               "--history-len": {"int_uniform": [4, 20]}},
+#    "fixed": {"--total-timesteps": 500000}}
+#
+#   In "grid" mode every parameter is a list of values and every combination
+#   is one trial. In "random" mode n_trials trials draw each parameter from
+#   its list or range, using --seed. "fixed" arguments go to every trial.
+#
+#   Each trial is a stable_solve.py process running in
+#   <sweep-dir>/trial_<n>/ and pinned to its own --cpus-per-trial cores
+#   (which also sets its --n-envs unless the spec does); at most --max-cpus
+#   cores are used at once. Every trial streams its per-iteration metrics to
+#   its metrics.csv, and each new row is appended to <sweep-dir>/progress.csv.
+#   A trial that has run --grace-steps steps is stopped early when its mean
+#   episode reward so far is below the median of the other trials' at the
+#   same step, once at least --min-trials-to-stop others have got that far.
+#
+#   Finished and stopped trials are recorded in <sweep-dir>/trials.jsonl, and
+#   <sweep-dir>/results.csv ranks them by their final episode reward. Running
+#   the same command again resumes the sweep: recorded trials are skipped and
+#   trials that were interrupted start over.
+##
+
+import csv
+import hashlib
+import inspect
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+
+from common.simple_arg_parse import arg_or_default
+
+STABLE_SOLVE = os.path.join(currentdir, "stable_solve.py")
+FINAL_REPORTS = 3
+
+def sample_value(rand, spec):
+    if isinstance(spec, list):
+        return rand.choice(spec)
+    if "uniform" in spec:
+        low, high = spec["uniform"]
+        return rand.uniform(low, high)
+    if "log_uniform" in spec:
+        low, high = spec["log_uniform"]
+        return math.exp(rand.uniform(math.log(low), math.log(high)))
+    if "int_uniform" in spec:
+        low, high = spec["int_uniform"]
+        return rand.randint(low, high)
+    raise ValueError("Unknown parameter spec %s" % str(spec))
+
+# The list of trials' arguments, in the same order for the same spec and
+# seed.
+def expand_spec(spec, seed):
+    params = spec.get("params", {})
+    names = sorted(params.keys())
+    trials = []
+    if spec.get("mode", "grid") == "grid":
+        for name in names:
+            if not isinstance(params[name], list):
+                raise ValueError("Grid parameter %s must be a list of values, not %s"
+                                 % (name, str(params[name])))
+        for values in itertools.product(*[params[name] for name in names]):
+            trials.append(dict(zip(names, values)))
+    else:
+        rand = random.Random(seed)
+        for _ in range(0, spec["n_trials"]):
+            trials.append({name:sample_value(rand, params[name]) for name in names})
+    for trial in trials:
+        trial.update(spec.get("fixed", {}))
+    return trials
+
+def trial_key(args):
+    return hashlib.sha1(json.dumps(args, sort_keys=True).encode()).hexdigest()[:12]
+
+def read_journal(path):
+    records = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line != "":
+                    record = json.loads(line)
+                    records[record["key"]] = record
+    return records
+
+# The complete rows added to a trial's metrics.csv since offset, and the new
+# offset.
+def read_metrics(path, offset, columns):
+    rows = []
+    if not os.path.exists(path):
+        return rows, offset
+    with open(path) as f:
+        f.seek(offset)
+        while True:
+            line = f.readline()
+            if not line.endswith("\n"):
+                break
+            offset = f.tell()
+            values = line.strip().split(",")
+            if values[0] == "iteration":
+                columns[:] = values
+                continue
+            row = dict(zip(columns, values))
+            rows.append({"total_steps":int(row["total_steps"]), "wall_time":float(row["wall_time"]),
+                         "episode_reward":float(row["episode_reward"])})
+    return rows, offset
+
+class Trial():
+
+    def __init__(self, index, args, sweep_dir):
+        self.index = index
+        self.args = args
+        self.key = trial_key(args)
+        self.dir = os.path.join(sweep_dir, "trial_%d" % index)
+        self.metrics_path = os.path.join(self.dir, "metrics.csv")
+        self.process = None
+        self.cpus = None
+        self.offset = 0
+        self.columns = []
+        self.rows = []
+        self.reward_sum = 0.0
+        self.n_rewards = 0
+
+    def start(self, cpus):
+        if os.path.exists(self.dir):
+            shutil.rmtree(self.dir)
+        os.makedirs(self.dir)
+        self.cpus = cpus
+        args = dict(self.args)
+        args["--model-dir"] = os.path.join(self.dir, "model")
+        args["--checkpoint-dir"] = os.path.join(self.dir, "checkpoints")
+        args["--metrics-file"] = self.metrics_path
+        command = [sys.executable, STABLE_SOLVE] + ["%s=%s" % (k, v) for k, v in sorted(args.items())]
+        env = dict(os.environ)
+        env["OMP_NUM_THREADS"] = str(len(cpus))
+        log = open(os.path.join(self.dir, "train.log"), "w")
+        # Its own session, so stopping it also stops its simulator workers.
+        self.process = subprocess.Popen(command, cwd=self.dir, stdout=log, stderr=subprocess.STDOUT,
+                                        env=env, start_new_session=True,
+                                        preexec_fn=lambda: os.sched_setaffinity(0, cpus))
+        log.close()
+
+    def poll_metrics(self):
+        rows, self.offset = read_metrics(self.metrics_path, self.offset, self.columns)
+        for row in rows:
+            if not math.isnan(row["episode_reward"]):
+                self.reward_sum += row["episode_reward"]
+                self.n_rewards += 1
+            row["mean_reward"] = self.reward_sum / self.n_rewards if self.n_rewards > 0 else math.nan
+        self.rows += rows
+        return rows
+
+    def steps(self):
+        return self.rows[-1]["total_steps"] if len(self.rows) > 0 else 0
+
+    # The running mean episode reward at the last report at or before steps.
+    def mean_reward_at(self, steps):
+        value = None
+        for row in self.rows:
+            if row["total_steps"] > steps:
+                break
+            value = row["mean_reward"]
+        return value
+
+    def final_reward(self):
+        rewards = [row["episode_reward"] for row in self.rows[-FINAL_REPORTS:]
+                   if not math.isnan(row["episode_reward"])]
+        return sum(rewards) / len(rewards) if len(rewards) > 0 else math.nan
+
+    def stop(self):
+        os.killpg(self.process.pid, signal.SIGTERM)
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.process.pid, signal.SIGKILL)
+            self.process.wait()
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[mid]
+    return 0.5 * (values[mid - 1] + values[mid])
+
+class Sweep():
+
+    def __init__(self, spec, sweep_dir, max_cpus, cpus_per_trial, seed, grace_steps,
+                 min_trials_to_stop, poll_seconds):
+        self.sweep_dir = sweep_dir
+        self.cpus_per_trial = cpus_per_trial
+        self.grace_steps = grace_steps
+        self.min_trials_to_stop = min_trials_to_stop
+        self.poll_seconds = poll_seconds
+        if not os.path.isdir(sweep_dir):
+            os.makedirs(sweep_dir)
+        self.journal_path = os.path.join(sweep_dir, "trials.jsonl")
+        self.progress_path = os.path.join(sweep_dir, "progress.csv")
+        self.results_path = os.path.join(sweep_dir, "results.csv")
+        self.records = read_journal(self.journal_path)
+        # --n-envs defaults to the trial's core count before the trials are
+        # keyed, so a resumed sweep with another --cpus-per-trial reruns them.
+        trial_args = expand_spec(spec, seed)
+        for args in trial_args:
+            args.setdefault("--n-envs", cpus_per_trial)
+        self.trials = [Trial(i, args, sweep_dir) for i, args in enumerate(trial_args)]
+        self.param_names = sorted(set(itertools.chain.from_iterable([t.args.keys() for t in self.trials])))
+
+        available = sorted(os.sched_getaffinity(0))[:max_cpus]
+        self.free_cpu_sets = [available[i:i + cpus_per_trial]
+                              for i in range(0, len(available) - cpus_per_trial + 1, cpus_per_trial)]
+        if len(self.free_cpu_sets) == 0:
+            raise ValueError("--cpus-per-trial is larger than --max-cpus")
+        # Trials that ended earlier in this sweep, for the stopping rule.
+        self.ended = []
+
+    def record(self, trial, status):
+        record = {"key":trial.key, "trial":trial.index, "args":trial.args, "status":status,
+                  "steps":trial.steps(), "final_reward":trial.final_reward(),
+                  "curve":[(row["total_steps"], row["mean_reward"]) for row in trial.rows]}
+        self.records[trial.key] = record
+        with open(self.journal_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        self.write_results()
+
+    def write_results(self):
+        records = sorted(self.records.values(),
+                         key=lambda r: -r["final_reward"] if not math.isnan(r["final_reward"]) else math.inf)
+        # Values such as --arch contain commas, so use a real CSV writer.
+        with open(self.results_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["trial", "status", "steps", "final_reward"] + self.param_names)
+            for r in records:
+                writer.writerow([r["trial"], r["status"], r["steps"], r["final_reward"]]
+                                + [r["args"].get(name, "") for name in self.param_names])
+
+    def write_progress(self, trial, rows):
+        new_file = not os.path.exists(self.progress_path)
+        with open(self.progress_path, "a") as f:
+            if new_file:
+                f.write("trial,total_steps,wall_time,episode_reward,mean_reward\n")
+            for row in rows:
+                f.write("%d,%d,%f,%f,%f\n" % (trial.index, row["total_steps"], row["wall_time"],
+                                              row["episode_reward"], row["mean_reward"]))
+
+    # The other trials' running mean rewards at the given step, from
+    # recorded curves and the trials still running.
+    def peer_rewards(self, trial, steps, running):
+        values = []
+        for record in self.records.values():
+            if record["key"] == trial.key:
+                continue
+            curve = [mean for s, mean in record["curve"] if s <= steps]
+            if len(record["curve"]) > 0 and record["curve"][-1][0] >= steps and len(curve) > 0:
+                values.append(curve[-1])
+        for other in running:
+            if other is not trial and other.steps() >= steps:
+                values.append(other.mean_reward_at(steps))
+        return [v for v in values if v is not None and not math.isnan(v)]
+
+    def should_stop(self, trial, running):
+        steps = trial.steps()
+        if steps < self.grace_steps or len(trial.rows) == 0:
+            return False
+        value = trial.rows[-1]["mean_reward"]
+        if math.isnan(value):
+            return False
+        peers = self.peer_rewards(trial, steps, running)
+        return len(peers) >= self.min_trials_to_stop and value < median(peers)
+
+    def run(self):
+        pending = [t for t in self.trials if t.key not in self.records]
+        print("%d trials, %d already recorded, %d to run on %d slots of %d cores"
+              % (len(self.trials), len(self.trials) - len(pending), len(pending),
+                 len(self.free_cpu_sets), self.cpus_per_trial))
+        running = []
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                while len(pending) > 0 and len(self.free_cpu_sets) > 0:
+                    trial = pending.pop(0)
+                    trial.start(self.free_cpu_sets.pop(0))
+                    running.append(trial)
+                    print("Started trial %d on cores %s: %s" % (trial.index, trial.cpus, trial.args))
+                time.sleep(self.poll_seconds)
+                for trial in list(running):
+                    rows = trial.poll_metrics()
+                    if len(rows) > 0:
+                        self.write_progress(trial, rows)
+                    status = None
+                    if trial.process.poll() is not None:
+                        status = "done" if trial.process.returncode == 0 else "failed"
+                    elif self.should_stop(trial, running):
+                        trial.stop()
+                        status = "stopped"
+                    if status is None:
+                        continue
+                    trial.poll_metrics()
+                    running.remove(trial)
+                    self.free_cpu_sets.append(trial.cpus)
+                    if status == "failed":
+                        # Failed trials are not recorded, so a resumed sweep retries them.
+                        print("Trial %d failed with code %d, see %s"
+                              % (trial.index, trial.process.returncode,
+                                 os.path.join(trial.dir, "train.log")))
+                        continue
+                    self.record(trial, status)
+                    print("Trial %d %s after %d steps, final reward %0.2f"
+                          % (trial.index, status, trial.steps(), trial.final_reward()))
+        finally:
+            for trial in running:
+                trial.stop()
+        self.write_results()
+
+def main():
+    spec_path = arg_or_default("--spec", "sweep.json")
+    sweep_dir = os.path.abspath(arg_or_default("--sweep-dir", "./pcc_sweep"))
+    max_cpus = arg_or_default("--max-cpus", multiprocessing.cpu_count())
+    cpus_per_trial = arg_or_default("--cpus-per-trial", 1)
+    seed = arg_or_default("--seed", 0)
+    grace_steps = arg_or_default("--grace-steps", 200000)
+    min_trials_to_stop = arg_or_default("--min-trials-to-stop", 3)
+    poll_seconds = arg_or_default("--poll-seconds", 5.0)
+    with open(spec_path) as f:
+        spec = json.load(f)
+    sweep = Sweep(spec, sweep_dir, max_cpus, cpus_per_trial, seed, grace_steps,
+                  min_trials_to_stop, poll_seconds)
+    sweep.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import time
+
+import gym
+import numpy as np
+from stable_baselines.common.vec_env import VecEnvWrapper
+
+# Measures where training time goes. The env wrappers add up the time the
+# learner spends waiting on environment steps and resets; the TrainingMonitor
+# is passed as the learn() callback and, once per report_every steps (one
+# algorithm iteration by default), prints the env steps per second and how
+# the wall clock time split between the environments and the learner. It also
+# stops learn() once a step or wall clock budget is used up. Older
+# stable_baselines versions call the callback once per iteration and newer
+# ones once per step, so reports are triggered by the step count. The
+# wrappers also collect the returns of finished episodes, and each report
+# includes their mean. With a metrics_path, every report is also appended to
+# that CSV file as it happens.
+
+METRIC_COLUMNS = ["iteration", "total_steps", "wall_time", "steps_per_s", "env_time",
+                  "learner_time", "episodes", "episode_reward"]
+
+# PPO2 splits each rollout of n_steps * n_envs steps into nminibatches equal
+# minibatches and asserts that they divide evenly. Returns the n_steps per env
+# closest to timesteps_per_batch / n_envs for which they do.
+def ppo2_n_steps(timesteps_per_batch, n_envs, nminibatches=4):
+    if n_envs < 1 or nminibatches < 1:
+        raise ValueError("Need at least one env and one minibatch, got %d envs and %d minibatches"
+                         % (n_envs, nminibatches))
+    if timesteps_per_batch < nminibatches:
+        raise ValueError("A batch of %d steps cannot be split into %d minibatches"
+                         % (timesteps_per_batch, nminibatches))
+    # n_steps must be a multiple of step to make n_steps * n_envs a multiple
+    # of nminibatches.
+    step = nminibatches // math.gcd(n_envs, nminibatches)
+    return max(step, int(round(timesteps_per_batch / float(n_envs * step))) * step)
+
+class TimedEnv(gym.Wrapper):
+
+    def __init__(self, env):
+        gym.Wrapper.__init__(self, env)
+        self.env_time = 0.0
+        self.episode_return = 0.0
+        self.episode_returns = []
+
+    def step(self, action):
+        start = time.time()
+        result = self.env.step(action)
+        self.env_time += time.time() - start
+        self.episode_return += result[1]
+        if result[2]:
+            self.episode_returns.append(self.episode_return)
+            self.episode_return = 0.0
+        return result
+
+    def reset(self, **kwargs):
+        start = time.time()
+        obs = self.env.reset(**kwargs)
+        self.env_time += time.time() - start
+        self.episode_return = 0.0
+        return obs
+
+class TimedVecEnv(VecEnvWrapper):
+
+    def __init__(self, venv):
+        VecEnvWrapper.__init__(self, venv)
+        self.env_time = 0.0
+        self.episode_return = np.zeros(self.num_envs)
+        self.episode_returns = []
+
+    def step_async(self, actions):
+        start = time.time()
+        self.venv.step_async(actions)
+        self.env_time += time.time() - start
+
+    def step_wait(self):
+        start = time.time()
+        result = self.venv.step_wait()
+        self.env_time += time.time() - start
+        _, rewards, dones, _ = result
+        self.episode_return += rewards
+        for i in np.flatnonzero(dones):
+            self.episode_returns.append(float(self.episode_return[i]))
+            self.episode_return[i] = 0.0
+        return result
+
+    def reset(self):
+        start = time.time()
+        obs = self.venv.reset()
+        self.env_time += time.time() - start
+        return obs
+
+class TrainingMonitor():
+
+    def __init__(self, timed_env, total_timesteps=None, time_budget=None, report_every=1,
+                 metrics_path=None):
+        self.timed_env = timed_env
+        self.report_every = report_every
+        self.total_timesteps = total_timesteps
+        self.time_budget = time_budget
+        self.start_time = time.time()
+        self.iteration = 0
+        self.last_time = self.start_time
+        self.last_env_time = 0.0
+        self.last_steps = 0
+        self.history = []
+        self.metrics_file = None
+        if metrics_path is not None:
+            self.metrics_file = open(metrics_path, "w")
+            self.metrics_file.write(",".join(METRIC_COLUMNS) + "\n")
+            self.metrics_file.flush()
+
+    def out_of_budget(self, num_timesteps):
+        if self.total_timesteps is not None and num_timesteps >= self.total_timesteps:
+            return True
+        if self.time_budget is not None and time.time() - self.start_time >= self.time_budget:
+            return True
+        return False
+
+    def __call__(self, locals_, globals_):
+        model = locals_["self"]
+        if self.out_of_budget(model.num_timesteps):
+            return False
+        if model.num_timesteps - self.last_steps < self.report_every:
+            return True
+        now = time.time()
+        elapsed = now - self.last_time
+        if elapsed > 0.0:
+            steps = model.num_timesteps - self.last_steps
+            env_time = self.timed_env.env_time - self.last_env_time
+            learner_time = max(0.0, elapsed - env_time)
+            episode_returns = self.timed_env.episode_returns
+            self.timed_env.episode_returns = []
+            stats = {"iteration":self.iteration, "steps":steps,
+                     "steps_per_s":steps / elapsed, "env_time":env_time,
+                     "learner_time":learner_time, "total_steps":model.num_timesteps,
+                     "wall_time":now - self.start_time, "episodes":len(episode_returns),
+                     "episode_reward":float(np.mean(episode_returns)) if len(episode_returns) > 0 else math.nan}
+            self.history.append(stats)
+            print("Iteration %d: %d steps in %0.1fs (%0.0f steps/s), env %0.1fs (%0.0f%%), learner %0.1fs (%0.0f%%), episode reward %0.2f"
+                  % (self.iteration, steps, elapsed, stats["steps_per_s"],
+                     env_time, 100.0 * env_time / elapsed,
+                     learner_time, 100.0 * learner_time / elapsed, stats["episode_reward"]))
+            if self.metrics_file is not None:
+                self.metrics_file.write(",".join([str(stats[c]) for c in METRIC_COLUMNS]) + "\n")
+                self.metrics_file.flush()
+            self.iteration += 1
+        self.last_time = now
+        self.last_env_time = self.timed_env.env_time
+        self.last_steps = model.num_timesteps
+        return True
+
+    def summary(self):
+        elapsed = time.time() - self.start_time
+        steps = sum([stats["steps"] for stats in self.history])
+        env_time = sum([stats["env_time"] for stats in self.history])
+        if self.metrics_file is not None:
+            self.metrics_file.close()
+            self.metrics_file = None
+        print("Trained for %d steps in %0.1fs (%0.0f steps/s), %0.0f%% of the time in the environments"
+              % (steps, elapsed, steps / max(elapsed, 1e-9), 100.0 * env_time / max(elapsed, 1e-9)))
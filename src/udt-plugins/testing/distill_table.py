@@ -0,0 +1,150 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+##
+#   Distills a trained policy into a quantized interpolation table that
+#   table_agent.TableModel can serve in constant time.
+#
+#   usage: python3 distill_table.py --model-path=<saved model dir or .npz>
+#              --output=<table.npz> [--table-dims=3] [--table-bins=17]
+#              [--table-bits=16] [--n-samples=100000]
+#              [--obs-samples=<observations.npy>] [--max-obs-value=10.0]
+#              [--history-len=10] [--input-features=...]
+#
+#   Observations are sampled from the box given by sender_obs' min/max
+#   vectors (upper bounds capped at --max-obs-value, since several features
+#   have effectively unbounded maxima), or loaded from a .npy file of real
+#   observations. A PCA projection reduces them to --table-dims dimensions,
+#   the policy is evaluated in bulk on the grid, and the error of the table
+#   against the policy is measured on held-out samples.
+##
+
+import inspect
+import os
+import sys
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+grandparentdir = os.path.dirname(parentdir)
+sys.path.insert(0, parentdir)
+sys.path.insert(0, grandparentdir)
+
+import numpy as np
+
+from common import sender_obs
+from common.simple_arg_parse import arg_or_default
+import table_agent
+
+EVAL_BATCH_SIZE = 8192
+
+def load_policy(model_path):
+    if model_path.endswith(".npz"):
+        import np_agent
+        return np_agent.NumpyModel(model_path)
+    import loaded_agent
+    return loaded_agent.LoadedModel(model_path)
+
+def eval_policy(model, obs):
+    actions = []
+    for start in range(0, len(obs), EVAL_BATCH_SIZE):
+        batch = obs[start:start + EVAL_BATCH_SIZE].astype(np.float32)
+        actions.append(np.asarray(model.act(batch)["act"]).reshape(-1))
+    return np.concatenate(actions)
+
+def sample_observations(features, history_len, n_samples, max_obs_value):
+    low = np.tile(sender_obs.get_min_obs_vector(features), history_len)
+    high = np.tile(sender_obs.get_max_obs_vector(features), history_len)
+    high = np.minimum(high, np.maximum(low, max_obs_value))
+    return np.random.uniform(low, high, size=(n_samples, len(low)))
+
+def fit_projection(obs, n_dims):
+    mean = np.mean(obs, axis=0)
+    _, _, vt = np.linalg.svd(obs - mean, full_matrices=False)
+    return mean, vt[:n_dims]
+
+TABLE_DTYPES = {8:np.uint8, 16:np.uint16}
+
+def build_table(model, mean, components, coords, n_bins, n_bits):
+    if n_bits not in TABLE_DTYPES:
+        raise ValueError("Unsupported table bits %s (supported: 8, 16)" % str(n_bits))
+    # A bin at each end of every axis, so the grid step is defined.
+    if n_bins < 2:
+        raise ValueError("A table needs at least 2 bins per axis, not %d" % n_bins)
+    grid_min = np.percentile(coords, 0.5, axis=0)
+    grid_max = np.percentile(coords, 99.5, axis=0)
+    grid_step = np.maximum((grid_max - grid_min) / (n_bins - 1), 1e-9)
+    axes = [grid_min[i] + grid_step[i] * np.arange(n_bins) for i in range(len(grid_min))]
+    grid = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, len(axes))
+    grid_obs = mean + np.dot(grid, components)
+    values = eval_policy(model, grid_obs)
+    act_min = float(np.min(values))
+    act_max = float(np.max(values))
+    q_table = table_agent.quantize(values, act_min, act_max, TABLE_DTYPES[n_bits])
+    return {
+        "table":q_table.reshape([n_bins] * len(axes)),
+        "grid_min":grid_min,
+        "grid_step":grid_step,
+        "act_min":np.array(act_min),
+        "act_max":np.array(act_max),
+    }
+
+def report_error(model, table_path, obs):
+    table = table_agent.TableModel(table_path)
+    expected = eval_policy(model, obs)
+    approx = table.act(obs)["act"].reshape(-1)
+    err = np.abs(expected - approx)
+    same_sign = np.mean(np.sign(expected) == np.sign(approx))
+    print("Table error over %d held-out observations:" % len(obs))
+    print("\tmean abs: %g" % np.mean(err))
+    print("\tp50 abs: %g" % np.percentile(err, 50))
+    print("\tp99 abs: %g" % np.percentile(err, 99))
+    print("\tmax abs: %g" % np.max(err))
+    print("\taction sign agreement: %0.4f" % same_sign)
+    return err
+
+if __name__ == "__main__":
+    model_path = arg_or_default("--model-path", "/tmp/pcc_saved_models/model_A/")
+    output_path = arg_or_default("--output", "pcc_table.npz")
+    n_dims = arg_or_default("--table-dims", 3)
+    n_bins = arg_or_default("--table-bins", 17)
+    n_bits = arg_or_default("--table-bits", 16)
+    n_samples = arg_or_default("--n-samples", 100000)
+    obs_samples_file = arg_or_default("--obs-samples", None)
+    max_obs_value = arg_or_default("--max-obs-value", 10.0)
+    history_len = arg_or_default("--history-len", 10)
+    features = arg_or_default("--input-features",
+                              default="sent latency inflation,"
+                                    + "latency ratio,"
+                                    + "send ratio").split(",")
+
+    if obs_samples_file is not None:
+        obs = np.load(obs_samples_file).reshape(-1, history_len * len(features))
+        np.random.shuffle(obs)
+    else:
+        obs = sample_observations(features, history_len, n_samples, max_obs_value)
+    n_holdout = max(1, len(obs) // 10)
+    holdout, obs = obs[:n_holdout], obs[n_holdout:]
+
+    model = load_policy(model_path)
+    mean, components = fit_projection(obs, n_dims)
+    coords = np.dot(obs - mean, components.T)
+    arrays = build_table(model, mean, components, coords, n_bins, n_bits)
+    arrays["format_version"] = np.array(table_agent.TABLE_FORMAT_VERSION)
+    arrays["mean"] = mean
+    arrays["components"] = components
+    arrays["features"] = np.array(",".join(features))
+    arrays["history_len"] = np.array(history_len)
+    np.savez_compressed(output_path, **arrays)
+    print("Wrote %d-entry table to %s" % (arrays["table"].size, output_path))
+    report_error(model, output_path, holdout)
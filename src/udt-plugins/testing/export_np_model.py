@@ -0,0 +1,115 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+##
+#   Extracts the deterministic policy of a SavedModel written by
+#   stable_solve.py into a .npz file that np_agent.NumpyModel can run without
+#   tensorflow.
+#
+#   usage: python3 export_np_model.py --model-path=<saved model dir>
+#              --output=<model.npz> [--act-fun=tanh] [--check-samples=1024]
+##
+
+import inspect
+import os
+import re
+import sys
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+grandparentdir = os.path.dirname(parentdir)
+sys.path.insert(0, parentdir)
+sys.path.insert(0, grandparentdir)
+
+import numpy as np
+import tensorflow as tf
+
+from common.simple_arg_parse import arg_or_default
+import loaded_agent
+import np_agent
+
+# FeedForwardPolicy builds its layers as <scope>/shared_fc<i> followed by
+# <scope>/pi_fc<i>, and the Gaussian mean as <scope>/pi. stable_solve.py uses
+# the default tanh activation.
+def _collect_layer_weights(var_values, scope, layer_kind):
+    layers = []
+    i = 0
+    while True:
+        w_name = "%s%s%d/w:0" % (scope, layer_kind, i)
+        b_name = "%s%s%d/b:0" % (scope, layer_kind, i)
+        if w_name not in var_values.keys():
+            return layers
+        layers.append((var_values[w_name], var_values[b_name]))
+        i += 1
+
+def _policy_scope(act_tensor_name):
+    # The deterministic action is the output of the "pi" linear layer, e.g.
+    # "pi/model/pi/add:0", so the policy scope is everything before "pi/".
+    match = re.match(r"^(.*/)?pi/[^/]+:\d+$", act_tensor_name)
+    if match is None:
+        raise ValueError("Cannot locate policy scope from action tensor %s"
+                         % act_tensor_name)
+    return match.group(1) or ""
+
+def export_model(model_path, output_path, act_fun="tanh"):
+    graph = tf.Graph()
+    with graph.as_default():
+        sess = tf.Session(graph=graph)
+        metagraph = tf.saved_model.loader.load(sess,
+            [tf.saved_model.tag_constants.SERVING], model_path)
+        sig = metagraph.signature_def["serving_default"]
+        if "state" in sig.inputs.keys():
+            raise ValueError("Recurrent policies cannot be exported to NumPy")
+        scope = _policy_scope(sig.outputs["act"].name)
+        variables = tf.global_variables()
+        var_values = dict(zip([v.name for v in variables], sess.run(variables)))
+        sess.close()
+
+    layers = (_collect_layer_weights(var_values, scope, "shared_fc")
+              + _collect_layer_weights(var_values, scope, "pi_fc"))
+    arrays = {
+        "format_version":np.array(np_agent.NP_MODEL_FORMAT_VERSION),
+        "n_layers":np.array(len(layers)),
+        "act_fun":np.array(act_fun),
+        "out_w":var_values["%spi/w:0" % scope],
+        "out_b":var_values["%spi/b:0" % scope],
+    }
+    for i, (w, b) in enumerate(layers):
+        arrays["w_%d" % i] = w
+        arrays["b_%d" % i] = b
+    logstd_name = "%spi/logstd:0" % scope
+    if logstd_name in var_values.keys():
+        arrays["logstd"] = var_values[logstd_name]
+    np.savez(output_path, **arrays)
+    print("Exported %d hidden layers from %s to %s"
+          % (len(layers), model_path, output_path))
+
+def check_export(model_path, output_path, n_samples):
+    tf_model = loaded_agent.LoadedModel(model_path)
+    np_model = np_agent.NumpyModel(output_path)
+    obs = np.random.uniform(-1.0, 3.0, size=(n_samples, np_model.obs_dim))
+    tf_act = np.concatenate([tf_model.act(ob.reshape(1, -1))["act"] for ob in obs])
+    np_act = np_model.act(obs)["act"]
+    max_err = np.max(np.abs(tf_act - np_act))
+    print("Max abs difference over %d samples: %g" % (n_samples, max_err))
+    return max_err
+
+if __name__ == "__main__":
+    model_path = arg_or_default("--model-path", "/tmp/pcc_saved_models/model_A/")
+    output_path = arg_or_default("--output", "pcc_model.npz")
+    act_fun = arg_or_default("--act-fun", "tanh")
+    n_check = arg_or_default("--check-samples", 1024)
+    export_model(model_path, output_path, act_fun)
+    if n_check > 0:
+        check_export(model_path, output_path, n_check)
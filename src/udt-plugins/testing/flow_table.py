@@ -0,0 +1,102 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import numpy as np
+
+# Compact per-flow state for the UDT plugin. Every flow owns a slot in a set of
+# preallocated column arrays. Instead of keeping monitor interval objects, the
+# history holds only each interval's scaled feature row, so a flow costs
+# history_len * n_features * 4 bytes plus a few scalars. Slots of closed flows
+# are reused, and the arrays double in size when they run out of slots.
+#
+# With track_decisions, the table also remembers the observation and action of
+# each flow's last model decision so that unchanged observations can reuse it.
+#
+# UDT calls the plugin from several threads, and growing the table replaces
+# every column array. The table's methods take its lock, and callers that
+# index the columns directly must hold it too.
+
+class FlowTable():
+
+    def __init__(self, history_len, n_features, capacity=1024, track_decisions=False):
+        self.history_len = history_len
+        self.n_features = n_features
+        self.lock = threading.RLock()
+        self.slots = {}
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self.history = np.zeros((capacity, history_len, n_features), dtype=np.float32)
+        self.rate = np.zeros(capacity, dtype=np.float64)
+        self.got_data = np.zeros(capacity, dtype=np.bool_)
+        self.columns = ["history", "rate", "got_data"]
+        self.track_decisions = track_decisions
+        if track_decisions:
+            self.last_obs = np.zeros((capacity, history_len * n_features), dtype=np.float32)
+            self.last_delta = np.zeros(capacity, dtype=np.float32)
+            self.n_skipped = np.zeros(capacity, dtype=np.int32)
+            self.last_skipped = np.zeros(capacity, dtype=np.bool_)
+            self.columns += ["last_obs", "last_delta", "n_skipped", "last_skipped"]
+
+    def __len__(self):
+        return len(self.slots)
+
+    def capacity(self):
+        return len(self.rate)
+
+    def _grow(self):
+        old_capacity = self.capacity()
+        for name in self.columns:
+            column = getattr(self, name)
+            setattr(self, name, np.concatenate([column, np.zeros_like(column)]))
+        self.free_slots.extend(range(2 * old_capacity - 1, old_capacity - 1, -1))
+
+    # Returns the slot for flow_id, allocating one if the flow is new.
+    def add(self, flow_id):
+        with self.lock:
+            slot = self.slots.get(flow_id)
+            if slot is None:
+                if len(self.free_slots) == 0:
+                    self._grow()
+                slot = self.free_slots.pop()
+                self.slots[flow_id] = slot
+            return slot
+
+    # Releases the flow's slot and returns it so callers can clean up any
+    # state they keep alongside it.
+    def remove(self, flow_id):
+        with self.lock:
+            slot = self.slots.pop(flow_id)
+            self.got_data[slot] = False
+            self.free_slots.append(slot)
+            return slot
+
+    def lookup(self, flow_id):
+        return self.slots[flow_id]
+
+    def fill_history(self, slot, row):
+        with self.lock:
+            self.history[slot] = row
+            self.got_data[slot] = False
+
+    def push(self, slot, row):
+        with self.lock:
+            hist = self.history[slot]
+            hist[:-1] = hist[1:]
+            hist[-1] = row
+            self.got_data[slot] = True
+
+    def get_obs(self, slot):
+        with self.lock:
+            return self.history[slot].reshape(-1)
@@ -0,0 +1,75 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array
+import struct
+
+# Wire format between remote_client.py and inference_server.py. Every request
+# starts with a fixed header:
+#
+#   version (u8) | message type (u8) | flow id (i32) | rtt sample count (u32)
+#
+# SAMPLE requests follow it with the fixed monitor interval fields and then
+# the RTT samples as packed float32 values. GET_RATE requests are answered
+# with a single float64 rate in bits per second; no other request gets a
+# reply. Header and fixed fields are little-endian, and the RTT samples use
+# the host's float32 layout since both ends always share a host.
+
+PROTOCOL_VERSION = 1
+
+MSG_INIT = 1
+MSG_SAMPLE = 2
+MSG_GET_RATE = 3
+MSG_RESET = 4
+MSG_CLOSE = 5
+
+HEADER = struct.Struct("<BBiI")
+SAMPLE = struct.Struct("<qqqddddid")
+RATE_REPLY = struct.Struct("<d")
+
+def pack_request(msg_type, flow_id):
+    return HEADER.pack(PROTOCOL_VERSION, msg_type, flow_id, 0)
+
+def pack_sample(flow_id, bytes_sent, bytes_acked, bytes_lost,
+                send_start_time, send_end_time, recv_start_time,
+                recv_end_time, rtt_samples, packet_size, utility):
+    rtts = array.array("f", rtt_samples)
+    return b"".join([
+        HEADER.pack(PROTOCOL_VERSION, MSG_SAMPLE, flow_id, len(rtts)),
+        SAMPLE.pack(bytes_sent, bytes_acked, bytes_lost, send_start_time,
+                    send_end_time, recv_start_time, recv_end_time,
+                    packet_size, utility),
+        rtts.tobytes()])
+
+# Parses one request from buf starting at offset. Returns None if the buffer
+# does not hold a complete request yet, or (msg_type, flow_id, sample, end)
+# where sample is None or the tuple of give_sample arguments after flow_id.
+def unpack_request(buf, offset):
+    if len(buf) - offset < HEADER.size:
+        return None
+    version, msg_type, flow_id, n_rtt = HEADER.unpack_from(buf, offset)
+    if version != PROTOCOL_VERSION:
+        raise ValueError("Unsupported inference protocol version %d" % version)
+    end = offset + HEADER.size
+    if msg_type != MSG_SAMPLE:
+        return msg_type, flow_id, None, end
+    rtt_start = end + SAMPLE.size
+    rtt_end = rtt_start + 4 * n_rtt
+    if len(buf) < rtt_end:
+        return None
+    fields = SAMPLE.unpack_from(buf, end)
+    rtts = array.array("f")
+    rtts.frombytes(bytes(buf[rtt_start:rtt_end]))
+    sample = fields[:7] + (rtts.tolist(),) + fields[7:]
+    return msg_type, flow_id, sample, rtt_end
@@ -0,0 +1,207 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+##
+#   Local inference daemon that holds one copy of the model for every
+#   pccclient process on the host. Senders load remote_client.py, which
+#   forwards the plugin calls over a Unix domain socket. All get_rate requests
+#   that arrive in the same polling round, from any process, are answered with
+#   one batched model call.
+#
+#   usage: python3 inference_server.py --server-path=/tmp/pcc_inference.sock
+#              --model-path=<model> [any other loaded_client.py option]
+##
+
+import inspect
+import os
+import selectors
+import socket
+import sys
+import time
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+grandparentdir = os.path.dirname(parentdir)
+sys.path.insert(0, parentdir)
+sys.path.insert(0, grandparentdir)
+
+import inference_protocol
+import loaded_client
+from common.simple_arg_parse import arg_or_default
+
+SERVER_PATH = arg_or_default("--server-path", "/tmp/pcc_inference.sock")
+RECV_SIZE = 1 << 16
+# A sender that lets this many bytes of replies pile up unread is dropped.
+MAX_PENDING_OUTPUT = 1 << 20
+
+# Sockets are non-blocking. Replies go to a per-connection output buffer that
+# is written as the socket accepts it, so a sender that stops reading only
+# delays itself. Any error while serving a connection drops that connection
+# and leaves the others running.
+
+class ClientConnection():
+
+    def __init__(self, sock, conn_id):
+        self.sock = sock
+        self.conn_id = conn_id
+        self.buf = bytearray()
+        self.offset = 0
+        self.out = bytearray()
+        self.flows = set()
+
+    # Flow ids are only unique within one sender process.
+    def flow_key(self, flow_id):
+        return (self.conn_id, flow_id)
+
+class InferenceServer():
+
+    def __init__(self, path, driver):
+        self.path = path
+        self.driver = driver
+        self.sel = selectors.DefaultSelector()
+        self.conns = {}
+        self.next_conn_id = 0
+        if os.path.exists(path):
+            os.unlink(path)
+        self.listen_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listen_sock.bind(path)
+        self.listen_sock.listen(128)
+        self.sel.register(self.listen_sock, selectors.EVENT_READ, None)
+
+    def accept(self):
+        sock, _ = self.listen_sock.accept()
+        sock.setblocking(False)
+        conn = ClientConnection(sock, self.next_conn_id)
+        self.next_conn_id += 1
+        self.conns[sock] = conn
+        self.sel.register(sock, selectors.EVENT_READ, conn)
+
+    def drop(self, conn):
+        if conn.sock not in self.conns:
+            return
+        self.sel.unregister(conn.sock)
+        conn.sock.close()
+        del self.conns[conn.sock]
+        for flow_key in conn.flows:
+            try:
+                self.driver.close(flow_key)
+            except Exception as e:
+                print("Failed to close flow %s: %s" % (str(flow_key), str(e)))
+        print("Sender %d disconnected, closed %d flows" % (conn.conn_id, len(conn.flows)))
+
+    # Handles queued requests from conn until it reaches a GET_RATE, which is
+    # returned so it can join the batch. Later requests on the connection wait
+    # for the next round so they are applied after the rate is computed.
+    def handle_requests(self, conn):
+        while True:
+            request = inference_protocol.unpack_request(conn.buf, conn.offset)
+            if request is None:
+                del conn.buf[:conn.offset]
+                conn.offset = 0
+                return None
+            msg_type, flow_id, sample, conn.offset = request
+            flow_key = conn.flow_key(flow_id)
+            if msg_type != inference_protocol.MSG_CLOSE and flow_key not in conn.flows:
+                # A misbehaving sender must not take down the shared server,
+                # so unknown flows are created on first use.
+                self.driver.init(flow_key)
+                conn.flows.add(flow_key)
+                if msg_type == inference_protocol.MSG_INIT:
+                    continue
+            if msg_type == inference_protocol.MSG_GET_RATE:
+                return flow_key
+            if msg_type == inference_protocol.MSG_SAMPLE:
+                self.driver.give_sample(flow_key, *sample)
+            elif msg_type == inference_protocol.MSG_INIT:
+                self.driver.init(flow_key)
+                conn.flows.add(flow_key)
+            elif msg_type == inference_protocol.MSG_RESET:
+                self.driver.reset(flow_key)
+            elif msg_type == inference_protocol.MSG_CLOSE and flow_key in conn.flows:
+                self.driver.close(flow_key)
+                conn.flows.discard(flow_key)
+
+    def answer_rate_requests(self):
+        while True:
+            waiting = []
+            for conn in list(self.conns.values()):
+                try:
+                    flow_key = self.handle_requests(conn)
+                except Exception as e:
+                    print("Dropping sender %d after a bad request: %s" % (conn.conn_id, str(e)))
+                    self.drop(conn)
+                    continue
+                if flow_key is not None:
+                    waiting.append((conn, flow_key))
+            if len(waiting) == 0:
+                return
+            start = time.perf_counter()
+            rates = self.driver.get_rates([flow_key for _, flow_key in waiting])
+            if loaded_client.stats is not None:
+                loaded_client.stats.record("get_rate_batch", time.perf_counter() - start)
+                loaded_client.stats.incr("get_rate", len(waiting))
+            for (conn, _), rate in zip(waiting, rates):
+                conn.out.extend(inference_protocol.RATE_REPLY.pack(rate))
+                self.flush(conn)
+
+    # Writes as much buffered output as the socket takes, and waits for the
+    # socket to become writable if some is left.
+    def flush(self, conn):
+        if conn.sock not in self.conns:
+            return
+        try:
+            while len(conn.out) > 0:
+                sent = conn.sock.send(conn.out)
+                del conn.out[:sent]
+        except BlockingIOError:
+            pass
+        except OSError:
+            self.drop(conn)
+            return
+        if len(conn.out) > MAX_PENDING_OUTPUT:
+            print("Dropping sender %d, which stopped reading" % conn.conn_id)
+            self.drop(conn)
+            return
+        events = selectors.EVENT_READ
+        if len(conn.out) > 0:
+            events |= selectors.EVENT_WRITE
+        self.sel.modify(conn.sock, events, conn)
+
+    def serve_forever(self):
+        print("Serving inference on %s" % self.path)
+        while True:
+            for key, events in self.sel.select():
+                if key.data is None:
+                    self.accept()
+                    continue
+                conn = key.data
+                if events & selectors.EVENT_WRITE:
+                    self.flush(conn)
+                if not (events & selectors.EVENT_READ) or conn.sock not in self.conns:
+                    continue
+                try:
+                    data = conn.sock.recv(RECV_SIZE)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b""
+                if len(data) == 0:
+                    self.drop(conn)
+                else:
+                    conn.buf.extend(data)
+            self.answer_rate_requests()
+
+if __name__ == "__main__":
+    server = InferenceServer(SERVER_PATH, loaded_client.driver)
+    server.serve_forever()
@@ -0,0 +1,246 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+##
+#   Synthetic load generator for the UDT plugin API. It emulates pccclient by
+#   calling init for every flow and then interleaving get_rate/give_sample
+#   calls across all flows, with realistic monitor intervals and RTT sample
+#   counts. It reports throughput, per-call latency percentiles and memory
+#   growth.
+#
+#   usage: python3 load_harness.py [--plugin=loaded_client] [--n-flows=1000]
+#              [--n-workers=4] [--worker-type=thread|process]
+#              [--mis-per-flow=100] [--mean-rtt-samples=50]
+#              [--stand-in-trainer] [--output=<results.json>]
+#              [plugin options, e.g. --model-path=... or --model-type=stand-in]
+#
+#   --plugin names a module in this directory or in ../training (e.g. shim),
+#   or a path to one. With threads, all workers share one plugin instance,
+#   as the UDT threads of a single pccclient do. With processes, every worker
+#   loads its own instance, like separate pccclient processes. The
+#   --stand-in-trainer option answers the shim plugin in place of
+#   shim_solver.py.
+##
+
+import importlib
+import inspect
+import json
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import traceback
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+grandparentdir = os.path.dirname(parentdir)
+sys.path.insert(0, parentdir)
+sys.path.insert(0, grandparentdir)
+sys.path.insert(0, os.path.join(parentdir, "training"))
+
+from common import shim_protocol
+from common.simple_arg_parse import arg_or_default
+import plugin_stats
+
+PLUGIN = arg_or_default("--plugin", "loaded_client")
+N_FLOWS = arg_or_default("--n-flows", 1000)
+N_WORKERS = arg_or_default("--n-workers", 4)
+WORKER_TYPE = arg_or_default("--worker-type", "thread")
+MIS_PER_FLOW = arg_or_default("--mis-per-flow", 100)
+MEAN_RTT_SAMPLES = arg_or_default("--mean-rtt-samples", 50)
+MAX_RTT_SAMPLES = arg_or_default("--max-rtt-samples", 2000)
+STAND_IN_TRAINER = arg_or_default("--stand-in-trainer", False)
+OUTPUT = arg_or_default("--output", None)
+
+CALLS = ["init", "get_rate", "give_sample"]
+
+def load_plugin(name):
+    if name.endswith(".py"):
+        sys.path.insert(0, os.path.dirname(os.path.abspath(name)))
+        name = os.path.basename(name)[:-3]
+    return importlib.import_module(name)
+
+class FlowEmulator():
+
+    def __init__(self, flow_id, rand):
+        self.flow_id = flow_id
+        self.rand = rand
+        self.base_rtt = rand.uniform(0.01, 0.2)
+        self.time = 0.0
+
+    # Builds the give_sample arguments for one monitor interval at the given
+    # rate, with a lognormal number of RTT samples around MEAN_RTT_SAMPLES.
+    def next_sample(self, rate_bps):
+        dur = 1.5 * self.base_rtt
+        bytes_sent = int(max(rate_bps, 1.0) * dur / 8.0)
+        bytes_lost = int(bytes_sent * self.rand.uniform(0.0, 0.02))
+        bytes_acked = bytes_sent - bytes_lost
+        n_rtt = int(min(MAX_RTT_SAMPLES, self.rand.lognormvariate(0.0, 0.5) * MEAN_RTT_SAMPLES))
+        queueing = self.rand.uniform(0.0, 0.5 * self.base_rtt)
+        rtts = [self.base_rtt + queueing * self.rand.random() for _ in range(n_rtt)]
+        start = self.time
+        self.time += dur
+        return (self.flow_id, bytes_sent, bytes_acked, bytes_lost, start,
+                self.time, start + self.base_rtt, self.time + self.base_rtt,
+                rtts, 1500, self.rand.uniform(-1.0, 1.0))
+
+def run_worker(plugin, flow_ids, seed):
+    rand = random.Random(seed)
+    hists = {}
+    for call in CALLS:
+        hists[call] = plugin_stats.LatencyHistogram()
+    flows = [FlowEmulator(flow_id, rand) for flow_id in flow_ids]
+    for flow in flows:
+        start = time.perf_counter()
+        plugin.init(flow.flow_id)
+        hists["init"].record(time.perf_counter() - start)
+    for mi in range(0, MIS_PER_FLOW):
+        for flow in flows:
+            start = time.perf_counter()
+            rate = plugin.get_rate(flow.flow_id)
+            hists["get_rate"].record(time.perf_counter() - start)
+            sample = flow.next_sample(rate)
+            start = time.perf_counter()
+            plugin.give_sample(*sample)
+            hists["give_sample"].record(time.perf_counter() - start)
+    if hasattr(plugin, "close"):
+        for flow in flows:
+            plugin.close(flow.flow_id)
+    return hists
+
+# A failed process worker sends back its traceback in place of results.
+def _process_worker(flow_ids, seed, queue):
+    try:
+        plugin = load_plugin(PLUGIN)
+        rss_before, _ = plugin_stats.get_memory_bytes()
+        hists = run_worker(plugin, flow_ids, seed)
+        rss_after, max_rss = plugin_stats.get_memory_bytes()
+    except Exception:
+        queue.put(traceback.format_exc())
+        return
+    queue.put(({call: hist.__dict__ for call, hist in hists.items()},
+               rss_after - rss_before, max_rss))
+
+def merge_histograms(hist_dicts):
+    merged = {}
+    for call in CALLS:
+        hist = plugin_stats.LatencyHistogram()
+        for other in hist_dicts:
+            o = other[call]
+            hist.counts = [a + b for a, b in zip(hist.counts, o["counts"])]
+            hist.count += o["count"]
+            hist.total += o["total"]
+            hist.max = max(hist.max, o["max"])
+        merged[call] = hist
+    return merged
+
+def stand_in_trainer(port=9787):
+    listen_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listen_sock.bind(("localhost", port))
+    listen_sock.listen(1024)
+
+    def serve(conn):
+        rate = 6.0
+        try:
+            while True:
+                shim_protocol.send_rate(conn, rate)
+                shim_protocol.recv_mi(conn)
+        except (ConnectionError, OSError):
+            conn.close()
+
+    def accept_loop():
+        while True:
+            conn, _ = listen_sock.accept()
+            thread = threading.Thread(target=serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    thread = threading.Thread(target=accept_loop)
+    thread.daemon = True
+    thread.start()
+
+def main():
+    if STAND_IN_TRAINER:
+        stand_in_trainer()
+    flow_ids = list(range(0, N_FLOWS))
+    shards = [flow_ids[i::N_WORKERS] for i in range(0, N_WORKERS)]
+    start = time.time()
+    if WORKER_TYPE == "process":
+        queue = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=_process_worker, args=(shard, i, queue))
+                 for i, shard in enumerate(shards)]
+        for proc in procs:
+            proc.start()
+        results = [queue.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+        for result in results:
+            if isinstance(result, str):
+                raise RuntimeError("Load worker failed:\n" + result)
+        hists = merge_histograms([r[0] for r in results])
+        rss_growth = sum([r[1] for r in results])
+        max_rss = max([r[2] for r in results])
+    else:
+        plugin = load_plugin(PLUGIN)
+        rss_loaded, _ = plugin_stats.get_memory_bytes()
+        worker_hists = [None] * N_WORKERS
+        worker_errors = [None] * N_WORKERS
+        def thread_main(i):
+            try:
+                hists = run_worker(plugin, shards[i], i)
+            except Exception as e:
+                worker_errors[i] = e
+                raise
+            worker_hists[i] = {call: hist.__dict__ for call, hist in hists.items()}
+        threads = [threading.Thread(target=thread_main, args=(i,)) for i in range(0, N_WORKERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for error in worker_errors:
+            if error is not None:
+                raise error
+        hists = merge_histograms(worker_hists)
+        rss_after, max_rss = plugin_stats.get_memory_bytes()
+        rss_growth = rss_after - rss_loaded
+    elapsed = time.time() - start
+
+    n_calls = sum([hist.count for hist in hists.values()])
+    n_mis = hists["give_sample"].count
+    results = {"plugin":PLUGIN, "n_flows":N_FLOWS, "n_workers":N_WORKERS,
+               "worker_type":WORKER_TYPE, "elapsed_s":elapsed,
+               "calls_per_s":n_calls / elapsed, "mis_per_s":n_mis / elapsed,
+               "rss_growth_bytes":rss_growth, "max_rss_bytes":max_rss,
+               "latency_us":{}}
+    print("%d flows, %d MIs in %0.2fs: %0.0f MIs/s, %0.0f calls/s"
+          % (N_FLOWS, n_mis, elapsed, results["mis_per_s"], results["calls_per_s"]))
+    for call in CALLS:
+        hist = hists[call]
+        lat = {"p50":hist.quantile(0.5) * 1e6, "p99":hist.quantile(0.99) * 1e6,
+               "max":hist.max * 1e6, "count":hist.count}
+        results["latency_us"][call] = lat
+        print("\t%s: p50 %0.1fus, p99 %0.1fus, max %0.1fus over %d calls"
+              % (call, lat["p50"], lat["p99"], lat["max"], lat["count"]))
+    print("Memory growth: %0.1f MB (max RSS %0.1f MB)"
+          % (rss_growth / 1e6, max_rss / 1e6))
+    if OUTPUT is not None:
+        with open(OUTPUT, "w") as f:
+            json.dump(results, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -19,10 +19,14 @@ import io
 class LoadedModel():
 
     def __init__(self, model_path):
-        self.sess = tf.Session()
+        # Each model gets its own graph so that a replacement can be loaded
+        # (e.g. by model_reloader.py) while this one is still serving.
+        self.graph = tf.Graph()
+        self.sess = tf.Session(graph=self.graph)
         self.model_path = model_path
-        self.metagraph = tf.saved_model.loader.load(self.sess,
-            [tf.saved_model.tag_constants.SERVING], self.model_path)
+        with self.graph.as_default():
+            self.metagraph = tf.saved_model.loader.load(self.sess,
+                [tf.saved_model.tag_constants.SERVING], self.model_path)
         sig = self.metagraph.signature_def["serving_default"]
         input_dict = dict(sig.inputs)
         output_dict = dict(sig.outputs)       
@@ -56,8 +60,9 @@ class LoadedModel():
         self.state = np.copy(self.initial_state)
 
     def reload(self):
-        self.metagraph = tf.saved_model.loader.load(self.sess,
-            [tf.saved_model.tag_constants.SERVING], self.model_path)
+        with self.graph.as_default():
+            self.metagraph = tf.saved_model.loader.load(self.sess,
+                [tf.saved_model.tag_constants.SERVING], self.model_path)
  
     def act(self, obs, stochastic=False):
         input_dict = {self.input_obs_label:obs}
@@ -12,10 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
 import inspect
 import os
 import random
 import sys
+import threading
+import time
+
+import numpy as np
 
 currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 parentdir = os.path.dirname(currentdir)
@@ -23,9 +28,11 @@ grandparentdir = os.path.dirname(parentdir)
 sys.path.insert(0, parentdir)
 sys.path.insert(0, grandparentdir)
     
-from common import sender_obs
+from common import sender_obs, shim_recording
 from common.simple_arg_parse import arg_or_default
-import loaded_agent
+import flow_table
+import model_reloader
+import plugin_stats
 
 if not hasattr(sys, 'argv'):
     sys.argv  = ['']
@@ -42,6 +49,48 @@ RESET_RATE_MAX = 6.0
 
 MODEL_PATH = arg_or_default("--model-path", "/tmp/")
 
+# Models exported by export_np_model.py and tables from distill_table.py run
+# on NumPy alone, so tensorflow is only imported when serving a SavedModel.
+MODEL_TYPE = arg_or_default("--model-type",
+    "numpy" if MODEL_PATH.endswith(".npz") else "saved-model")
+if MODEL_TYPE == "table":
+    import table_agent
+    Model = table_agent.TableModel
+elif MODEL_TYPE == "numpy":
+    import np_agent
+    Model = np_agent.NumpyModel
+elif MODEL_TYPE == "stand-in":
+    import stand_in_agent
+    Model = stand_in_agent.StandInModel
+else:
+    import loaded_agent
+    Model = loaded_agent.LoadedModel
+
+# All flows share one feed-forward model, so a decision for many flows is one
+# batched call. When a reload interval is set, the shared model is swapped for a new version
+# in the background whenever the files at MODEL_PATH change.
+MODEL_RELOAD_INTERVAL = arg_or_default("--model-reload-interval", 0.0)
+shared_model = None
+
+# Latency histograms, call counts, active flows and memory use are written in
+# Prometheus text format to this file every STATS_INTERVAL seconds.
+STATS_FILE = arg_or_default("--stats-file", None)
+STATS_INTERVAL = arg_or_default("--stats-interval", 10.0)
+
+# Decision skipping: when SKIP_THRESHOLD > 0, a flow whose observation differs
+# from the one its last model decision was made on by at most SKIP_THRESHOLD
+# (in every element) reuses that decision. SKIP_MODE "repeat" applies the last
+# rate delta again and "hold" keeps the rate. A fresh decision is forced at
+# least every SKIP_MAX_MIS monitor intervals.
+SKIP_THRESHOLD = arg_or_default("--skip-threshold", 0.0)
+SKIP_MODE = arg_or_default("--skip-mode", "hold")
+SKIP_MAX_MIS = arg_or_default("--skip-max-mis", 10)
+
+# Every MI given to the plugin, with the rate (in Mbps) its flow was sending
+# at, is appended to this file in the shim_recording format, for offline
+# analysis such as policy_diff.py.
+MI_LOG = arg_or_default("--mi-log", None)
+
 for arg in sys.argv:
     arg_str = "NULL"
     try:
@@ -54,88 +103,191 @@ for arg in sys.argv:
         RESET_RATE_MAX = float(arg_str)
 
 class PccGymDriver():
-    
-    flow_lookup = {}
-    
-    def __init__(self, flow_id):
-        global RESET_RATE_MIN
-        global RESET_RATE_MAX
-
-        self.id = flow_id
 
-        self.rate = random.uniform(RESET_RATE_MIN, RESET_RATE_MAX)
+    # Drives every flow in the process. Per-flow state lives in a FlowTable
+    # slot, so flows cost a few hundred bytes and are freed by close().
+    def __init__(self):
         self.history_len = arg_or_default("--history-len", 10)
         self.features = arg_or_default("--input-features",
                                        default="sent latency inflation,"
                                              + "latency ratio,"
                                              + "send ratio").split(",")
-        self.history = sender_obs.SenderHistory(self.history_len,
-                                                self.features,
-                                                self.id)
-        self.got_data = False
+        self.flows = flow_table.FlowTable(self.history_len, len(self.features),
+                                          track_decisions=(SKIP_THRESHOLD > 0.0))
+        self.model = None
 
-        self.agent = loaded_agent.LoadedModelAgent(MODEL_PATH)
+        # Skip counters, and the utility reported for intervals sent at a
+        # rate chosen by a fresh decision versus a reused one.
+        self.n_decisions = 0
+        self.n_skips = 0
+        self.decision_utility_sum = 0.0
+        self.n_decision_utility = 0
+        self.skip_utility_sum = 0.0
+        self.n_skip_utility = 0
 
-        PccGymDriver.flow_lookup[flow_id] = self
+    def init(self, flow_id):
+        with self.flows.lock:
+            if self.model is None:
+                self.model = get_shared_model(self.history_len * len(self.features))
+            # Initializing a known flow again resets it in place.
+            if flow_id in self.flows.slots:
+                sender_obs.forget_sender(flow_id)
+            slot = self.flows.add(flow_id)
+            self.flows.rate[slot] = random.uniform(RESET_RATE_MIN, RESET_RATE_MAX)
+            self.reset_history(flow_id, slot)
 
-    def get_rate(self):
-        if self.has_data():
-            rate_delta = self.agent.act(self.history.as_array())
-            self.rate = apply_rate_delta(self.rate, rate_delta)
-        return self.rate * 1e6
+    def close(self, flow_id):
+        with self.flows.lock:
+            self.flows.remove(flow_id)
+        sender_obs.forget_sender(flow_id)
 
-    def has_data(self):
-        return self.got_data
+    def get_rate(self, flow_id):
+        return self.get_rates([flow_id])[0]
 
-    def set_current_rate(self, new_rate):
-        self.current_rate = new_rate
+    # Updates the rates of several flows, running the model once for all of
+    # the flows that need a fresh decision. The table is locked while
+    # observations are gathered and rates written back, but not while the
+    # model runs.
+    def get_rates(self, flow_ids):
+        to_decide = []
+        with self.flows.lock:
+            slots = [self.flows.lookup(flow_id) for flow_id in flow_ids]
+            for slot in slots:
+                if not self.flows.got_data[slot]:
+                    continue
+                if self.flows.track_decisions and self.can_skip(slot, self.flows.get_obs(slot)):
+                    rate_delta = 0.0
+                    if SKIP_MODE == "repeat":
+                        rate_delta = self.flows.last_delta[slot]
+                    self.flows.n_skipped[slot] += 1
+                    self.flows.last_skipped[slot] = True
+                    self.n_skips += 1
+                    self.flows.rate[slot] = apply_rate_delta(self.flows.rate[slot], rate_delta)
+                else:
+                    to_decide.append(slot)
+            if len(to_decide) > 0:
+                obs = self.flows.history[to_decide].reshape(len(to_decide), -1)
 
-    def record_observation(self, new_mi):
-        self.history.step(new_mi)
-        self.got_data = True
+        if len(to_decide) > 0:
+            if stats is not None:
+                start = time.perf_counter()
+                rate_deltas = self.act(obs)
+                stats.record("model", time.perf_counter() - start)
+            else:
+                rate_deltas = self.act(obs)
 
-    def reset_rate(self):
-        self.current_rate = random.uniform(RESET_RATE_MIN, RESET_RATE_MAX)
+        with self.flows.lock:
+            for i, slot in enumerate(to_decide):
+                rate_delta = rate_deltas[i]
+                if self.flows.track_decisions:
+                    self.flows.last_obs[slot] = obs[i]
+                    self.flows.last_delta[slot] = rate_delta
+                    self.flows.n_skipped[slot] = 0
+                    self.flows.last_skipped[slot] = False
+                    self.n_decisions += 1
+                self.flows.rate[slot] = apply_rate_delta(self.flows.rate[slot], rate_delta)
+            return [float(self.flows.rate[slot]) * 1e6 for slot in slots]
 
-    def reset_history(self):
-        self.history = sender_obs.SenderHistory(self.history_len,
-                                                self.features,
-                                                self.id)
-        self.got_data = False
+    def act(self, obs):
+        return np.asarray(self.model.act(obs)["act"])[:, 0]
 
-    def reset(self):
-        self.agent.reset()
-        self.reset_rate()
-        self.reset_history()
+    def can_skip(self, slot, obs):
+        if self.flows.n_skipped[slot] + 1 >= SKIP_MAX_MIS:
+            return False
+        return np.max(np.abs(obs - self.flows.last_obs[slot])) <= SKIP_THRESHOLD
 
-    def give_sample(self, bytes_sent, bytes_acked, bytes_lost,
+    def get_skip_ratio(self):
+        total = self.n_decisions + self.n_skips
+        if total == 0:
+            return 0.0
+        return self.n_skips / total
+
+    # Mean utility of intervals following skipped decisions minus that of
+    # intervals following fresh decisions.
+    def get_skip_utility_change(self):
+        if self.n_skip_utility == 0 or self.n_decision_utility == 0:
+            return 0.0
+        return (self.skip_utility_sum / self.n_skip_utility
+                - self.decision_utility_sum / self.n_decision_utility)
+
+    # An empty monitor interval, as used to pad a fresh SenderHistory.
+    def reset_history(self, flow_id, slot):
+        empty_mi = sender_obs.SenderMonitorInterval(flow_id)
+        self.flows.fill_history(slot, empty_mi.as_array(self.features))
+        if self.flows.track_decisions:
+            # Force a fresh decision on the next call to get_rate.
+            self.flows.n_skipped[slot] = SKIP_MAX_MIS
+            self.flows.last_skipped[slot] = False
+
+    # Matches the original per-flow driver, which reset the history but left
+    # the sending rate unchanged.
+    def reset(self, flow_id):
+        with self.flows.lock:
+            self.reset_history(flow_id, self.flows.lookup(flow_id))
+
+    def give_sample(self, flow_id, bytes_sent, bytes_acked, bytes_lost,
                     send_start_time, send_end_time, recv_start_time,
                     recv_end_time, rtt_samples, packet_size, utility):
-        self.record_observation(
-            sender_obs.SenderMonitorInterval(
-                self.id,
-                bytes_sent=bytes_sent,
-                bytes_acked=bytes_acked,
-                bytes_lost=bytes_lost,
-                send_start=send_start_time,
-                send_end=send_end_time,
-                recv_start=recv_start_time,
-                recv_end=recv_end_time,
-                rtt_samples=rtt_samples,
-                packet_size=packet_size
-            )
+        slot = self.flows.lookup(flow_id)
+        mi = sender_obs.SenderMonitorInterval(
+            flow_id,
+            bytes_sent=bytes_sent,
+            bytes_acked=bytes_acked,
+            bytes_lost=bytes_lost,
+            send_start=send_start_time,
+            send_end=send_end_time,
+            recv_start=recv_start_time,
+            recv_end=recv_end_time,
+            rtt_samples=rtt_samples,
+            packet_size=packet_size
         )
+        row = mi.as_array(self.features)
+        with self.flows.lock:
+            self.flows.push(slot, row)
+            if self.flows.track_decisions:
+                if self.flows.last_skipped[slot]:
+                    self.skip_utility_sum += utility
+                    self.n_skip_utility += 1
+                else:
+                    self.decision_utility_sum += utility
+                    self.n_decision_utility += 1
+
+# Recurrent policies keep one state for the whole model, which flows sharing
+# it would overwrite, so they are rejected.
+def get_shared_model(obs_dim):
+    global shared_model
+    if shared_model is None:
+        if MODEL_RELOAD_INTERVAL > 0.0:
+            model = model_reloader.ReloadingModel(MODEL_PATH, Model,
+                obs_dim, MODEL_RELOAD_INTERVAL)
+        else:
+            model = Model(MODEL_PATH)
+            if getattr(model, "initial_state", None) is not None:
+                raise ValueError("%s is a recurrent policy; shared models must be feed-forward"
+                                 % MODEL_PATH)
+        shared_model = model
+    return shared_model
 
-    def get_by_flow_id(flow_id):
-        return PccGymDriver.flow_lookup[flow_id]
+driver = PccGymDriver()
 
 def give_sample(flow_id, bytes_sent, bytes_acked, bytes_lost,
                 send_start_time, send_end_time, recv_start_time,
                 recv_end_time, rtt_samples, packet_size, utility):
-    driver = PccGymDriver.get_by_flow_id(flow_id)
-    driver.give_sample(bytes_sent, bytes_acked, bytes_lost,
+    if stats is not None:
+        start = time.perf_counter()
+    if mi_log is not None:
+        with mi_log_lock:
+            with driver.flows.lock:
+                rate = float(driver.flows.rate[driver.flows.lookup(flow_id)])
+            mi_log.record_rate(rate)
+            mi_log.record_mi(flow_id, bytes_sent, bytes_acked, bytes_lost,
+                             send_start_time, send_end_time, recv_start_time,
+                             recv_end_time, rtt_samples, packet_size, utility)
+    driver.give_sample(flow_id, bytes_sent, bytes_acked, bytes_lost,
                        send_start_time, send_end_time, recv_start_time,
                        recv_end_time, rtt_samples, packet_size, utility)
+    if stats is not None:
+        stats.record("give_sample", time.perf_counter() - start)
 
 def apply_rate_delta(rate, rate_delta):
     global MIN_RATE
@@ -161,13 +313,38 @@ def apply_rate_delta(rate, rate_delta):
     return rate
     
 def reset(flow_id):
-    driver = PccGymDriver.get_by_flow_id(flow_id)
-    driver.reset()
+    driver.reset(flow_id)
 
 def get_rate(flow_id):
     #print("Getting rate")
-    driver = PccGymDriver.get_by_flow_id(flow_id)
-    return driver.get_rate()
+    if stats is not None:
+        start = time.perf_counter()
+    rate = driver.get_rate(flow_id)
+    if stats is not None:
+        stats.record("get_rate", time.perf_counter() - start)
+    return rate
 
 def init(flow_id):
-    driver = PccGymDriver(flow_id)
+    driver.init(flow_id)
+    if stats is not None:
+        stats.incr("init")
+
+def close(flow_id):
+    driver.close(flow_id)
+    if stats is not None:
+        stats.incr("close")
+
+mi_log = None
+mi_log_lock = threading.Lock()
+if MI_LOG is not None:
+    mi_log = shim_recording.ShimRecorder(MI_LOG)
+    mi_log.start_session()
+    atexit.register(mi_log.close)
+
+stats = None
+if STATS_FILE is not None:
+    stats = plugin_stats.PluginStats(STATS_FILE, STATS_INTERVAL,
+        active_flows_fn=lambda: len(driver.flows))
+    if SKIP_THRESHOLD > 0.0:
+        stats.add_gauge("skip_ratio", driver.get_skip_ratio)
+        stats.add_gauge("skip_utility_change", driver.get_skip_utility_change)
@@ -0,0 +1,108 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+import time
+import traceback
+
+import numpy as np
+
+# Hot reloading for the models served by loaded_client.py. A background thread
+# polls the model path; once a change has settled it loads a fresh model off
+# the hot path, checks it with a warm-up inference and then replaces the
+# served model with a single reference assignment. A call that already
+# fetched the old model finishes on it, and the old model is freed once the
+# last such call returns.
+
+def model_fingerprint(model_path):
+    if os.path.isfile(model_path):
+        stat = os.stat(model_path)
+        return (stat.st_mtime, stat.st_size)
+    fingerprint = []
+    for dirpath, dirnames, filenames in os.walk(model_path):
+        for filename in filenames:
+            stat = os.stat(os.path.join(dirpath, filename))
+            fingerprint.append((filename, stat.st_mtime, stat.st_size))
+    return tuple(sorted(fingerprint))
+
+class ReloadingModel():
+
+    def __init__(self, model_path, model_class, obs_dim, poll_interval=5.0):
+        self.model_path = model_path
+        self.model_class = model_class
+        self.obs_dim = obs_dim
+        self.poll_interval = poll_interval
+        self.n_reloads = 0
+        self.n_failed_reloads = 0
+
+        self.fingerprint = model_fingerprint(model_path)
+        self.model = self.load_and_validate()
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._watch, name="model-reloader")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def load_and_validate(self):
+        model = self.model_class(self.model_path)
+        if getattr(model, "initial_state", None) is not None:
+            raise ValueError("%s is a recurrent policy; shared models must be feed-forward"
+                             % self.model_path)
+        warmup_obs = np.zeros((1, self.obs_dim), dtype=np.float32)
+        action = np.asarray(model.act(warmup_obs)["act"])
+        if action.shape[0] != 1 or not np.all(np.isfinite(action)):
+            raise ValueError("Warm-up inference on %s returned %s"
+                             % (self.model_path, str(action)))
+        model.reset_state()
+        return model
+
+    def _watch(self):
+        pending = None
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                fingerprint = model_fingerprint(self.model_path)
+            except OSError:
+                continue # The model is being replaced; try again next poll.
+            if fingerprint == self.fingerprint:
+                pending = None
+                continue
+            # Only load once the files have stopped changing for a full poll
+            # interval, so we never read a half-written model.
+            if fingerprint != pending:
+                pending = fingerprint
+                continue
+            try:
+                start = time.time()
+                new_model = self.load_and_validate()
+            except Exception:
+                self.n_failed_reloads += 1
+                print("Failed to reload model from %s:" % self.model_path)
+                traceback.print_exc()
+            else:
+                self.model = new_model
+                self.n_reloads += 1
+                print("Reloaded model from %s in %0.3fs"
+                      % (self.model_path, time.time() - start))
+            self.fingerprint = fingerprint
+            pending = None
+
+    def stop(self):
+        self.stop_event.set()
+
+    def reset_state(self):
+        self.model.reset_state()
+
+    def act(self, obs, stochastic=False):
+        return self.model.act(obs, stochastic)
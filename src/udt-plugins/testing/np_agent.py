@@ -0,0 +1,92 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+# Pure-NumPy runtime for the deterministic MLP policy exported by
+# export_np_model.py. Mirrors the LoadedModel/LoadedModelAgent interface from
+# loaded_agent.py without importing tensorflow.
+
+NP_MODEL_FORMAT_VERSION = 1
+
+def _relu(x):
+    return np.maximum(x, 0.0)
+
+def _identity(x):
+    return x
+
+ACTIVATIONS = {
+    "tanh": np.tanh,
+    "relu": _relu,
+    "linear": _identity,
+}
+
+class NumpyModel():
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.load()
+
+    def load(self):
+        with np.load(self.model_path) as data:
+            version = int(data["format_version"])
+            if version != NP_MODEL_FORMAT_VERSION:
+                raise ValueError("Unsupported exported model version %d in %s"
+                                 % (version, self.model_path))
+            n_layers = int(data["n_layers"])
+            self.layers = []
+            for i in range(0, n_layers):
+                self.layers.append((data["w_%d" % i].astype(np.float32),
+                                    data["b_%d" % i].astype(np.float32)))
+            self.act_fun_name = str(data["act_fun"])
+            self.out_w = data["out_w"].astype(np.float32)
+            self.out_b = data["out_b"].astype(np.float32)
+            self.logstd = None
+            if "logstd" in data.files:
+                self.logstd = data["logstd"].astype(np.float32)
+        self.act_fun = ACTIVATIONS[self.act_fun_name]
+        self.obs_dim = self.out_w.shape[0]
+        if len(self.layers) > 0:
+            self.obs_dim = self.layers[0][0].shape[0]
+        self.act_dim = self.out_w.shape[1]
+
+    def reset_state(self):
+        pass # Feed-forward policies have no recurrent state.
+
+    def reload(self):
+        self.load()
+
+    # Accepts a single observation or a (batch, obs_dim) array and always
+    # returns a (batch, act_dim) array, like the tensorflow model does.
+    def act(self, obs, stochastic=False):
+        x = np.asarray(obs, dtype=np.float32).reshape(-1, self.obs_dim)
+        for w, b in self.layers:
+            x = self.act_fun(np.dot(x, w) + b)
+        action = np.dot(x, self.out_w) + self.out_b
+        if stochastic and self.logstd is not None:
+            noise = np.random.standard_normal(action.shape).astype(np.float32)
+            action = action + np.exp(self.logstd) * noise
+        return {"act":action}
+
+class NumpyModelAgent():
+
+    def __init__(self, model_path):
+        self.model = NumpyModel(model_path)
+
+    def reset(self):
+        self.model.reset_state()
+
+    def act(self, ob):
+        act_dict = self.model.act(ob.reshape(1,-1), stochastic=False)
+        return act_dict["act"][0][0]
@@ -0,0 +1,154 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import os
+import resource
+import threading
+
+# Low-overhead telemetry for the UDT plugins. Latencies go into fixed
+# log-spaced histograms (a list index increment per call) and a background
+# thread periodically rewrites a Prometheus text-format file from them.
+#
+# Updates are not locked. Under heavy multi-threaded use an increment can
+# occasionally be lost, which is fine for monitoring and keeps the hot path
+# free of lock traffic.
+
+BUCKETS_PER_OCTAVE = 4
+MIN_LATENCY_US = 1.0
+N_BUCKETS = BUCKETS_PER_OCTAVE * 28 # 1us up to ~4.5 minutes
+
+def _bucket_upper_bound(bucket):
+    return MIN_LATENCY_US * 2.0 ** ((bucket + 1) / BUCKETS_PER_OCTAVE) * 1e-6
+
+class LatencyHistogram():
+
+    def __init__(self):
+        self.counts = [0] * N_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        us = seconds * 1e6
+        bucket = 0
+        if us > MIN_LATENCY_US:
+            bucket = min(N_BUCKETS - 1, int(math.log2(us / MIN_LATENCY_US) * BUCKETS_PER_OCTAVE))
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # Returns the upper bound of the bucket holding the given quantile, which
+    # overestimates by at most one bucket width (~19%).
+    def quantile(self, q):
+        counts = list(self.counts)
+        n = sum(counts)
+        if n == 0:
+            return 0.0
+        target = q * n
+        seen = 0
+        for bucket, count in enumerate(counts):
+            seen += count
+            if seen >= target:
+                return min(_bucket_upper_bound(bucket), self.max)
+        return self.max
+
+def get_memory_bytes():
+    rss = 0
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    # ru_maxrss is in kilobytes on Linux.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return rss, max_rss
+
+class PluginStats():
+
+    def __init__(self, stats_file, interval=10.0, active_flows_fn=None,
+                 prefix="pcc_plugin"):
+        self.stats_file = stats_file
+        self.interval = interval
+        self.active_flows_fn = active_flows_fn
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._write_loop, name="plugin-stats")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self, name, seconds):
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms.setdefault(name, LatencyHistogram())
+        hist.record(seconds)
+
+    def incr(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    # Registers a function that is called each time the stats are written.
+    def add_gauge(self, name, fn):
+        self.gauges[name] = fn
+
+    def format(self):
+        p = self.prefix
+        lines = []
+        lines.append("# TYPE %s_call_latency_seconds summary" % p)
+        for name, hist in sorted(self.histograms.items()):
+            for q in (0.5, 0.99):
+                lines.append('%s_call_latency_seconds{call="%s",quantile="%g"} %.9g'
+                             % (p, name, q, hist.quantile(q)))
+            lines.append('%s_call_latency_seconds_sum{call="%s"} %.9g' % (p, name, hist.total))
+            lines.append('%s_call_latency_seconds_count{call="%s"} %d' % (p, name, hist.count))
+        lines.append("# TYPE %s_call_latency_max_seconds gauge" % p)
+        for name, hist in sorted(self.histograms.items()):
+            lines.append('%s_call_latency_max_seconds{call="%s"} %.9g' % (p, name, hist.max))
+        if len(self.counters) > 0:
+            lines.append("# TYPE %s_events_total counter" % p)
+            for name, value in sorted(self.counters.items()):
+                lines.append('%s_events_total{event="%s"} %d' % (p, name, value))
+        if self.active_flows_fn is not None:
+            lines.append("# TYPE %s_active_flows gauge" % p)
+            lines.append("%s_active_flows %d" % (p, self.active_flows_fn()))
+        for name, fn in sorted(self.gauges.items()):
+            lines.append("# TYPE %s_%s gauge" % (p, name))
+            lines.append("%s_%s %.9g" % (p, name, fn()))
+        rss, max_rss = get_memory_bytes()
+        lines.append("# TYPE %s_resident_memory_bytes gauge" % p)
+        lines.append("%s_resident_memory_bytes %d" % (p, rss))
+        lines.append("# TYPE %s_max_resident_memory_bytes gauge" % p)
+        lines.append("%s_max_resident_memory_bytes %d" % (p, max_rss))
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        # Write then rename so readers never see a partial file.
+        tmp_file = "%s.tmp.%d" % (self.stats_file, os.getpid())
+        with open(tmp_file, "w") as f:
+            f.write(self.format())
+        os.replace(tmp_file, self.stats_file)
+
+    def _write_loop(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                print("Failed to write plugin stats to %s: %s" % (self.stats_file, e))
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,205 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+##
+#   Compares the decisions of two or more policies on logged monitor
+#   intervals, without a network.
+#
+#   usage: python3 policy_diff.py --mi-log=<log>[,<log>...]
+#              --model-paths=<reference>,<candidate>[,...]
+#              [--batch-size=65536] [--delta-scale=0.05] [--min-rate=0.5]
+#              [--max-rate=300.0] [--output=<report.json>]
+#              [--flow-output=<flows.csv>] [--history-len=10]
+#              [--input-features=...]
+#
+#   Logs come from loaded_client.py --mi-log or ShimNetworkEnv --shim-record.
+#   The observation after every MI is rebuilt in bulk with the vectorized
+#   sender_obs pipeline, and every policy (SavedModel or .npz) acts on all of
+#   them in large batches. The first policy is the reference. The report gives
+#   the distribution of each candidate's action minus the reference action.
+#
+#   It also replays each policy's decisions from every flow's first logged
+#   rate, using loaded_client's rate update, and reports how far the
+#   resulting rate trajectories drift from the reference and from the logged
+#   rates (as |log2| ratios). The replay is open loop: the network is assumed
+#   to behave as logged whatever rate a policy picks, and the min/max rate
+#   clamp is applied to the end result rather than at every step.
+##
+
+import inspect
+import json
+import os
+import sys
+import time
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+grandparentdir = os.path.dirname(parentdir)
+sys.path.insert(0, parentdir)
+sys.path.insert(0, grandparentdir)
+
+import numpy as np
+
+from common import sender_obs, shim_recording
+from common.simple_arg_parse import arg_or_default
+import distill_table
+
+PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
+
+# Concatenates several logs, keeping flows from different files apart.
+def load_logs(paths):
+    all_columns = []
+    all_keys = []
+    for path_index, path in enumerate(paths):
+        columns, flow_keys = shim_recording.load_columns(path)
+        columns["flow"] = columns["flow"] + len(all_keys)
+        all_keys += [(path_index,) + key for key in flow_keys]
+        all_columns.append(columns)
+    columns = {}
+    for name in all_columns[0].keys():
+        columns[name] = np.concatenate([c[name] for c in all_columns])
+    # Group each flow's MIs together, keeping them in order.
+    order = np.argsort(columns["flow"], kind="stable")
+    for name in columns.keys():
+        columns[name] = columns[name][order]
+    return columns, all_keys
+
+def run_policies(models, feature_rows, flow, history_len, features, batch_size):
+    actions = [np.zeros(len(flow), dtype=np.float32) for _ in models]
+    for start in range(0, len(flow), batch_size):
+        end = min(len(flow), start + batch_size)
+        obs = sender_obs.batch_history(feature_rows, flow, history_len, features, start, end)
+        for i, model in enumerate(models):
+            actions[i][start:end] = np.asarray(model.act(obs)["act"]).reshape(-1)
+    return actions
+
+def distribution(values):
+    result = {"mean":float(np.mean(values)), "std":float(np.std(values))}
+    for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        result["p%d" % p] = float(v)
+    return result
+
+# The log2 of the rate after each decision, following loaded_client's
+# apply_rate_delta from the flow's first logged rate.
+def log2_rate_trajectory(actions, flow, flow_starts, first_rates, delta_scale, min_rate, max_rate):
+    delta = actions.astype(np.float64) * delta_scale
+    steps = np.where(delta >= 0.0, np.log2(1.0 + np.abs(delta)), -np.log2(1.0 + np.abs(delta)))
+    cumsum = np.cumsum(steps)
+    before_flow = np.concatenate([[0.0], cumsum])[flow_starts]
+    log2_rates = np.log2(first_rates)[flow] + cumsum - before_flow[flow]
+    return np.clip(log2_rates, np.log2(min_rate), np.log2(max_rate))
+
+def flow_divergence(log2_a, log2_b, flow_starts, flow_lengths):
+    valid = np.isfinite(log2_a) & np.isfinite(log2_b)
+    gap = np.where(valid, np.abs(log2_a - log2_b), 0.0)
+    mean_gap = np.add.reduceat(gap, flow_starts) / np.maximum(
+        np.add.reduceat(valid.astype(np.float64), flow_starts), 1.0)
+    max_gap = np.maximum.reduceat(gap, flow_starts)
+    final_gap = gap[flow_starts + flow_lengths - 1]
+    return mean_gap, max_gap, final_gap
+
+def main():
+    log_paths = arg_or_default("--mi-log", "/tmp/pcc_mi.log").split(",")
+    model_paths = arg_or_default("--model-paths", "").split(",")
+    batch_size = arg_or_default("--batch-size", 65536)
+    # loaded_client's DELTA_SCALE, MIN_RATE and MAX_RATE. It is not imported,
+    # since importing it starts a driver for its own model.
+    delta_scale = arg_or_default("--delta-scale", 0.05)
+    min_rate = arg_or_default("--min-rate", 0.5)
+    max_rate = arg_or_default("--max-rate", 300.0)
+    output = arg_or_default("--output", None)
+    flow_output = arg_or_default("--flow-output", None)
+    history_len = arg_or_default("--history-len", 10)
+    features = arg_or_default("--input-features",
+                              default="sent latency inflation,"
+                                    + "latency ratio,"
+                                    + "send ratio").split(",")
+    if len(model_paths) < 2:
+        print("Need at least two policies in --model-paths")
+        sys.exit(1)
+
+    start = time.time()
+    columns, flow_keys = load_logs(log_paths)
+    flow = columns["flow"]
+    n_mis = len(flow)
+    print("Loaded %d MIs from %d flows in %0.1fs" % (n_mis, len(flow_keys), time.time() - start))
+
+    start = time.time()
+    feature_rows = sender_obs.batch_features(columns, features)
+    models = [distill_table.load_policy(path) for path in model_paths]
+    actions = run_policies(models, feature_rows, flow, history_len, features, batch_size)
+    elapsed = time.time() - start
+    print("Ran %d policies on %d observations in %0.1fs (%0.0f MIs/s)"
+          % (len(models), n_mis, elapsed, n_mis / max(elapsed, 1e-9)))
+
+    flow_starts = np.flatnonzero(np.concatenate([[True], flow[1:] != flow[:-1]]))
+    flow_lengths = np.diff(np.concatenate([flow_starts, [n_mis]]))
+    flow_index = np.repeat(np.arange(len(flow_starts)), flow_lengths)
+    first_rates = columns["rate"][flow_starts]
+    trajectories = [log2_rate_trajectory(a, flow_index, flow_starts, first_rates,
+                                         delta_scale, min_rate, max_rate) for a in actions]
+    # The logged rate following each decision; the last MI of a flow has none.
+    logged = np.full(n_mis, np.nan)
+    logged[:-1] = np.log2(np.maximum(columns["rate"][1:], 1e-12))
+    logged[flow_starts + flow_lengths - 1] = np.nan
+
+    report = {"n_mis":int(n_mis), "n_flows":len(flow_keys), "reference":model_paths[0],
+              "candidates":[]}
+    flow_rows = []
+    for i in range(0, len(models)):
+        entry = {"model":model_paths[i]}
+        if i > 0:
+            diff = actions[i] - actions[0]
+            entry["action_diff"] = distribution(diff)
+            entry["abs_action_diff"] = distribution(np.abs(diff))
+            entry["sign_agreement"] = float(np.mean(np.sign(actions[i]) == np.sign(actions[0])))
+            mean_gap, max_gap, final_gap = flow_divergence(trajectories[i], trajectories[0],
+                                                           flow_starts, flow_lengths)
+            entry["rate_divergence_vs_reference"] = {"mean_log2":distribution(mean_gap),
+                                                     "max_log2":distribution(max_gap),
+                                                     "final_log2":distribution(final_gap)}
+        mean_gap, max_gap, final_gap = flow_divergence(trajectories[i], logged,
+                                                       flow_starts, flow_lengths)
+        entry["rate_divergence_vs_logged"] = {"mean_log2":distribution(mean_gap),
+                                              "max_log2":distribution(max_gap)}
+        for j, key in enumerate(flow_keys):
+            flow_rows.append((model_paths[i], key, int(flow_lengths[j]),
+                              float(mean_gap[j]), float(max_gap[j])))
+        report["candidates"].append(entry)
+
+        print("%s:" % model_paths[i])
+        if i > 0:
+            d = entry["action_diff"]
+            print("\taction - reference: mean %0.3f, p5 %0.3f, p50 %0.3f, p95 %0.3f; |diff| p99 %0.3f; same sign %0.1f%%"
+                  % (d["mean"], d["p5"], d["p50"], d["p95"], entry["abs_action_diff"]["p99"],
+                     100.0 * entry["sign_agreement"]))
+            g = entry["rate_divergence_vs_reference"]
+            print("\trate vs reference per flow (|log2|): mean p50 %0.3f, p95 %0.3f; max p95 %0.3f"
+                  % (g["mean_log2"]["p50"], g["mean_log2"]["p95"], g["max_log2"]["p95"]))
+        g = entry["rate_divergence_vs_logged"]
+        print("\trate vs logged per flow (|log2|): mean p50 %0.3f, p95 %0.3f"
+              % (g["mean_log2"]["p50"], g["mean_log2"]["p95"]))
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=4)
+    if flow_output is not None:
+        with open(flow_output, "w") as f:
+            f.write("model,flow,n_mis,mean_log2_vs_logged,max_log2_vs_logged\n")
+            for model_path, key, n, mean_gap, max_gap in flow_rows:
+                f.write("%s,%s,%d,%f,%f\n" % (model_path, "/".join([str(k) for k in key]),
+                                              n, mean_gap, max_gap))
+
+if __name__ == "__main__":
+    main()
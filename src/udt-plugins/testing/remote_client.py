@@ -0,0 +1,84 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Thin drop-in replacement for loaded_client.py that forwards every plugin
+# call to inference_server.py over a Unix domain socket. It imports neither
+# numpy nor tensorflow, so each pccclient process stays small.
+
+import inspect
+import os
+import socket
+import sys
+import threading
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+grandparentdir = os.path.dirname(parentdir)
+sys.path.insert(0, parentdir)
+sys.path.insert(0, grandparentdir)
+
+if not hasattr(sys, 'argv'):
+    sys.argv  = ['']
+
+from common.simple_arg_parse import arg_or_default
+import inference_protocol
+
+SERVER_PATH = arg_or_default("--server-path", "/tmp/pcc_inference.sock")
+
+class PccRemoteDriver():
+
+    def __init__(self, server_path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(server_path)
+        # UDT may call in from several threads; a request and its reply must
+        # not interleave with another thread's.
+        self.lock = threading.Lock()
+
+    def send(self, msg):
+        with self.lock:
+            self.sock.sendall(msg)
+
+    def get_rate(self, flow_id):
+        reply_size = inference_protocol.RATE_REPLY.size
+        with self.lock:
+            self.sock.sendall(inference_protocol.pack_request(
+                inference_protocol.MSG_GET_RATE, flow_id))
+            reply = b""
+            while len(reply) < reply_size:
+                data = self.sock.recv(reply_size - len(reply))
+                if len(data) == 0:
+                    raise ConnectionError("Inference server closed the connection")
+                reply += data
+        return inference_protocol.RATE_REPLY.unpack(reply)[0]
+
+driver = PccRemoteDriver(SERVER_PATH)
+
+def give_sample(flow_id, bytes_sent, bytes_acked, bytes_lost,
+                send_start_time, send_end_time, recv_start_time,
+                recv_end_time, rtt_samples, packet_size, utility):
+    driver.send(inference_protocol.pack_sample(flow_id, bytes_sent,
+        bytes_acked, bytes_lost, send_start_time, send_end_time,
+        recv_start_time, recv_end_time, rtt_samples, packet_size, utility))
+
+def reset(flow_id):
+    driver.send(inference_protocol.pack_request(inference_protocol.MSG_RESET, flow_id))
+
+def get_rate(flow_id):
+    return driver.get_rate(flow_id)
+
+def init(flow_id):
+    driver.send(inference_protocol.pack_request(inference_protocol.MSG_INIT, flow_id))
+
+def close(flow_id):
+    driver.send(inference_protocol.pack_request(inference_protocol.MSG_CLOSE, flow_id))
@@ -0,0 +1,58 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from common.simple_arg_parse import arg_or_default
+import np_agent
+
+# Stand-in policy for benchmarking the plugins without a trained model. It is
+# an MLP with the default 32,16 architecture and small random weights, sized
+# for the --history-len and --input-features the plugin observes, so it costs
+# about as much as a real exported model. Selected with --model-type=stand-in.
+
+STAND_IN_ARCH = [32, 16]
+
+class StandInModel(np_agent.NumpyModel):
+
+    def __init__(self, model_path=None, seed=0, obs_dim=None):
+        self.model_path = model_path
+        self.seed = seed
+        self.logstd = None
+        self.act_fun = np.tanh
+        if obs_dim is None:
+            features = arg_or_default("--input-features",
+                                      default="sent latency inflation,"
+                                            + "latency ratio,"
+                                            + "send ratio").split(",")
+            obs_dim = arg_or_default("--history-len", 10) * len(features)
+        # Built up front: the plugin's threads may make their first calls at
+        # the same time.
+        self.build(obs_dim)
+
+    def load(self):
+        pass
+
+    def build(self, obs_dim):
+        rand = np.random.RandomState(self.seed)
+        self.layers = []
+        in_dim = obs_dim
+        for width in STAND_IN_ARCH:
+            w = (0.1 * rand.standard_normal((in_dim, width))).astype(np.float32)
+            self.layers.append((w, np.zeros(width, dtype=np.float32)))
+            in_dim = width
+        self.out_w = (0.1 * rand.standard_normal((in_dim, 1))).astype(np.float32)
+        self.out_b = np.zeros(1, dtype=np.float32)
+        self.obs_dim = obs_dim
+        self.act_dim = 1
@@ -0,0 +1,94 @@
+# Copyright 2019 Nathan Jay and Noga Rotman
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import numpy as np
+
+# Constant-time runtime for the interpolation tables written by
+# distill_table.py. An observation is projected onto the table's principal
+# components and the action is interpolated multilinearly between the 2^k
+# surrounding grid points.
+
+TABLE_FORMAT_VERSION = 1
+
+def dequantize(q_table, act_min, act_max):
+    levels = float(np.iinfo(q_table.dtype).max)
+    return (act_min + (act_max - act_min) * (q_table.astype(np.float32) / levels)).astype(np.float32)
+
+def quantize(table, act_min, act_max, dtype):
+    levels = float(np.iinfo(dtype).max)
+    span = max(act_max - act_min, 1e-12)
+    return np.round((table - act_min) / span * levels).astype(dtype)
+
+class TableModel():
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.load()
+
+    def load(self):
+        with np.load(self.model_path) as data:
+            version = int(data["format_version"])
+            if version != TABLE_FORMAT_VERSION:
+                raise ValueError("Unsupported table version %d in %s"
+                                 % (version, self.model_path))
+            self.mean = data["mean"].astype(np.float32)
+            self.components = data["components"].astype(np.float32)
+            self.grid_min = data["grid_min"].astype(np.float32)
+            self.grid_step = data["grid_step"].astype(np.float32)
+            self.features = str(data["features"]).split(",")
+            self.history_len = int(data["history_len"])
+            q_table = data["table"]
+            self.table = dequantize(q_table, float(data["act_min"]),
+                                    float(data["act_max"])).reshape(-1)
+            self.bins = np.array(q_table.shape, dtype=np.int64)
+        self.obs_dim = self.mean.shape[0]
+        self.n_dims = len(self.bins)
+        strides = np.ones(self.n_dims, dtype=np.int64)
+        for i in range(self.n_dims - 2, -1, -1):
+            strides[i] = strides[i + 1] * self.bins[i + 1]
+        self.strides = strides
+        self.corners = np.array(list(itertools.product([0, 1], repeat=self.n_dims)),
+                                dtype=np.int64)
+        self.corner_offsets = self.corners.dot(self.strides)
+
+    def reset_state(self):
+        pass
+
+    def reload(self):
+        self.load()
+
+    def act(self, obs, stochastic=False):
+        x = np.asarray(obs, dtype=np.float32).reshape(-1, self.obs_dim)
+        coords = np.dot(x - self.mean, self.components.T)
+        pos = np.clip((coords - self.grid_min) / self.grid_step, 0.0, self.bins - 1)
+        base = np.minimum(pos.astype(np.int64), self.bins - 2)
+        frac = pos - base
+        idx = base.dot(self.strides)[:, None] + self.corner_offsets[None, :]
+        weights = np.prod(np.where(self.corners[None, :, :] == 1,
+                                   frac[:, None, :], 1.0 - frac[:, None, :]), axis=2)
+        action = np.sum(weights * self.table[idx], axis=1)
+        return {"act":action.reshape(-1, 1)}
+
+class TableModelAgent():
+
+    def __init__(self, model_path):
+        self.model = TableModel(model_path)
+
+    def reset(self):
+        self.model.reset_state()
+
+    def act(self, ob):
+        act_dict = self.model.act(ob.reshape(1,-1), stochastic=False)
+        return act_dict["act"][0][0]
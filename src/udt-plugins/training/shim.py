@@ -1,34 +1,134 @@
 print("Beginning module import!")
+import inspect
+import os
 import socket
+import sys
+import threading
+import time
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+grandparentdir = os.path.dirname(parentdir)
+sys.path.insert(0, grandparentdir)
+
+from common import shim_protocol, shim_ring
+from common.simple_arg_parse import arg_or_default
+
+# With --shim-transport=shm, a flow exchanges MIs and rates with a trainer on
+# the same host through the shared memory ring in common/shim_ring.py. If the
+# ring does not exist or another flow already uses it, the flow falls back to
+# the TCP connection.
+SHIM_TRANSPORT = arg_or_default("--shim-transport", "tcp")
+SHIM_PORT = arg_or_default("--shim-port", 9787)
+SHIM_RING_NAME = arg_or_default("--shim-ring-name", shim_ring.default_name(SHIM_PORT))
+
+# With a non-negative --shim-rate-deadline (in seconds), get_rate waits at
+# most that long for the trainer's next decision. If none has arrived, the
+# flow keeps sending at its most recent rate, and a background thread picks up
+# the decision whenever the trainer sends it. The trainer still gets exactly
+# one MI per decision: MIs sent at a stale rate are not reported, and the next
+# MI reported is the one measured at the late decision. The default of -1
+# blocks until the trainer replies.
+RATE_DEADLINE = arg_or_default("--shim-rate-deadline", -1.0)
+LATE_REPLY_PRINT_INTERVAL = 100
+
+def connect_to_trainer():
+    if SHIM_TRANSPORT == "shm":
+        try:
+            return shim_ring.ShimRing.attach(SHIM_RING_NAME)
+        except (FileNotFoundError, ConnectionError, ValueError) as e:
+            print("Shared memory transport unavailable (%s), using TCP" % str(e))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(("localhost", SHIM_PORT))
+    return shim_protocol.SocketChannel(sock)
 
 class PccShimDriver():
     
     flow_lookup = {}
     
     def __init__(self, flow_id):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock.connect(("localhost", 9787))
+        self.channel = connect_to_trainer()
         self.replay_rate = False
         self.last_rate = None
+
+        # State shared with the background reader in deadline mode.
+        self.cond = threading.Condition()
+        self.new_rate = None
+        self.rate_is_fresh = True
+        self.waiting_on_late_reply = False
+        self.n_stale_rates = 0
+        self.n_late_replies = 0
+        self.n_unreported_samples = 0
+        self.closing = False
+        self.reader = None
+        if RATE_DEADLINE >= 0.0:
+            self.reader = threading.Thread(target=self.read_rates, name="shim-rate-reader")
+            self.reader.daemon = True
+            self.reader.start()
         PccShimDriver.flow_lookup[flow_id] = self
     
+    def read_rates(self):
+        try:
+            while True:
+                rate = self.channel.recv_rate()
+                with self.cond:
+                    if self.waiting_on_late_reply:
+                        self.waiting_on_late_reply = False
+                        self.n_late_replies += 1
+                        if self.n_late_replies % LATE_REPLY_PRINT_INTERVAL == 0:
+                            print("Shim: %d late trainer replies, %d MIs at a stale rate"
+                                  % (self.n_late_replies, self.n_stale_rates))
+                    self.new_rate = rate
+                    self.cond.notify_all()
+        except (ConnectionError, OSError, ValueError) as e:
+            if not self.closing:
+                print("Shim: lost connection to trainer (%s)" % str(e))
+
     def get_rate(self):
         if self.replay_rate:
             return self.last_rate
         self.replay_rate = True
-        self.last_rate = float(self.sock.recv(1024).decode())
+        if RATE_DEADLINE < 0.0:
+            self.last_rate = self.channel.recv_rate()
+            return self.last_rate
+        with self.cond:
+            deadline = time.time() + RATE_DEADLINE
+            # There is nothing to fall back on before the first decision.
+            while self.new_rate is None and (self.last_rate is None or time.time() < deadline):
+                self.cond.wait(None if self.last_rate is None else deadline - time.time())
+            if self.new_rate is None:
+                self.rate_is_fresh = False
+                self.waiting_on_late_reply = True
+                self.n_stale_rates += 1
+            else:
+                self.last_rate = self.new_rate
+                self.new_rate = None
+                self.rate_is_fresh = True
         return self.last_rate
 
     def reset(self):
         pass # Nothing to reset in the shim driver.
 
+    # Stops the background reader before closing the channel it reads from.
+    def close(self):
+        if self.reader is not None:
+            self.closing = True
+            self.channel.shutdown()
+            self.reader.join()
+        self.channel.close()
+
     def give_sample(self, flow_id, bytes_sent, bytes_acked, bytes_lost,
                     send_start_time, send_end_time, recv_start_time,
                     recv_end_time, rtt_samples, packet_size, utility):
         if not self.replay_rate:
             print("Detected repeat sample! Ignoring.")
             return
-        self.sock.send(("%d;%d;%d;%d;%f;%f;%f;%f;%s;%d;%f\n" % (
+        self.replay_rate = False
+        if not self.rate_is_fresh:
+            # The trainer is still working on its next decision.
+            self.n_unreported_samples += 1
+            return
+        self.channel.send_mi(
             flow_id,
             bytes_sent,
             bytes_acked,
@@ -39,8 +139,7 @@ class PccShimDriver():
             recv_end_time,
             rtt_samples,
             packet_size,
-            utility)).encode())
-        self.replay_rate = False
+            utility)
 
     def get_by_flow_id(flow_id):
         return PccShimDriver.flow_lookup[flow_id]
@@ -71,3 +170,11 @@ def get_rate(flow_id):
 
 def init(flow_id):
     driver = PccShimDriver(flow_id)
+
+def close(flow_id):
+    driver = PccShimDriver.flow_lookup.pop(flow_id)
+    if RATE_DEADLINE >= 0.0:
+        print("Shim flow %d: %d late trainer replies, %d MIs at a stale rate, %d unreported"
+              % (flow_id, driver.n_late_replies, driver.n_stale_rates,
+                 driver.n_unreported_samples))
+    driver.close()